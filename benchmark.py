@@ -0,0 +1,402 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+Benchmark for mkgallery.py
+
+Generates synthetic input directory tree (images, fonts, PDF files, other
+files in nested directories), builds gallery from it with mkgallery.py and
+saves wall time, CPU time and peak memory of each build phase (see phase()
+in mkgallery.py) in JSON file, peak memory of phase is the largest resident
+set size of main process and worker processes during the phase (0 if unknown,
+i.e. not on Linux) and peak memory of build is the largest of its phases:
+	{
+		"revision": "git revision of mkgallery.py",
+		"python": "Python version",
+		"config": { benchmark options },
+		"args": [ mkgallery.py arguments ],
+		"runs": [
+			{
+				"wall": seconds,
+				"cpu": seconds,
+				"peak_rss_kib": KiB,
+				"phases": {
+					"scan": {"wall": seconds, "cpu": seconds, "peak_rss_kib": KiB},
+					...
+				}
+			},
+			...
+		]
+	}
+
+Each build runs in new process so builds don't share memory and state.
+Benchmark needs only Python Imaging Library (PIL) and runs offline, fonts are
+created with fontTools (if installed) or copied from system font directories.
+"""
+
+import os, sys, getopt, json, math, random, shutil, subprocess, time
+
+from PIL import Image
+
+S = os.sep
+d = os.path.dirname( os.path.abspath(sys.argv[0]) ) # path to mkgallery.py
+
+# default values:
+config = {
+	'jpeg': 200, # number of JPEG images
+	'png': 50, # number of PNG images
+	'megapixels': 2.0, # size of images
+	'fonts': 10, # number of fonts
+	'pdfs': 2, # number of PDF files
+	'pdf_pages': 20, # number of pages in each PDF file
+	'other': 20, # number of other files (not gallery items)
+	'depth': 2, # depth of directory tree
+	'dirs': 3, # number of subdirectories in each directory
+	'seed': 0 # seed for random generator
+	}
+workdir = "mkgallery-benchmark" # directory for input tree and galleries
+output = "benchmark.json" # results
+runs = 3 # number of builds
+use_cache = False # use thumbnail cache (cache is cleared before first run)
+verbose = False # show output of mkgallery.py
+
+# builds gallery in child process and writes phase_stats to file
+child_script = """
+import sys, os, json
+sys.path.insert(0, sys.argv[1])
+sys.argv[0] = os.path.join(sys.argv[1], "mkgallery.py")
+import mkgallery
+mkgallery.main(sys.argv[3:])
+f = open(sys.argv[2], "w")
+json.dump(mkgallery.phase_stats, f)
+f.close()
+"""
+
+def usage():#{{{
+	print( """\
+usage: %s [options] [-- mkgallery.py options]
+
+  Generates synthetic input directory tree, builds gallery from it
+  several times and saves time and memory used by each build phase.
+
+options:
+  -h, --help              prints this help
+  -w, --workdir=<dir>     directory for input tree, galleries and cache
+                            (default: '%s')
+  -o, --output=<file>     JSON file with results
+                            (default: '%s')
+  -n, --runs=<n>          number of builds
+                            (default: %s)
+  --jpeg=<n>              number of JPEG images
+  --png=<n>               number of PNG images
+  --megapixels=<mpx>      size of images in megapixels
+  --fonts=<n>             number of fonts
+  --pdfs=<n>              number of PDF files
+  --pdf-pages=<n>         number of pages in each PDF file
+  --other=<n>             number of other files (not gallery items)
+  --depth=<n>             depth of directory tree
+  --dirs=<n>              number of subdirectories in each directory
+  --seed=<n>              seed for random generator
+                            (defaults: %s)
+  --cache                 use thumbnail cache (only first build is uncached)
+  -v, --verbose           show output of mkgallery.py
+
+  Input tree is generated again only if its configuration changes.
+""" % (sys.argv[0], workdir, output, runs,
+		", ".join(["%s=%s" % (k, config[k]) for k in sorted(config)])) )
+#}}}
+
+def parse_args(argv):#{{{
+	""" parse switches, returns arguments for mkgallery.py """
+	global workdir, output, runs, use_cache, verbose
+
+	try:
+		opts, args = getopt.gnu_getopt(argv, "hw:o:n:v",
+				["help", "workdir=", "output=", "runs=", "cache", "verbose"] +
+				[k.replace('_', '-') + "=" for k in config])
+	except getopt.GetoptError:
+		usage()
+		sys.exit(2)
+
+	for opt, arg in opts:
+		key = opt[2:].replace('-', '_')
+		if opt in ("-h", "--help"):
+			usage()
+			sys.exit(0)
+		elif opt in ("-w", "--workdir"):
+			workdir = arg
+		elif opt in ("-o", "--output"):
+			output = arg
+		elif opt in ("-n", "--runs"):
+			try:
+				runs = max( 1, int(arg) )
+			except:
+				print("ERROR: Number of runs must be a single number!")
+				sys.exit(1)
+		elif opt == "--cache":
+			use_cache = True
+		elif opt in ("-v", "--verbose"):
+			verbose = True
+		elif key in config:
+			try:
+				config[key] = max( 0, type(config[key])(arg) )
+			except:
+				print("ERROR: Option "+opt+" must be a number!")
+				sys.exit(1)
+
+	return args
+#}}}
+
+def directories(root):#{{{
+	""" return root and all its subdirectories in generated tree """
+	dirs = [root]
+	level = [root]
+	for i in range(config['depth']):
+		level = [p +S+ "dir%d" % j for p in level for j in range(config['dirs'])]
+		dirs.extend(level)
+	return dirs
+#}}}
+
+def create_image(filename, fmt, rnd):#{{{
+	"""
+	create image with noise (photo) or few colors (drawing for PNG),
+	aspect ratio is 4:3
+	"""
+	w = max( 1, int(math.sqrt(config['megapixels']*1e6*4/3)) )
+	h = max( 1, w*3//4 )
+	if fmt == "JPEG":
+		im = Image.merge( "RGB", [Image.effect_noise( (w,h), rnd.randint(10,80) ) for i in range(3)] )
+		im.save(filename, fmt, quality=90)
+	else:
+		im = Image.new( "RGB", (w,h), (rnd.randint(0,255), rnd.randint(0,255), rnd.randint(0,255)) )
+		for i in range(10):
+			x, y = rnd.randint(0, w-1), rnd.randint(0, h-1)
+			im.paste( (rnd.randint(0,255), rnd.randint(0,255), rnd.randint(0,255)),
+					(x, y, min(w, x + w//4 + 1), min(h, y + h//4 + 1)) )
+		im.save(filename, fmt)
+#}}}
+
+def create_pdf(filename, pages):#{{{
+	""" create PDF file with text on each page """
+	objects = [
+		"<< /Type /Catalog /Pages 2 0 R >>",
+		"<< /Type /Pages /Kids [%s] /Count %d >>" %
+			(" ".join(["%d 0 R" % (4 + 2*i) for i in range(pages)]), pages),
+		"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+		]
+	for i in range(pages):
+		text = "BT /F1 48 Tf 72 700 Td (Page %d) Tj ET" % (i+1)
+		objects.append( "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+				"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2*i) )
+		objects.append( "<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text) )
+
+	data = "%PDF-1.4\n"
+	offsets = []
+	for i, obj in enumerate(objects):
+		offsets.append( len(data) )
+		data = data + "%d 0 obj\n%s\nendobj\n" % (i+1, obj)
+	xref = len(data)
+	data = data + "xref\n0 %d\n0000000000 65535 f \n" % (len(objects)+1)
+	data = data + "".join(["%010d 00000 n \n" % offset for offset in offsets])
+	data = data + "trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects)+1, xref)
+
+	f = open(filename, "wb")
+	try:
+		f.write( data.encode('ascii') )
+	finally:
+		f.close()
+#}}}
+
+def create_font(filename, name, rnd):#{{{
+	""" create TrueType font with rectangular glyphs, return False if fontTools is missing """
+	try:
+		from fontTools.fontBuilder import FontBuilder
+		from fontTools.pens.ttGlyphPen import TTGlyphPen
+	except ImportError:
+		return False
+
+	chars = "+-,0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+	names = [".notdef", "space"] + ["uni%04X" % ord(c) for c in chars]
+	cmap = dict( (ord(c), "uni%04X" % ord(c)) for c in chars )
+	cmap[32] = "space"
+
+	glyphs = {}
+	for glyph in names:
+		pen = TTGlyphPen(None)
+		if glyph != "space":
+			w, h = rnd.randint(100, 500), rnd.randint(200, 700)
+			pen.moveTo( (50, 0) )
+			pen.lineTo( (50, h) )
+			pen.lineTo( (50 + w, h) )
+			pen.lineTo( (50 + w, 0) )
+			pen.closePath()
+		glyphs[glyph] = pen.glyph()
+
+	fb = FontBuilder(1000, isTTF=True)
+	fb.setupGlyphOrder(names)
+	fb.setupCharacterMap(cmap)
+	fb.setupGlyf(glyphs)
+	fb.setupHorizontalMetrics( dict( (glyph, (600, 50)) for glyph in names ) )
+	fb.setupHorizontalHeader(ascent=800, descent=-200)
+	fb.setupNameTable( {'familyName': name, 'styleName': "Regular"} )
+	fb.setupOS2(sTypoAscender=800, sTypoDescender=-200, usWinAscent=800, usWinDescent=200)
+	fb.setupPost()
+	fb.save(filename)
+	return True
+#}}}
+
+def system_fonts():#{{{
+	""" return TrueType and OpenType fonts in system font directories """
+	fonts = []
+	for root in ("/usr/share/fonts", "/usr/local/share/fonts", os.path.expanduser("~/.fonts")):
+		for path, dirs, files in os.walk(root):
+			fonts.extend( [path +S+ f for f in sorted(files) if f.lower().endswith((".ttf", ".otf"))] )
+	return fonts
+#}}}
+
+def generate_tree(root):#{{{
+	""" generate input directory tree if it doesn't exist for current config """
+	configfile = root +S+ "config.json"
+	if os.path.exists(configfile):
+		f = open(configfile)
+		try:
+			if json.load(f) == config:
+				return
+		finally:
+			f.close()
+	if os.path.isdir(root):
+		shutil.rmtree(root)
+
+	sys.stdout.write("Generating input tree in \"" + root + "\" ... ")
+	sys.stdout.flush()
+
+	rnd = random.Random(config['seed'])
+	dirs = directories(root +S+ "input")
+	for dirpath in dirs:
+		os.makedirs(dirpath)
+
+	# files are distributed to all directories in turn
+	n = 0
+	for i in range(config['jpeg']):
+		create_image( dirs[n % len(dirs)] +S+ "photo%d.jpg" % i, "JPEG", rnd )
+		n = n+1
+	for i in range(config['png']):
+		create_image( dirs[n % len(dirs)] +S+ "drawing%d.png" % i, "PNG", rnd )
+		n = n+1
+	for i in range(config['pdfs']):
+		create_pdf( dirs[n % len(dirs)] +S+ "document%d.pdf" % i, config['pdf_pages'] )
+		n = n+1
+	for i in range(config['other']):
+		f = open( dirs[n % len(dirs)] +S+ "notes%d.txt" % i, "w" )
+		f.write("not a gallery item\n")
+		f.close()
+		n = n+1
+
+	fonts = []
+	if config['fonts']:
+		fonts = system_fonts()
+	for i in range(config['fonts']):
+		filename = dirs[n % len(dirs)] +S+ "font%d.ttf" % i
+		if not create_font(filename, "Benchmark Font %d" % i, rnd):
+			if not fonts:
+				print("\nWARNING: Fonts not created -- please install fontTools module.")
+				break
+			shutil.copyfile( fonts[i % len(fonts)], filename[:-4] + fonts[i % len(fonts)][-4:] )
+		n = n+1
+
+	f = open(configfile, "w")
+	try:
+		json.dump(config, f)
+	finally:
+		f.close()
+
+	print("DONE")
+#}}}
+
+def revision():#{{{
+	""" return git revision of mkgallery.py or None """
+	try:
+		p = subprocess.Popen(["git", "describe", "--always", "--dirty"], cwd=d,
+				stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		out = p.communicate()[0]
+	except OSError:
+		return None
+	return p.returncode == 0 and out.decode('utf-8').strip() or None
+#}}}
+
+def run(args):#{{{
+	""" build gallery in child process, return statistics of the build """
+	statsfile = workdir +S+ "stats.json"
+	if os.path.exists(statsfile):
+		os.remove(statsfile)
+
+	devnull = open(os.devnull, "w")
+	try:
+		t0 = time.time()
+		c0 = os.times()
+		res = subprocess.call( [sys.executable, "-c", child_script, d, statsfile] + args,
+				stdout=(not verbose and devnull or None) )
+		c1 = os.times()
+		t1 = time.time()
+	finally:
+		devnull.close()
+
+	if res != 0 or not os.path.exists(statsfile):
+		print("ERROR: Gallery build failed (use --verbose to see output of mkgallery.py).")
+		sys.exit(1)
+
+	f = open(statsfile)
+	try:
+		phases = json.load(f)
+	finally:
+		f.close()
+
+	return {
+		'wall': t1 - t0,
+		'cpu': (c1[2] + c1[3]) - (c0[2] + c0[3]),
+		'peak_rss_kib': max( [0] + [p['peak_rss_kib'] for p in phases.values()] ),
+		'phases': phases
+		}
+#}}}
+
+def main(argv):#{{{
+	mkargs = parse_args(argv)
+
+	if not os.path.isdir(workdir):
+		os.makedirs(workdir)
+	generate_tree(workdir)
+
+	cachedir = workdir +S+ "cache"
+	if os.path.isdir(cachedir):
+		shutil.rmtree(cachedir)
+
+	args = ["-f", "-u", "", "-d", workdir +S+ "gallery", "--cache=" + (use_cache and cachedir or "")] + \
+			mkargs + [workdir +S+ "input"]
+
+	results = []
+	for i in range(runs):
+		sys.stdout.write( "Build %d/%d ... " % (i+1, runs) )
+		sys.stdout.flush()
+		stats = run(args)
+		results.append(stats)
+		print( "%.2fs (CPU %.2fs, peak memory %d KiB)" % (stats['wall'], stats['cpu'], stats['peak_rss_kib']) )
+		for name in stats['phases']:
+			p = stats['phases'][name]
+			print( "  %-12s %8.3fs  CPU %8.3fs  peak memory %8d KiB" % (name, p['wall'], p['cpu'], p['peak_rss_kib']) )
+
+	f = open(output, "w")
+	try:
+		json.dump( {
+			'revision': revision(),
+			'python': sys.version.split()[0],
+			'config': config,
+			'args': args,
+			'runs': results
+			}, f, indent=1 )
+	finally:
+		f.close()
+
+	print("Results saved in: '"+output+"'")
+#}}}
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
@@ -157,6 +157,7 @@ Viewer: [
     [["Home","KP7","7"], "itemlist.listHome()", "Move cursor on first item in list"],
     ["n", "itemlist.nextPage()", "Next page"],
     ["b", "itemlist.prevPage()", "Previous page"],
+    [["/","f"], "itemlist.search()", "Search items (if gallery has search index)"],
 ],
 
 Help: [
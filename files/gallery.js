@@ -93,6 +93,7 @@ var configs = {
 	'slide_scroll': [100, "_General", "Slide scroll _amount"],
     'shuffle': [false, "_General", "Randomly _shuffle gallery items"],
     'transparency': ["", "_General", "Color for transparency"],
+    'update_interval': [3000, "_General", "Check for _updates of watched gallery (in milliseconds, 0: never)"],
 
 	'font_size': [16, "_Font", "font _size"],
 	'font_thumbnail_text': ['+-1234567890,<br/>abcdefghijklmnopqrstuvwxyz,<br/>ABCDEFGHIJKLMNOPQRSTUVWXYZ', "_Font", "Font t_humbnail text (HTML)"],
@@ -147,6 +148,26 @@ function esc (str) {//{{{
 	return str.replace(/#/g,'%23').replace(/\?/g,'%3F');
 }//}}}
 
+function decodeItems (data) {//{{{
+    // items generated by mkgallery.py: {items: [...], dirs: [...]}
+    // item: [directory index, filename, properties] or [] (page break)
+    var dirs, items, ls, i, item;
+
+    dirs = data.dirs;
+    items = data.items;
+    ls = [];
+    for(i=0; i<items.length; i+=1) {
+        item = items[i];
+        if (!item.length) {
+            ls.push("");
+        } else {
+            ls.push( [(item[0] >= 0 ? dirs[item[0]] : "") + item[1], item[2] ? item[2] : {}] );
+        }
+    }
+
+    return ls;
+}//}}}
+
 function createPathElements(dir_e, filename_e, ext_e, path) {//{{{
     var m, dir, filename;
 
@@ -212,6 +233,10 @@ setItems: function(ls, max_page_items)//{{{
 {
 	var item, i, len;
 
+    if ( !(ls instanceof Array) ) {
+        ls = decodeItems(ls);
+    }
+
     this.pages = 1;
 	for(i=0, len=0; i<ls.length; i+=1) {
 		item = ls[i];
@@ -234,6 +259,90 @@ setItems: function(ls, max_page_items)//{{{
 	}
 },//}}}
 
+/**
+ * \fn setPages(pages)
+ * \brief items are loaded from "items-page-<n>.js" only when needed
+ * \param pages list of pages (number of items and title of each page)
+ */
+setPages: function(pages)//{{{
+{
+    var i, j;
+
+    this.pages = pages.length;
+    this.page_start = [];
+    this.page_loaded = [];
+    this.page_callbacks = [];
+
+    // items are unknown until the page is loaded
+    for(i=0; i<pages.length; i+=1) {
+        this.page_start.push(this.items.length);
+        for(j=0; j<pages[i].n; j+=1) {
+            this.items.push([null, {page_: i+1}]);
+        }
+    }
+},//}}}
+
+loaded: function(i)//{{{
+{
+    return i < 0 || i >= this.length() || this.items[i][0] !== null;
+},//}}}
+
+loadPage: function(page, callback)//{{{
+{
+    var callbacks, script;
+
+    if ( !this.page_start || page < 1 || page > this.page_start.length ||
+         this.page_loaded[page] ) {
+        if (callback) {
+            callback();
+        }
+        return;
+    }
+
+    // page is already loading
+    callbacks = this.page_callbacks[page];
+    if (callbacks) {
+        if (callback) {
+            callbacks.push(callback);
+        }
+        return;
+    }
+    this.page_callbacks[page] = callback ? [callback] : [];
+
+    // script calls itemsPage() (works with "file://" protocol)
+    script = document.createElement("script");
+    script.src = "items-page-" + page + ".js";
+    document.getElementsByTagName("head")[0].appendChild(script);
+},//}}}
+
+setPage: function(page, list)//{{{
+{
+    var i, item, start, callbacks;
+
+    if ( !(list instanceof Array) ) {
+        list = decodeItems(list);
+    }
+
+    start = this.page_start[page-1];
+    for(i=0; i<list.length; i+=1) {
+        item = list[i];
+        if ( !(item instanceof Array) ) {
+            item = [item,{}];
+        } else if (item.length < 2) {
+            item.push({});
+        }
+        item[1].page_ = page;
+        this.items[start+i] = item;
+    }
+    this.page_loaded[page] = true;
+
+    callbacks = this.page_callbacks[page];
+    delete this.page_callbacks[page];
+    for(i=0; callbacks && i<callbacks.length; i+=1) {
+        callbacks[i]();
+    }
+},//}}}
+
 length: function()//{{{
 {
 	return this.items.length;
@@ -245,7 +354,10 @@ get: function(i)//{{{
 
     if ( i < this.length() ) {
         res = this.items[i];
-        if ( storage && res[0].search(/^data:[a-z]+\/[a-z]+;/) === 0 ) {
+        if ( res[0] === null ) {
+            // page not loaded
+            return ['', res[1]];
+        } else if ( storage && res[0].search(/^data:[a-z]+\/[a-z]+;/) === 0 ) {
             // get data URL from localStorage
             key = res[0].split(';:');
             return [storage[key[1]], res[1]];
@@ -270,6 +382,10 @@ shuffle: function ()//{{{
     var items, tmp, i, j;
     items = this.items;
 
+    for(i=0; i<items.length; i+=1) {
+        items[i][1].index_ = i;
+    }
+
     i = this.length();
     while(i>0) {
         j = Math.floor( Math.random() * i );
@@ -278,6 +394,18 @@ shuffle: function ()//{{{
         items[j] = items[i];
         items[i] = tmp;
     }
+
+    // new positions of items (see position())
+    this.positions = [];
+    for(i=0; i<items.length; i+=1) {
+        this.positions[ items[i][1].index_ ] = i;
+    }
+},//}}}
+
+position: function (i)//{{{
+{
+    // current position of i-th item in gallery (items can be shuffled)
+    return this.positions ? this.positions[i] : i;
 },//}}}
 
 clear: function ()//{{{
@@ -295,13 +423,136 @@ append: function (url, props)//{{{
 });
 //}}}
 
+//! \class SearchIndex
+//{{{
+/**
+ * \brief sorted words in gallery items and numbers of items containing each
+ * word (see write_search_index() in "mkgallery.py")
+ */
+var SearchIndex = Class({
+init: function (data) {//{{{
+    this.count = data.count;
+    this.terms = data.terms;
+    // increasing item numbers stored as differences to previous number
+    this.items = data.items;
+    // item numbers for words in last query (typed query changes gradually)
+    this.cache = {};
+},//}}}
+
+lookup: function (word)//{{{
+{
+    // sorted numbers of items containing a word which starts with given word
+    var terms, lo, hi, mid, res, found, i, j, k, list;
+
+    // first word not less than given word
+    terms = this.terms;
+    lo = 0;
+    hi = terms.length;
+    while (lo < hi) {
+        mid = (lo+hi) >> 1;
+        if (terms[mid] < word) {
+            lo = mid+1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    for(hi=lo; hi<terms.length && terms[hi].substring(0, word.length) === word; hi+=1);
+
+    // numbers of single word
+    res = [];
+    if (hi === lo+1) {
+        list = this.items[lo];
+        for(j=0, k=0; j<list.length; j+=1) {
+            k += list[j];
+            res.push(k);
+        }
+        return res;
+    }
+
+    // mark items containing any of the words (faster than sorting)
+    found = new Uint8Array(this.count+1);
+    for(i=lo; i<hi; i+=1) {
+        list = this.items[i];
+        for(j=0, k=0; j<list.length; j+=1) {
+            k += list[j];
+            found[k] = 1;
+        }
+    }
+    for(k=1; k<found.length; k+=1) {
+        if (found[k]) {
+            res.push(k);
+        }
+    }
+
+    return res;
+},//}}}
+
+find: function (query)//{{{
+{
+    // sorted numbers of items containing all words in query
+    // (or null if query has no words)
+    var words, word, cache, lists, res, list, i, lo, hi, mid;
+
+    words = query.toLowerCase().split(/[\s!-\/:-@\[-`{-~]+/);
+    cache = {};
+    lists = [];
+    for(i=0; i<words.length; i+=1) {
+        word = words[i];
+        if (word && !cache[word]) {
+            list = cache[word] = this.cache[word] || this.lookup(word);
+            lists.push(list);
+        }
+    }
+    this.cache = cache;
+
+    if (!lists.length) {
+        return null;
+    }
+
+    // intersection of sorted lists starting with shortest list,
+    // numbers are looked up in much longer lists by binary search
+    lists.sort( function (a, b) {return a.length-b.length;} );
+    res = lists[0];
+    for(i=1; i<lists.length && res.length; i+=1) {
+        list = lists[i];
+        lo = 0;
+        if ( res.length*16 < list.length ) {
+            res = res.filter( function (n) {
+                hi = list.length;
+                while (lo < hi) {
+                    mid = (lo+hi) >> 1;
+                    if (list[mid] < n) {
+                        lo = mid+1;
+                    } else {
+                        hi = mid;
+                    }
+                }
+                return list[lo] === n;
+            } );
+        } else {
+            res = res.filter( function (n) {
+                while (list[lo] < n) {
+                    lo += 1;
+                }
+                return list[lo] === n;
+            } );
+        }
+    }
+
+    return res;
+}//}}}
+});
+//}}}
+
 //! \interface ItemView
 //{{{
 var ItemView = Interface({
 /**
- * \fn init(itempath, parent)
+ * \fn init(itempath, parent, props)
  * \param itempath item filename
  * \param parent item parent (Viewer)
+ * \param props item properties (optional)
  */
 
 /** \fn type()
@@ -383,9 +634,18 @@ thumbnailOnLoad: function (error){}
 //! \implements ItemView
 //{{{
 var ImageView = Class(ItemView, {
-init: function (imgpath, parent) {
+init: function (imgpath, parent, props) {
+    var size = props ? props['.original_size'] : null;
+
     this.path = imgpath;
     this.parent = parent;
+    this.props = props ? props : {};
+
+    // image size is known before the image is loaded
+    if (size) {
+        this.orig_width = this.width = size[0];
+        this.orig_height = this.height = size[1];
+    }
 },
 
 type: function ()//{{{
@@ -435,6 +695,8 @@ element: function()//{{{
         self.orig_width = self.width = this.width ? this.width : this.naturalWidth;
         self.orig_height = self.height = this.height ? this.height : this.naturalHeight;
         self.loaded = true;
+        // redraw image even if it was already zoomed
+        self.zoom_factor = undefined;
 
         if ( self.visible ) {
             self.parent.onUpdateStatus(null);
@@ -463,11 +725,26 @@ show: function ()//{{{
 
 thumbnail: function ()//{{{
 {
+    var sprite, size;
+
+    // thumbnail is part of sprite sheet
+    sprite = this.props['.sprite'];
+    size = this.props['.thumbnail_size'];
+    if ( !this.thumb && sprite && size ) {
+        this.thumb = $('<div>', {'class': "thumbnail " + this.type()}).css({
+                width: size[0] + "px",
+                height: size[1] + "px",
+                background: "url('" + esc(sprite[0]) + "') -" + sprite[1] + "px -" + sprite[2] + "px no-repeat"
+            });
+        this.thumbnailOnLoad();
+    }
+
     if ( !this.thumb ) {
         var thumbpath, thumb, t;
         thumbpath = this.path.replace(/:/g,'_');
         if ( !getConfig('use_svg_thumbnails') || this.path.search(/\.svg$/i) == -1 ) {
-            thumbpath = "thumbs/" + thumbpath + ".png";
+            thumbpath = "thumbs/" + thumbpath + this.thumbnailSuffix() + "." +
+                (this.props['.thumbnail_ext'] || "png");
         }
 
         thumb = this.thumb = $("<img>", {'class': "thumbnail " + this.type()});
@@ -480,6 +757,37 @@ thumbnail: function ()//{{{
     return this.thumb;
 },//}}}
 
+/** \fn thumbnailSuffix()
+ * \return suffix of the smallest thumbnail file which fills thumbnail size
+ *         on current display ("@<resolution>" or "" for default thumbnail)
+ */
+thumbnailSuffix: function ()//{{{
+{
+    var res, size, orig, need, best, best_px, px, i;
+
+    res = this.props['.thumbnail_resolutions'];
+    size = this.props['.thumbnail_size'];
+    if (!res || !size) {
+        return "";
+    }
+
+    orig = this.props['.original_size'];
+    need = Math.max(size[0], size[1]) * (window.devicePixelRatio || 1);
+
+    best = "";
+    best_px = Math.max(size[0], size[1]);
+    for (i=0; i<res.length; i+=1) {
+        px = orig ? Math.min( res[i], Math.max(orig[0], orig[1]) ) : res[i];
+        // smallest thumbnail bigger than needed or the biggest one
+        if ( best_px < need ? px > best_px : (px >= need && px < best_px) ) {
+            best = "@" + res[i];
+            best_px = px;
+        }
+    }
+
+    return best;
+},//}}}
+
 sharpen: function(strength)//{{{
 {
     if (this.use_canvas) {
@@ -609,9 +917,11 @@ zoom: function (z)//{{{
         this.height = this.e[0].height = Math.ceil(h*z);
 
         // redraw image
-        this.ctx.drawImage(this.img[0],0,0,this.width,this.height);
+        if (this.loaded || !this.use_canvas) {
+            this.ctx.drawImage(this.img[0],0,0,this.width,this.height);
+        }
 
-        if (this.use_canvas) {
+        if (this.use_canvas && this.loaded) {
             // apply filters
             // get other filters: http://www.pixastic.com/lib/download/
             sharpen = this.parent.getConfig('sharpen');
@@ -637,10 +947,19 @@ zoom: function (z)//{{{
 //! \implements ItemView
 //{{{
 var VideoView = Class(ItemView, {
-init: function (vidpath, parent) {
+init: function (vidpath, parent, props) {
+    var size = props ? props['.original_size'] : null;
+
     this.path = vidpath;
     this.parent = parent;
+    this.props = props || {};
     this.zoom_factor = 1;
+
+    // video size is known before the video is loaded
+    if (size) {
+        this.orig_width = this.width = size[0];
+        this.orig_height = this.height = size[1];
+    }
 },
 
 type: function ()//{{{
@@ -664,6 +983,10 @@ element: function()//{{{
         .addClass("videoview")
         .attr("id","video");
 
+    if ( this.props['.poster'] ) {
+        e.attr( "poster", esc(this.props['.poster']) );
+    }
+
     self = this;
     e.bind('canplay', function () {
         var s, m;
@@ -794,6 +1117,17 @@ togglePlay: function ()//{{{
 seek: function (how) {//{{{
     this.e[0].currentTime += how;
 },//}}}
+
+thumbnail: function ()//{{{
+{
+    // thumbnail is created from poster frame
+    if ( this.props['.thumbnail_size'] ) {
+        return ImageView.prototype.thumbnail.call(this);
+    }
+    return ItemView.prototype.thumbnail.call(this);
+},//}}}
+
+thumbnailSuffix: ImageView.prototype.thumbnailSuffix
 });
 //}}}
 
@@ -848,7 +1182,9 @@ thumbnail: function ()//{{{
 
     if ( !thumb ) {
         thumb = this.thumb = $('<div>', {'class': "thumbnail " + this.type(), html: this.parent.getConfig('font_thumbnail_text')});
-        thumb.css("font-family",this.font);
+        // font subset (if available) contains only characters in thumbnail,
+        // full font is downloaded only for missing characters
+        thumb.css("font-family", "thumb_" + this.font + "," + this.font);
 
         this.thumbnailOnLoad();
     }
@@ -1095,15 +1431,15 @@ init: function (parent) {
     this.parent = parent;
 },
 
-newView: function (filepath) {//{{{
+newView: function (filepath, props) {//{{{
      var view;
 
     if (filepath.search(/\.(png|jpg|gif|svg)$|^data:image\/[a-z]+;/i) > -1) {
-        view = new ImageView(filepath, this.parent);
+        view = new ImageView(filepath, this.parent, props);
     } else if (filepath.search(/\.(ttf|otf)$/i) > -1) {
         view = new FontView(filepath, this.parent);
     } else if (filepath.search(/\.(mp4|mov|flv|ogg|mp3|wav)$/i) > -1) {
-        view = new VideoView(filepath, this.parent);
+        view = new VideoView(filepath, this.parent, props);
     } else if (filepath.search(/\.(html|pdf)$/i) > -1) {
         view = new HTMLView(filepath, this.parent);
     } else if (filepath.search(/^\$\(<.*\)$/) > -1) {
@@ -1393,7 +1729,7 @@ center: function ()//{{{
     });
 },//}}}
 
-show: function (filepath)//{{{
+show: function (filepath, props)//{{{
 {
     var self, v, c;
 
@@ -1402,7 +1738,7 @@ show: function (filepath)//{{{
     }
 
     // retrieve view from cache (or create view)
-    c = this.preload(filepath);
+    c = this.preload(filepath, props);
 	if (c) {
 		this.view = v = c.view;
 		c.age = this.cache_age;
@@ -1420,12 +1756,17 @@ show: function (filepath)//{{{
             }
         };
         v.show();
+
+        // resize view before it's loaded if the original size is known
+        if (!v.loaded && v.orig_width) {
+            this.zoom();
+        }
     } else if (this.onError) {
         this.onError("Unknown format: \""+filepath+"\"");
     }
 },//}}}
 
-preload: function(filepath)//{{{
+preload: function(filepath, props)//{{{
 {
     var cache, age, c, v, f, min_age;
 
@@ -1448,7 +1789,7 @@ preload: function(filepath)//{{{
             }
         }
 
-        v = this.viewFactory.newView(filepath);
+        v = this.viewFactory.newView(filepath, props);
 		if (v) {
 			c = cache[filepath] = {view: v, age: age};
 
@@ -1614,6 +1955,16 @@ init: function (elem, items, getConfig) {
     this.selected = this.last = this.first = 0;
     this.selection_needs_update = true;
 
+    // search box (see search())
+    if (search_index) {
+        this.search_edit = new TextEdit("Search:", "", false);
+        this.search_edit.e.addClass("search").hide();
+        this.search_edit.e.insertAfter( elem.children(".selection") );
+        this.search_edit.edit.keyup( this.filter.bind(this) );
+    }
+    // sorted positions of items found by search (null: show all items)
+    this.matches = null;
+
     this.lastpos = [0,0];
 
     this.viewFactory = new ViewFactory(this);
@@ -1644,7 +1995,7 @@ addThumbnail: function (i)//{{{
     if (thumb_e.length) {
         item = this.ls.get(i);
 
-        thumb = this.viewFactory.newView(item[0]);
+        thumb = this.viewFactory.newView(item[0], item[1]);
 
         thumb.thumbnailOnLoad = function (error) {
 			if (error === true) {
@@ -1660,7 +2011,7 @@ addThumbnail: function (i)//{{{
 
 newItem: function (i,props)//{{{
 {
-    var self, e, item, itemname, tags, size, w, h, key;
+    var self, e, item, itemname, tags, size, w, h, key, placeholder;
 
     // image identification
     e = this.e_ident;
@@ -1700,6 +2051,13 @@ newItem: function (i,props)//{{{
         e.css({ "display": w||h ? "" : "none",
                 "width": w ? w+"px" : "",
                 "height": h ? h+"px" : "" });
+
+        // color or tiny image (scaled up) is shown until thumbnail is loaded
+        placeholder = tags['.placeholder'] || "";
+        e.css({ "background-color": placeholder.charAt(0) === "#" ? placeholder : "",
+                "background-image": placeholder.search(/^data:/) === 0 ?
+                    "url(" + placeholder + ")" : "",
+                "background-size": "100% 100%" });
     }
 
     // clone item
@@ -1736,24 +2094,190 @@ newItem: function (i,props)//{{{
 
 nextPage: function()//{{{
 {
-	if (this.last+1 === this.length()) {
+    var i = this.last+1;
+
+    // skip pages without found items
+    if (this.matches) {
+        i = this.matches[ this.findMatch(i) ];
+        if (i === undefined) {
+            return;
+        }
+    }
+
+	if (i === this.length()) {
 		return;
 	}
 	this.toggle();
-	this.selectItem(this.last+1, true);
+	this.selectItem(i, true);
 	this.toggle();
 },//}}}
 
 prevPage: function()//{{{
 {
-	if (this.first === 0) {
+    var i = this.first-1;
+
+    // skip pages without found items
+    if (this.matches) {
+        i = this.findMatch(this.first)-1;
+        i = i >= 0 ? this.matches[i] : -1;
+    }
+
+	if (i < 0) {
 		return;
 	}
 	this.toggle();
-	this.selectItem(this.first-1, true);
+	this.selectItem(i, true);
 	this.toggle();
 },//}}}
 
+search: function ()//{{{
+{
+    // show and focus search box
+    var edit = this.search_edit;
+    if (!edit) {
+        return false;
+    }
+
+    edit.show();
+    edit.edit[0].focus();
+    this.updateSelection();
+    return true;
+},//}}}
+
+filter: function ()//{{{
+{
+    // show only items containing all words in search box
+    var self, query;
+
+    query = this.search_edit.edit.val();
+    if (query === this.query) {
+        return;
+    }
+    this.query = query;
+
+    if ( !$.trim(query) ) {
+        this.setMatches(null);
+        return;
+    }
+
+    // search index is loaded with first search
+    self = this;
+    loadSearchIndex( function (index) {
+        if (query === self.query) {
+            self.setMatches( index.find(query) );
+        }
+    } );
+},//}}}
+
+setMatches: function (numbers)//{{{
+{
+    // show only items with given numbers (null: show all items)
+    var ls, matches, i, k;
+
+    ls = this.ls;
+    matches = null;
+    if (numbers) {
+        matches = [];
+        for(i=0; i<numbers.length; i+=1) {
+            matches.push( ls.position(numbers[i]-1) );
+        }
+        if (ls.positions) {
+            matches.sort( function (a, b) {return a-b;} );
+        }
+    }
+    this.matches = matches;
+
+    if (!this.items) {
+        return;
+    }
+    this.hideUnmatched();
+
+    // select found item on current page or go to page with nearest found item
+    i = this.selected;
+    if ( matches && matches.length && !this.visible(i) ) {
+        k = this.findMatch(this.first);
+        if ( k < matches.length && matches[k] <= this.last ) {
+            i = matches[k];
+        } else {
+            k = this.findMatch(i);
+            i = matches[ Math.min(k, matches.length-1) ];
+            this.toggle();
+            this.selectItem(i, true);
+            this.toggle();
+            this.search_edit.edit[0].focus();
+            return;
+        }
+    }
+
+    // items moved
+    this.selectItem(i);
+    this.updateSelection();
+},//}}}
+
+findMatch: function (i)//{{{
+{
+    // index of first found item at position i or later
+    var matches, lo, hi, mid;
+
+    matches = this.matches;
+    lo = 0;
+    hi = matches.length;
+    while (lo < hi) {
+        mid = (lo+hi) >> 1;
+        if (matches[mid] < i) {
+            lo = mid+1;
+        } else {
+            hi = mid;
+        }
+    }
+
+    return lo;
+},//}}}
+
+visible: function (i)//{{{
+{
+    // item (or page navigation) at position i is not hidden by search
+    var k;
+
+    if (!this.matches) {
+        return true;
+    }
+
+    // previous and next page navigation
+    if (i < this.first) {
+        return this.findMatch(this.first) > 0;
+    }
+    k = this.findMatch(i);
+    if (i > this.last) {
+        return k < this.matches.length;
+    }
+
+    return this.matches[k] === i;
+},//}}}
+
+nextVisible: function (i, direction)//{{{
+{
+    // first item from position i in given direction not hidden by search
+    while ( this.items[i] && !this.visible(i) ) {
+        i += direction;
+    }
+    return i;
+},//}}}
+
+hideUnmatched: function ()//{{{
+{
+    var items, i;
+
+    items = this.items;
+    for (i in items) {
+        if ( this.visible(parseInt(i, 10)) ) {
+            items[i].show();
+        } else {
+            items[i].hide();
+        }
+    }
+},//}}}
+
 appendItems: function ()//{{{
 {
     var e, ee, ls, items, i, page, item, t;
@@ -1802,6 +2326,11 @@ appendItems: function ()//{{{
 		ee.hide()
 	}
 
+    // items not found by search
+    if (this.matches) {
+        this.hideUnmatched();
+    }
+
     e.css("display","");
 },//}}}
 
@@ -1843,12 +2372,25 @@ toggle: function ()//{{{
     }
 
     page = this.ls.page(this.selected);
+
+    // load items on the page first
+    if ( !this.ls.loaded(this.selected) ) {
+        self = this;
+        this.ls.loadPage( page, function () {self.toggle();} );
+        return true;
+    }
+
 	if ( !this.items || this.selection_needs_update && this.page !== page ) {
 		this.createList();
     }
 
     this.e.toggleClass("focused");
 
+    // keys are not sent to search box of hidden list
+    if ( this.hidden() && this.search_edit ) {
+        this.search_edit.edit.blur();
+    }
+
     if ( !this.hidden() ) {
         self = this;
 		window.setTimeout(function (){
@@ -1958,7 +2500,7 @@ selectItem: function (i, globally)//{{{
 
 listVertically: function (direction)//{{{
 {
-    var sel, pos, x, y, ny, dist, newdist, i, it, e, len;
+    var sel, pos, x, y, ny, dist, newdist, i, it, e, len, found;
 
     sel = this.items[this.selected];
     pos = sel.position();
@@ -1976,6 +2518,9 @@ listVertically: function (direction)//{{{
 		if (!e) {
 			break;
 		}
+        if ( !this.visible(i) ) {
+            continue;
+        }
         pos = e.position();
 
         if ( newdist === null ) {
@@ -1994,6 +2539,7 @@ listVertically: function (direction)//{{{
         }
 
         dist = newdist;
+        found = i;
     }
 
     // no new line encountered
@@ -2002,7 +2548,7 @@ listVertically: function (direction)//{{{
     }
 
     // select new
-    this.selectItem(i-direction);
+    this.selectItem(found);
 },//}}}
 
 listDown: function ()//{{{
@@ -2018,7 +2564,7 @@ listUp: function ()//{{{
 listRight: function ()//{{{
 {
     // select next
-    var i = this.selected+1;
+    var i = this.nextVisible(this.selected+1, 1);
     if ( !this.items[i] ) {
         return;
     }
@@ -2030,7 +2576,7 @@ listRight: function ()//{{{
 listLeft: function ()//{{{
 {
     // select next
-    var i = this.selected-1;
+    var i = this.nextVisible(this.selected-1, -1);
     if ( !this.items[i] ) {
         return;
     }
@@ -2041,12 +2587,12 @@ listLeft: function ()//{{{
 
 listHome: function()//{{{
 {
-	this.selectItem(this.first);
+	this.selectItem( this.nextVisible(this.first, 1) );
 },//}}}
 
 listEnd: function()//{{{
 {
-	this.selectItem(this.last);
+	this.selectItem( this.nextVisible(this.last, -1) );
 },//}}}
 
 listPageDown: function ()//{{{
@@ -2057,10 +2603,11 @@ listPageDown: function ()//{{{
     i = this.selected+1;
 	items = this.items;
     len = this.length();
-    while ( i < len && items[i] && min_pos > items[i].offset().top ) {
+    while ( i < len && items[i] &&
+            (!this.visible(i) || min_pos > items[i].offset().top) ) {
         i += 1;
     }
-    this.selectItem(i-1);
+    this.selectItem( this.nextVisible(i-1, -1) );
 },//}}}
 
 listPageUp: function ()//{{{
@@ -2070,10 +2617,11 @@ listPageUp: function ()//{{{
     min_pos = this.selection.offset().top-window.innerHeight;
     i = this.selected;
 	items = this.items;
-    while ( i > 0 && items[i] && min_pos < this.items[i].offset().top ) {
+    while ( i > 0 && items[i] &&
+            (!this.visible(i) || min_pos < this.items[i].offset().top) ) {
         i -= 1;
     }
-    this.selectItem(i+1);
+    this.selectItem( this.nextVisible(i+1, 1) );
 },//}}}
 
 submit: function()//{{{
@@ -2304,6 +2852,11 @@ var config_strict = {};
 var controls = {};
 var events = {};
 var ls = {}; // gallery items
+var item_pages; // pages loaded from separate files (see Items.setPages())
+var search_index; // items can be searched (see loadSearchIndex())
+var search; // SearchIndex loaded from "search-index.js"
+var search_callbacks; // functions waiting for search index
+var font_thumbnail_text; // characters in font subsets (see "mkgallery.py")
 var title;   // gallery title
 
 // url variables
@@ -2610,7 +3163,9 @@ function preloadViews()//{{{
     for(i = n; i < end; i+=1) {
         item = ls.get(i);
         filename = item[0];
-        viewer.preload(filename);
+        if (filename) {
+            viewer.preload(filename, item[1]);
+        }
     }
 }//}}}
 
@@ -2651,7 +3206,7 @@ function scrollRight(how)//{{{
 
 function go (i)//{{{
 {
-    var newn, r, item, itemname, props;
+    var newn, r, item, itemname, props, page;
 
     $('#read_area').remove();
 
@@ -2660,6 +3215,12 @@ function go (i)//{{{
     }
     newn = getPage(i);
 
+    // load items on the page first
+    if ( !ls.loaded(newn-1) ) {
+        ls.loadPage( ls.page(newn-1), function () {go(i);} );
+        return;
+    }
+
     // FIXME: fix memory leaks!!!
     // reload window on every nth item
     r = getConfig('reload_every');
@@ -2693,7 +3254,12 @@ function go (i)//{{{
 	props = item[1];
 
     updateInfo(itemname, n, props);
-    viewer.show(itemname);
+    viewer.show(itemname, props);
+
+    // prefetch neighbouring pages
+    page = ls.page(n-1);
+    ls.loadPage(page-1);
+    ls.loadPage(page+1);
 
     updateTitle();
 	updateUrl(1000);
@@ -4443,8 +5009,16 @@ function onLoad ()//{{{
     // get URL variables
     vars = getUrlVars();
 
+    // default text of font thumbnails from "items.js" (new line is line break)
+    if (font_thumbnail_text) {
+        configs.font_thumbnail_text[0] = $('<div>').text(font_thumbnail_text).html().replace(/\n/g, "<br/>");
+    }
+
 	// change ls from array to object
 	ls = new Items( ls, getConfig('max_page_items') );
+    if (item_pages) {
+        ls.setPages(item_pages);
+    }
 
     // user storage
     if (localStorage) {
@@ -4452,8 +5026,8 @@ function onLoad ()//{{{
         restoreItems();
     }
 
-    // shuffle items
-    if ( getConfig('shuffle') ) {
+    // shuffle items (not possible if pages are loaded later)
+    if ( getConfig('shuffle') && !item_pages ) {
         ls.shuffle();
     }
 
@@ -4523,9 +5097,82 @@ function onLoad ()//{{{
         window.addEventListener('drop', fileDropped, false);
     }
 
+    // gallery is updated by "mkgallery.py --watch"
+    if ( typeof items_version !== "undefined" && getConfig('update_interval') ) {
+        window.setInterval( checkItemsVersion, getConfig('update_interval') );
+    }
+
     init_GUI();
 }//}}}
 
+function itemsPage (page, list)//{{{
+{
+    // called from "items-page-<n>.js"
+    ls.setPage(page, list);
+}//}}}
+
+function loadSearchIndex (callback)//{{{
+{
+    // callback is called with SearchIndex after "search-index.js" is loaded
+    var script;
+
+    if (search) {
+        callback(search);
+        return;
+    }
+
+    // index is already loading
+    if (search_callbacks) {
+        search_callbacks.push(callback);
+        return;
+    }
+    search_callbacks = [callback];
+
+    // script calls searchIndex() (works with "file://" protocol)
+    script = document.createElement("script");
+    script.src = "search-index.js";
+    script.onerror = function () {
+        // try again with next search
+        search_callbacks = undefined;
+        $(script).remove();
+    };
+    document.getElementsByTagName("head")[0].appendChild(script);
+}//}}}
+
+function searchIndex (data)//{{{
+{
+    // called from "search-index.js"
+    var callbacks, i;
+
+    search = new SearchIndex(data);
+
+    callbacks = search_callbacks;
+    search_callbacks = undefined;
+    for(i=0; callbacks && i<callbacks.length; i+=1) {
+        callbacks[i](search);
+    }
+}//}}}
+
+function checkItemsVersion ()//{{{
+{
+    // script calls itemsVersion() (works with "file://" protocol)
+    var script = document.createElement("script");
+    script.src = "items-version.js?" + new Date().getTime();
+    script.onload = script.onerror = function () {
+        $(script).remove();
+    };
+    document.getElementsByTagName("head")[0].appendChild(script);
+}//}}}
+
+function itemsVersion (version)//{{{
+{
+    // called from "items-version.js" -- items of watched gallery changed
+    if (version !== items_version) {
+        updateUrl();
+        location.reload();
+    }
+}//}}}
+
 function onReady ()//{{{
 {
     // window elements are hidden before inicialization
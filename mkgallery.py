@@ -25,29 +25,62 @@ Function create_gallery() returns list of items. The list format is:
 				# path to the original file
 				".link": "link to original filename",
 				# thumbnail size (see description below)
-				".thumbnail_size": [width, height]
+				".thumbnail_size": [width, height],
+				# thumbnail file extension if it's not "png"
+				".thumbnail_ext": "jpg",
+				# color or data URL of tiny image shown before thumbnail
+				# is loaded (see --placeholder)
+				".placeholder": "#rrggbb",
+				# poster image of video
+				".poster": "thumbs/items/video.mp4.poster.jpg",
+				# size of image or video read from file header
+				".original_size": [width, height],
+				# date and camera from EXIF data (see --search-exif)
+				".date": "YYYY-MM-DD HH:MM:SS",
+				".camera": "camera model"
 			}
 		...
 	}
 
-Function write_items() saves the list in JavaScript format:
-var ls = [
-	[ "item",
-		{
-			".alias": "item alias",
-			".link": "link to original filename",
-			".thumbnail_size": [width, height],
-		}
+Function write_items() saves the list as JSON text with directories stored
+only once (items refer to the directories by index, empty list is page break):
+var ls = JSON.parse('{
+	"items": [
+		[ directory_index, "filename",
+			{
+				".alias": "item alias",
+				".link": "link to original filename",
+				".thumbnail_size": [width, height],
+			}
+		],
+		[],
+		...
 	],
-	...
-]
+	"dirs": [ "items/directory/", ... ]
+}');
 
 Creating thumbnails can take a long time to complete therefore if user wants to
 view the gallery, the list of items is saved before without ".thumbnail_size"
 property and the thumbnails are generated afterwards.
 """
 
-import os, sys, re, shutil, glob, getopt, locale, codecs, subprocess
+import os, sys, re, shutil, glob, getopt, locale, codecs, subprocess, json, shlex
+import multiprocessing, hashlib, struct, io, collections, time, heapq, select, tempfile, array
+import base64
+from multiprocessing.pool import ThreadPool
+
+# reflinks (FICLONE ioctl) are supported only on Linux
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+FICLONE = 0x40049409
+
+# os.scandir() is available in Python 3.5 and newer
+try:
+	from os import scandir
+except ImportError:
+	scandir = None
 
 has_python3 = sys.version[0] == '3'
 
@@ -55,9 +88,26 @@ has_python3 = sys.version[0] == '3'
 has_pil = True
 try:
 	from PIL import Image, ImageFont, ImageDraw, ImageChops
+	# Image.ANTIALIAS was removed in newer versions of PIL (Pillow)
+	ANTIALIAS = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
 except ImportError:
 	has_pil = False
 
+# fontTools (subsets of fonts for thumbnails)
+try:
+	from fontTools import subset as fontsubset
+	# don't print warnings about dropped font tables
+	import logging
+	logging.getLogger("fontTools").setLevel(logging.ERROR)
+	try:
+		# WOFF2 compression needs brotli
+		import brotli
+		font_subset_format = "woff2"
+	except ImportError:
+		font_subset_format = "woff"
+except ImportError:
+	fontsubset = None
+
 S = os.sep
 # input/argument encoding
 Locale = locale.getdefaultlocale()[1]
@@ -65,15 +115,53 @@ Locale = locale.getdefaultlocale()[1]
 # default values:
 title="default" # html title and gallery directory name
 resolution = 300 # thumbnail resolution
+thumbnail_resolutions = [] # resolutions of additional thumbnails
 d = os.path.dirname(sys.argv[0]) or "." # path to template
 home = 'HOME' in os.environ and os.environ['HOME'] or os.environ['HOMEDRIVE']+os.environ['HOMEPATH']+S+"My Documents"
 gdir = home +S+ "Galleries" +S+ "%s"; # path to gallery
 url = "file:///<path_to_gallery>/index.html" # browser url
 progress_len = 40 # progress bar length
+progress_mode = "bar" # progress output: bar, json (event per line) or none
+event_output = None # stream for events, other output goes to stderr (see redirect_output())
+stats = False # print statistics of build phases and slowest items?
+stats_file = "" # JSON file for statistics (empty: don't save statistics)
+slowest = 10 # number of slowest items listed for each build phase
+profile_file = "" # cProfile statistics of main process (empty: don't profile)
+batch_file = "" # JSON file with arguments of galleries to build (see --batch)
+watch = False # update gallery whenever files change?
+watch_delay = 2.0 # seconds without changes before gallery is updated
+watch_poll = 0.0 # interval for checking files (0: use inotify if available)
+jobs = 0 # number of parallel jobs (0: number of CPUs)
+scan_threads = 0 # number of threads for scanning directories (0: no threads)
+# thumbnail cache shared by all galleries (empty string disables cache)
+cachedir = os.environ.get('XDG_CACHE_HOME', home +S+ ".cache") +S+ "mkgallery" +S+ "thumbs"
+cache_size = 512 # maximal size of thumbnail cache in MiB
+cache_hash = False # identify cached thumbnails by file content?
+# files with same content: none (process each file), keep (process first file
+# and share results with its copies) or collapse (remove copies from gallery)
+dedup_mode = "none"
+prune_cache = False # only prune thumbnail cache?
+# decode JPEG images in lower resolution or use EXIF thumbnail?
+fast_thumbnails = True
+# thumbnail format: png, jpeg, webp or auto (see thumbnail_encoder())
+thumb_format = "png"
+thumb_bytes = 0 # maximal size of thumbnail file in bytes (0: unlimited)
+thumb_quality = 85 # quality of JPEG and WebP thumbnails
+# placeholder shown in item list before thumbnail is loaded: none, color
+# (dominant color) or image (tiny image, see thumbnail_placeholder())
+placeholder = "none"
+placeholder_size = 16 # maximal width and height of placeholder image
+# command which saves video frame at %(time)s seconds from %(input)s
+# to %(output)s (JPEG image) used as poster and thumbnail of video
+poster_command = "ffmpeg -v error -ss %(time)s -i %(input)s -frames:v 1 -y %(output)s"
+poster_time = 5.0 # time of poster frame in seconds
 
 force = False # force file deletion?
 font_render = False # render fonts?
 font_size, font_text = 16, ""
+# characters in font thumbnails (written to items.js for gallery.js, new line
+# is line break), font subsets with only these characters are used for thumbnails
+font_thumbnail_text = "+-1234567890,\nabcdefghijklmnopqrstuvwxyz,\nABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
 rm_error = "ERROR: Existing gallery contains files that aren't symbolic links!\n"+\
           "       Use -f (--force) to remove all files."
@@ -99,12 +187,77 @@ else:
 	re_fontname = re.compile( unicode(r'[^a-z0-9_]+' ), re_flags )
 	re_tag = re.compile( unicode(r'^\$\(<.*\)$'), re_flags )
 	re_pdf = re.compile( unicode(r'\.pdf$' ), re_flags )
+# numbers and other text in item names (see natsort_key())
+re_natsort = re.compile(r'(\d+|\D+)')
+# words in item names and properties (see search_terms())
+re_search_term = re.compile(r'[^\W_]+', re.UNICODE)
 
 local = False
 page = 0
 title_page = False
 empty = False
 pdfto = "html"
+pdf_range_size = 10 # minimal number of PDF pages converted by single job
+pdf_converter_notes = {
+	'html': "NOTE: To convert PDF pages to HTML pdftohtml application must be installed.",
+	'svg': "NOTE: To convert PDF pages to SVG pdf2svg application must be installed (more info at: http://www.cityinthesky.co.uk/pdf2svg.html).",
+	'png': "NOTE: To convert PDF pages to images pdftoppm application must be installed."
+	}
+update = False
+split_items = False # write items of each page to separate file?
+sprites = False # pack thumbnails on each page into sprite sheets?
+sprite_size = 2048 # maximal width and height of sprite sheet
+search_index = False # write index of words in items for searching in gallery?
+search_exif = False # add date and camera from EXIF data to items and index?
+item_memory = 256 # memory for each list of items in MiB, rest is kept in temporary files
+stream_chunk = 1000 # number of items processed at once by build stages
+
+# build manifest (see load_manifest())
+manifest = {}
+# gallery built with different options is rebuilt by update without --force
+# (see load_manifest())
+rebuild = False
+new_manifest = {'dirs': []}
+# source files found in current update and manifest entries of files
+# without items (entries of other files are collected from items)
+new_sources = set()
+itemless_entries = []
+# number of files of each size (see --dedup)
+file_sizes = {}
+# items which share thumbnails and properties with item with same content
+# (item name -> name of the first item)
+duplicate_items = {}
+
+# wall time, CPU time, number of items, bytes read and written
+# and peak memory of build phases including jobs in worker processes
+# (see phase() and build_usage())
+phase_stats = collections.OrderedDict()
+current_phase = None
+# CPU time and bytes read and written by jobs in worker processes and by
+# worker processes when they finish (see accounted_job() and release_pool())
+worker_usage = [0.0, 0, 0]
+reaped_usage = [0.0, 0, 0]
+# peak memory of jobs in worker processes in current build phase (KiB)
+worker_peak = 0
+# durations of items in each build phase, recorded only with --stats
+# (see parallel_map())
+item_times = {}
+# worker pools kept between builds by GalleryBuilder (see worker_pool())
+pools = None
+# font index read in previous build ((path, size, mtime), index)
+loaded_font_index = (None, {})
+# directory listings and file sizes and modification times kept
+# between updates of watched gallery (see --watch and forget_dirs())
+scan_cache = None
+stat_cache = None
+
+# inotify events (see InotifyWatcher)
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF = 0x400, 0x800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x4000, 0x8000, 0x40000000
+# items reused from previous build (don't need fonts and thumbnails)
+unchanged_items = set()
 
 def from_locale(string):#{{{
 	global Locale
@@ -116,20 +269,145 @@ def from_locale(string):#{{{
 
 def copy(src, dest):#{{{
 	if os.path.isdir(src):
-		shutil.copytree( src, dest )
+		for root, dirs, files in os.walk(src, followlinks=True):
+			destdir = dest + root[len(src):]
+			makedirs(destdir)
+			for f in files:
+				copy_file( root +S+ f, destdir +S+ f )
 	else:
-		shutil.copyfile( src, dest )
+		copy_file(src, dest)
+#}}}
+
+def same_file_stat(st, dest):#{{{
+	"""
+	return True if file dest has same size and modification time as st
+	and it's hard link to the same file only in hardlink copy_mode
+	(hard link can be replaced by copy only on other file system)
+	"""
+	try:
+		st2 = os.lstat(dest)
+	except OSError:
+		return False
+	if copy_mode == "hardlink":
+		if st.st_dev == st2.st_dev and not os.path.samestat(st, st2):
+			return False
+	elif os.path.samestat(st, st2):
+		return False
+	return st.st_size == st2.st_size and abs(st.st_mtime - st2.st_mtime) < 1
+#}}}
+
+def copy_file(src, dest):#{{{
+	"""
+	copy file src to dest using methods for copy_mode,
+	file is not copied if dest (or same file from previous build) has same size
+	and modification time
+	"""
+	st = os.stat(src)
+	if same_file_stat(st, dest):
+		return
+
+	if os.path.islink(dest) or os.path.exists(dest):
+		os.remove(dest)
+
+	# reuse file from previous build
+	if olditemdir and dest.startswith(gdir +S+ "items" +S):
+		old = olditemdir + dest[len(gdir +S+ "items"):]
+		if same_file_stat(st, old):
+			os.rename(old, dest)
+			return
+
+	for method in copy_methods[copy_mode]:
+		try:
+			if method(src, dest):
+				return
+			break
+		except (IOError, OSError):
+			if os.path.exists(dest):
+				os.remove(dest)
+	else:
+		raise IOError("Cannot copy file \"" + src + "\"")
+
+	os.utime( dest, (st.st_atime, st.st_mtime) )
+#}}}
+
+def reflink_file(src, dest):#{{{
+	""" create copy-on-write clone of file (btrfs, XFS) """
+	if fcntl is None:
+		raise OSError("Reflinks are not supported")
+	s = open(src, 'rb')
+	try:
+		d = open(dest, 'wb')
+		try:
+			fcntl.ioctl( d.fileno(), FICLONE, s.fileno() )
+		finally:
+			d.close()
+	finally:
+		s.close()
+#}}}
+
+def hardlink_file(src, dest):#{{{
+	""" create hard link (file must be on same file system), return True """
+	os.link(src, dest)
+	# modification time is shared with source
+	return True
+#}}}
+
+def copy_file_data(src, dest):#{{{
+	""" copy file content using os.copy_file_range() or os.sendfile() if available """
+	s = open(src, 'rb')
+	try:
+		d = open(dest, 'wb')
+		try:
+			infd, outfd = s.fileno(), d.fileno()
+			if hasattr(os, 'copy_file_range'):
+				try:
+					while os.copy_file_range(infd, outfd, 1<<30):
+						pass
+					return
+				except OSError:
+					# not supported between these file systems
+					s.seek(0)
+					d.seek(0)
+					d.truncate()
+			if hasattr(os, 'sendfile'):
+				try:
+					offset = 0
+					while True:
+						n = os.sendfile(outfd, infd, offset, 1<<30)
+						if not n:
+							return
+						offset = offset + n
+				except OSError:
+					s.seek(0)
+					d.seek(0)
+					d.truncate()
+			shutil.copyfileobj(s, d, 1<<20)
+		finally:
+			d.close()
+	finally:
+		s.close()
 #}}}
 
+# copy mode -> methods tried in order
+copy_methods = {
+	'reflink': (reflink_file, copy_file_data),
+	'hardlink': (hardlink_file, copy_file_data),
+	'copy': (copy_file_data,)
+	}
+
 # default is create symbolic links
 # if operation not supported, copy all files
 try:
 	cp = os.symlink
 except:
 	cp = copy
+copy_mode = "reflink" # how files are copied (see copy_methods)
+olditemdir = None # items of previous build which can be reused by copy_file()
 
 def usage():#{{{
-	global title, resolution, gdir, url, d
+	global title, resolution, gdir, url, d, cachedir, cache_size, thumb_format, \
+			placeholder, poster_time, poster_command, copy_mode, item_memory, dedup_mode, \
+			progress_mode, slowest, watch_delay
 	print( """\
 usage: %s [options] [directories|filenames]
 
@@ -156,14 +434,27 @@ options:
                             (default: '%s')
   -u, --url=<url>         url location for web browser (%%s is replaced by <title>)
                             (default: '%s')
-  -r, --resolution=<res>  resolution for thumbnails in pixels
+  -r, --resolution=<res>[,<res>...]
+                          resolution for thumbnails in pixels, additional
+                          resolutions are used for high density displays
                             (default: %s)
   -c, --copy              copy files instead of creating symbolic links
+  --copy-mode=<mode>      copy files using reflinks, hard links or by copying
+                          content (can be REFLINK -- copy content if reflinks
+                          are not supported, HARDLINK -- gallery file and
+                          original are the same file, or COPY),
+                          files which didn't change are not copied again
+                            (default: '%s')
   -f, --force             overwrites existing gallery
   -l, --local             don't copy or create links to gallery items,
                           browse items locally, i.e. protocol is "file://"
   -x, --render=<size>,<text>
                           render fonts instead using them directly
+  --font-thumbnail-text=<text>
+                          characters in font thumbnails (new line is line
+                          break), thumbnails use font subsets with only
+                          these characters (fontTools must be installed,
+                          empty disables subsets)
   -p, --page              maximal number of items on one page
                           (if the argument is a negative number then each
                           directory/filename will be on separate page)
@@ -173,16 +464,119 @@ options:
   -P, --PDF=<format>      convert PDF to <format> (can be HTML, PNG, SVG or PDF)
   -T, --title-page        create title page
   -e, --empty             create empty gallery
+  -S, --split-items       write items of each page to separate file
+                          "items-page-<n>.js" which is loaded only when
+                          the page is viewed
+  --sprites               pack thumbnails on each page into few images
+                          (fewer requests when browsing item list, ignored
+                          with more thumbnail resolutions)
+  --search-index          write index of words in filenames, directories,
+                          item types and aliases to "search-index.js"
+                          (items can be searched in item list)
+  --search-exif           add date and camera from EXIF data of JPEG images
+                          to items and search index (implies --search-index)
+  -U, --update            update existing gallery -- only new and modified
+                          files are processed
+  --scan-threads=<n>      number of threads for scanning directories
+                          (useful for network file systems)
+                            (default: 0 (don't use threads))
+  --item-memory=<MiB>     memory for each list of items, items of larger
+                          galleries are sorted and kept in temporary files
+                          (--update and --dedup still keep data of all files
+                          in memory)
+                            (default: %s, 0 (unlimited))
+  --full-quality          always decode whole image to create thumbnail
+                          (by default JPEG images are decoded in lower
+                          resolution or embedded EXIF thumbnail is used)
+  --thumb-format=<format> thumbnail format (can be PNG, JPEG, WebP or AUTO --
+                          PNG for drawings and transparent images, JPEG
+                          for photos)
+                            (default: '%s')
+  --thumb-bytes=<bytes>   maximal size of thumbnail file, quality of thumbnail
+                          is lowered until it fits
+                            (default: 0 (unlimited))
+  --placeholder=<mode>    shown in item list before thumbnail is loaded
+                          (can be NONE, COLOR -- dominant color of image --
+                          or IMAGE -- tiny blurred image, adds few hundred
+                          bytes to each item, use with --split-items for
+                          large galleries)
+                            (default: '%s')
+  --poster-time=<sec>     time of video frame used as poster and thumbnail
+                          (first frame is used for shorter videos)
+                            (default: %s)
+  --poster-command=<cmd>  command which saves video frame at %%(time)s
+                          seconds from %%(input)s to %%(output)s (JPEG image)
+                            (default: '%s')
+  -j, --jobs=<n>          number of parallel jobs for generating thumbnails
+                          and converting PDF files
+                            (default: 0 (number of CPUs))
+  --cache=<dir>           cache directory for thumbnails and PDF pages
+                          shared by galleries
+                            (default: '%s')
+  --cache-size=<MiB>      maximal thumbnail cache size, least recently used
+                          thumbnails are removed first
+                            (default: %s)
+  --cache-hash            identify cached thumbnails by file content instead
+                          of path, size and modification time
+  --dedup=<mode>          find non-empty files with same content (can be
+                          NONE, KEEP -- thumbnails and properties of first
+                          file are used for its copies -- or COLLAPSE --
+                          only first file is in gallery)
+                            (default: '%s')
+  --prune-cache           remove least recently used thumbnails from cache
+                          so it doesn't exceed maximal size and exit
+  --progress=<mode>       progress output (can be BAR, JSON -- one JSON object
+                          per line with "event" phase_start, progress,
+                          phase_end or done, messages are written to
+                          standard error -- or NONE)
+                            (default: '%s')
+  --stats                 print time, CPU time, number of items, bytes read
+                          and written and peak memory of each build phase
+                          (including jobs in worker processes) and slowest
+                          items
+  --stats-file=<file>     save statistics to JSON file (implies --stats)
+  --slowest=<n>           number of slowest items listed for each phase
+                            (default: %s)
+  --profile=<file>        save cProfile statistics of main process to file
+                          (use with -j 1 to profile creating thumbnails)
+  --batch=<file>          build galleries listed in JSON file -- array with
+                          arguments of each gallery, e.g.
+                            [["-t", "2019", "photos/2019"], ...]
+                          in single process, other options on command line
+                          are used for all galleries and files are ignored
+  --watch                 keep updating gallery whenever files change
+                          (new files are shown in opened gallery after reload)
+  --watch-delay=<sec>     update gallery only after there are no changes
+                          for given time
+                            (default: %s)
+  --watch-poll=<sec>      check files in given interval instead of using
+                          inotify (e.g. on network file systems)
+                            (default: 0 (use inotify if available))
 
   -r 0, --resolution=0    don't generate thumbnails
   -u "", --url=""         don't launch web browser
-""" % (sys.argv[0], title, gdir, d, url, resolution) )
+  --cache=""              don't use cache
+  --poster-command=""     don't create thumbnails of videos
+""" % (sys.argv[0], title, gdir, d, url, resolution, copy_mode, item_memory, thumb_format,
+		placeholder, poster_time, poster_command, cachedir, cache_size, dedup_mode, progress_mode, slowest,
+		watch_delay) )
 #}}}
 
 def dirname(filename):#{{{
 	return os.path.dirname(filename).replace(':','_')
 #}}}
 
+def makedirs(d):#{{{
+	""" create directory d with parents if it doesn't exist """
+	# other worker process can create the directory at the same time
+	if not os.path.isdir(d):
+		try:
+			os.makedirs(d)
+		except OSError:
+			if not os.path.isdir(d):
+				raise
+#}}}
+
 def to_url(filename):#{{{
 	global local
 
@@ -201,13 +595,511 @@ def to_url(filename):#{{{
 	return url
 #}}}
 
-def walk(root):#{{{
-	if os.path.isdir(root):
+def scan_dir(root, skip=()):#{{{
+	"""
+	return lists of files and subdirectories in directory root,
+	directories with absolute path in skip are omitted
+	"""
+	# unchanged directory of watched gallery
+	key = os.path.normpath(root)
+	if scan_cache is not None:
+		if key not in scan_cache:
+			scan_cache[key] = list_dir(root, skip)
+		return scan_cache[key]
+	return list_dir(root, skip)
+#}}}
+
+def list_dir(root, skip=()):#{{{
+	files, dirs = [], []
+	prefix = root+S
+	if root == ".":
+		prefix = ""
+	abs_prefix = os.path.abspath(root)+S
+
+	if scandir is None:
 		for f in os.listdir(root):
-			for ff in walk(root == "." and f or root+S+f):
-				yield ff
-	else:
+			if os.path.isdir(prefix+f):
+				if abs_prefix+f not in skip:
+					dirs.append(prefix+f)
+			else:
+				files.append(prefix+f)
+		return files, dirs
+
+	for entry in scandir(root):
+		# file type is known from directory entry on most file systems
+		try:
+			is_dir = entry.is_dir()
+		except OSError:
+			is_dir = False
+
+		if is_dir:
+			if abs_prefix+entry.name not in skip:
+				dirs.append(prefix+entry.name)
+		else:
+			files.append(prefix+entry.name)
+
+	return files, dirs
+#}}}
+
+def walk(root, skip=()):#{{{
+	"""
+	yields all files in directory root (or root if it's a file),
+	directories with absolute path in skip are omitted
+	"""
+	if not os.path.isdir(root):
 		yield root
+		return
+
+	if scan_threads > 1:
+		# scan subdirectories concurrently
+		pool = worker_pool(ThreadPool, scan_threads)
+		pending = collections.deque( [pool.apply_async(scan_dir, (root, skip))] )
+		try:
+			while pending:
+				files, dirs = pending.popleft().get()
+				for d in dirs:
+					pending.append( pool.apply_async(scan_dir, (d, skip)) )
+				for f in files:
+					yield f
+		finally:
+			# wait for pending scans before pool is reused
+			for res in pending:
+				res.wait()
+			release_pool(pool)
+	else:
+		stack = [root]
+		while stack:
+			files, dirs = scan_dir(stack.pop(), skip)
+			for f in files:
+				yield f
+			stack.extend( reversed(dirs) )
+#}}}
+
+def watched_dirs(root):#{{{
+	"""
+	yields directory root and its subdirectories (or parent directory if root
+	is file) except gallery directory, paths are normalized
+	"""
+	if not os.path.isdir(root):
+		yield os.path.normpath( os.path.dirname(root) )
+		return
+
+	abs_gdir = os.path.abspath(gdir)
+	for path, dirs, files in os.walk(root):
+		if os.path.abspath(path) == abs_gdir:
+			# gallery files change with each update
+			dirs[:] = []
+			continue
+		yield os.path.normpath(path)
+#}}}
+
+def forget_dirs(changes):#{{{
+	"""
+	remove changed directories from scan and stat caches,
+	changes is dictionary {directory: True if whole subtree changed},
+	directory None means that all directories changed
+	"""
+	if None in changes:
+		scan_cache.clear()
+		stat_cache.clear()
+		return
+
+	for d, subtree in changes.items():
+		for cache in (scan_cache, stat_cache):
+			cache.pop(d, None)
+			if subtree:
+				for key in [key for key in cache if key.startswith(d + S)]:
+					del cache[key]
+#}}}
+
+class InotifyWatcher(object):#{{{
+	""" reports changed directories using inotify (Linux only) """
+	mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+			IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+	def __init__(self, roots):
+		import ctypes, ctypes.util
+		self.ctypes = ctypes
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		self.fd = self.libc.inotify_init()
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "Cannot initialize inotify")
+		self.dirs = {} # watch descriptor -> directory
+		try:
+			for root in roots:
+				self.add(root)
+		except:
+			self.close()
+			raise
+
+	def add(self, root):
+		""" watch directory tree, return watched directories """
+		added = []
+		for d in watched_dirs(root):
+			path = d
+			if has_python3:
+				path = os.fsencode(d)
+			wd = self.libc.inotify_add_watch(self.fd, path, self.mask)
+			if wd < 0:
+				errno = self.ctypes.get_errno()
+				if errno == 2: # ENOENT -- removed in the meantime
+					continue
+				raise OSError(errno, "Cannot watch directory \"" + d + "\"")
+			self.dirs[wd] = d
+			added.append(d)
+		return added
+
+	def changes(self, timeout=None):
+		"""
+		wait for changes at most timeout seconds (None: no limit),
+		return changed directories (see forget_dirs())
+		"""
+		changes = {}
+		if not select.select([self.fd], [], [], timeout)[0]:
+			return changes
+
+		buf = os.read(self.fd, 1<<16)
+		abs_gdir = os.path.abspath(gdir)
+		pos = 0
+		while pos + 16 <= len(buf):
+			wd, mask, cookie, length = struct.unpack_from("iIII", buf, pos)
+			name = buf[pos+16:pos+16+length].rstrip(b"\0")
+			pos = pos + 16 + length
+			if has_python3:
+				name = os.fsdecode(name)
+
+			if mask & IN_Q_OVERFLOW:
+				changes[None] = True
+				continue
+			d = self.dirs.get(wd)
+			if d is None:
+				continue
+			if mask & IN_IGNORED:
+				del self.dirs[wd]
+				continue
+
+			sub = os.path.normpath( os.path.join(d, name) )
+			if os.path.abspath(sub) == abs_gdir:
+				continue
+
+			changes.setdefault(d, False)
+			if name and mask & IN_ISDIR:
+				changes[sub] = True
+				if mask & (IN_CREATE | IN_MOVED_TO):
+					self.add(sub)
+
+		return changes
+
+	def close(self):
+		os.close(self.fd)
+#}}}
+
+class PollingWatcher(object):#{{{
+	""" reports changed directories by checking files in regular intervals """
+	def __init__(self, roots, interval):
+		self.roots = roots
+		self.interval = interval
+		self.state = self.snapshot()
+
+	def snapshot(self):
+		""" return {directory: {name: (size, mtime)}} """
+		state = {}
+		abs_gdir = os.path.abspath(gdir)
+		for root in self.roots:
+			for d in watched_dirs(root):
+				try:
+					names = os.listdir(d)
+				except OSError:
+					continue
+				entries = {}
+				for name in names:
+					if os.path.abspath( os.path.join(d, name) ) == abs_gdir:
+						continue
+					try:
+						st = os.stat( os.path.join(d, name) )
+						entries[name] = (st.st_size, st.st_mtime)
+					except OSError:
+						pass
+				state[d] = entries
+		return state
+
+	def changes(self, timeout=None):
+		""" see InotifyWatcher.changes() """
+		start = time.time()
+		while True:
+			wait = self.interval
+			if timeout is not None:
+				wait = min( wait, max(0, start + timeout - time.time()) )
+			time.sleep(wait)
+
+			state = self.snapshot()
+			changes = {}
+			for d in set(state) | set(self.state):
+				if d not in state or d not in self.state:
+					changes[d] = True
+				elif state[d] != self.state[d]:
+					changes[d] = False
+			self.state = state
+
+			if changes or timeout is not None and time.time() >= start + timeout:
+				return changes
+
+	def close(self):
+		pass
+#}}}
+
+def file_watcher(roots):#{{{
+	""" return InotifyWatcher or PollingWatcher for files and directories roots """
+	if not watch_poll:
+		try:
+			return InotifyWatcher(roots)
+		except (OSError, AttributeError, TypeError) as e:
+			# inotify is not available or limit of watches was reached
+			print("WARNING: Cannot use inotify ("+str(e)+") -- checking files every 5 seconds.")
+	return PollingWatcher(roots, watch_poll or 5.0)
+#}}}
+
+def reset_build_state():#{{{
+	""" clear state of previous build """
+	global manifest, rebuild, new_manifest, new_sources, itemless_entries, file_sizes, \
+			duplicate_items, phase_stats, current_phase, item_times, \
+			unchanged_items, olditemdir
+
+	manifest = {}
+	rebuild = False
+	new_manifest = {'dirs': []}
+	new_sources = set()
+	itemless_entries = []
+	file_sizes = {}
+	duplicate_items = {}
+	phase_stats = collections.OrderedDict()
+	current_phase = None
+	item_times = {}
+	unchanged_items = set()
+	olditemdir = None
+#}}}
+
+def cpu_time():#{{{
+	"""
+	return CPU time of process and its finished child processes
+	(worker processes in kept pools are not finished, see build_usage())
+	"""
+	t = os.times()
+	return t[0] + t[1] + t[2] + t[3]
+#}}}
+
+def reset_peak_memory():#{{{
+	""" reset peak resident set size of process on Linux (see peak_memory()) """
+	try:
+		f = open("/proc/self/clear_refs", "w")
+		try:
+			f.write("5")
+		finally:
+			f.close()
+	except (IOError, OSError):
+		pass
+#}}}
+
+def peak_memory():#{{{
+	"""
+	return peak resident set size of process since last reset_peak_memory()
+	in KiB on Linux (0 if unknown)
+	"""
+	try:
+		f = open("/proc/self/status")
+		try:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int( line.split()[1] )
+		finally:
+			f.close()
+	except (IOError, OSError, IndexError, ValueError):
+		pass
+	return 0
+#}}}
+
+def io_counters():#{{{
+	"""
+	return bytes read and written by process and its finished child
+	processes on Linux ((0, 0) if unknown, see build_usage())
+	"""
+	try:
+		f = open("/proc/self/io")
+		try:
+			counters = dict( line.split(":", 1) for line in f if ":" in line )
+		finally:
+			f.close()
+		return int(counters['rchar']), int(counters['wchar'])
+	except (IOError, OSError, KeyError, ValueError):
+		return 0, 0
+#}}}
+
+def build_usage():#{{{
+	"""
+	return CPU time and bytes read and written by main process, its finished
+	child processes and jobs in worker processes,
+	worker processes are accounted by each job because kept pools
+	(see GalleryBuilder) are not finished during build
+	"""
+	usage = (cpu_time(),) + io_counters()
+	return tuple( usage[i] - reaped_usage[i] + worker_usage[i] for i in range(3) )
+#}}}
+
+def accounted_job(job):#{{{
+	"""
+	call fn(arg) for job (fn, arg) in worker process, returns result and
+	CPU time, bytes read and written and peak memory of the call
+	(see build_usage())
+	"""
+	fn, arg = job
+	cpu = cpu_time()
+	read, written = io_counters()
+	reset_peak_memory()
+	res = fn(arg)
+	read2, written2 = io_counters()
+	return res, (cpu_time() - cpu, read2 - read, written2 - written, peak_memory())
+#}}}
+
+def add_worker_usage(usage):#{{{
+	""" add usage of job in worker process (see accounted_job()) """
+	global worker_peak
+	for i in range(3):
+		worker_usage[i] = worker_usage[i] + usage[i]
+	worker_peak = max(worker_peak, usage[3])
+#}}}
+
+def phase(name=None):#{{{
+	"""
+	end current build phase and start phase name (None only ends current phase),
+	statistics of phases with same name are summed in phase_stats,
+	peak memory is the largest resident set size of main process and jobs in
+	worker processes during the phase
+	"""
+	global current_phase, worker_peak
+
+	now = (time.time(),) + build_usage()
+	if current_phase:
+		name0, wall, cpu, read, written = current_phase
+		st = phase_stats[name0]
+		st['wall'] = st['wall'] + now[0] - wall
+		st['cpu'] = st['cpu'] + now[1] - cpu
+		st['bytes_read'] = st['bytes_read'] + now[2] - read
+		st['bytes_written'] = st['bytes_written'] + now[3] - written
+		st['peak_rss_kib'] = max( st['peak_rss_kib'], peak_memory(), worker_peak )
+		if progress_mode == "json":
+			emit_event("phase_end", phase=name0, stats=st)
+
+	current_phase = None
+	if name:
+		current_phase = (name,) + now
+		worker_peak = 0
+		reset_peak_memory()
+		phase_stats.setdefault( name, {'wall': 0.0, 'cpu': 0.0, 'items': 0,
+			'bytes_read': 0, 'bytes_written': 0, 'peak_rss_kib': 0} )
+		if progress_mode == "json":
+			emit_event("phase_start", phase=name)
+#}}}
+
+def count_items(n):#{{{
+	""" add n items processed in current build phase """
+	if current_phase:
+		st = phase_stats[current_phase[0]]
+		st['items'] = st['items'] + n
+#}}}
+
+def record_time(seconds, name):#{{{
+	""" record duration of item in current build phase (only with --stats) """
+	if stats and current_phase:
+		item_times.setdefault( current_phase[0], [] ).append( (seconds, name) )
+#}}}
+
+def emit_event(event, **fields):#{{{
+	""" write event as JSON object on single line (see --progress=json) """
+	out = event_output or sys.stdout
+	fields['event'] = event
+	fields['time'] = round(time.time(), 3)
+	out.write( json.dumps(fields, sort_keys=True) + "\n" )
+	out.flush()
+#}}}
+
+def redirect_output():#{{{
+	"""
+	keep standard output only for events (see emit_event()) and redirect
+	other output -- messages, output of commands and worker processes --
+	to standard error, returns function which restores output
+	"""
+	global event_output
+
+	stdout = sys.stdout
+	stdout.flush()
+	sys.stderr.flush()
+	try:
+		fd = stdout.fileno()
+		saved = os.dup(fd)
+	except (AttributeError, ValueError, OSError, IOError):
+		# stream without file descriptor (only messages of this process are redirected)
+		fd = None
+		event_output = stdout
+	else:
+		os.dup2(sys.stderr.fileno(), fd)
+		event_output = os.fdopen(saved, "w")
+	sys.stdout = sys.stderr
+
+	def restore():
+		global event_output
+		sys.stdout.flush()
+		sys.stdout = stdout
+		if fd is not None:
+			event_output.flush()
+			os.dup2(event_output.fileno(), fd)
+			event_output.close()
+		event_output = None
+	return restore
+#}}}
+
+def show_progress(label, i, n):#{{{
+	""" show progress bar or write progress event (see --progress) """
+	if progress_mode == "bar":
+		l = int(i*progress_len/n)
+		bar = ("="*l) + ">" + (" "*(progress_len-l))
+		sys.stdout.write( "%s: [%s] %d/%d%s"%(label,bar,i,n,i==n and "\n" or "\r") )
+		sys.stdout.flush()
+	elif progress_mode == "json":
+		emit_event("progress", phase=current_phase and current_phase[0], done=i, total=n)
+#}}}
+
+def stats_report():#{{{
+	""" return statistics of build phases and slowest items (see --stats) """
+	total = {'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes_read': 0,
+			'bytes_written': 0, 'peak_rss_kib': 0}
+	for st in phase_stats.values():
+		for key in total:
+			if key == 'peak_rss_kib':
+				total[key] = max(total[key], st[key])
+			else:
+				total[key] = total[key] + st[key]
+
+	slow = collections.OrderedDict()
+	for name in phase_stats:
+		if name in item_times:
+			slow[name] = [list(x) for x in heapq.nlargest(slowest, item_times[name])]
+
+	return {'phases': phase_stats, 'total': total, 'slowest': slow}
+#}}}
+
+def print_stats(report):#{{{
+	print("Build statistics:")
+	print("  %-12s %9s %9s %8s %13s %13s %13s" % ("phase", "time [s]", "CPU [s]",
+		"items", "read [KiB]", "written [KiB]", "memory [KiB]"))
+	rows = list(report['phases'].items()) + [("total", report['total'])]
+	for name, st in rows:
+		print( "  %-12s %9.3f %9.3f %8d %13d %13d %13d" % (name, st['wall'], st['cpu'],
+			st['items'], st['bytes_read']//1024, st['bytes_written']//1024, st['peak_rss_kib']) )
+
+	for name, items in report['slowest'].items():
+		print("Slowest items (%s):" % name)
+		for seconds, f in items:
+			print("  %9.3fs  %s" % (seconds, f))
 #}}}
 
 def launch_browser(url):#{{{
@@ -226,22 +1118,38 @@ def launch_browser(url):#{{{
 	print(ok and "DONE" or "FAILED!")
 #}}}
 
+# command line options (see parse_args())
+short_options = "ht:r:d:u:cflx:p:TeP:j:US"
+long_options = ["help", "title=", "resolution=", "directory=", "url=",
+		"template=", "copy", "force", "local", "render=", "page=",
+		"title-page", "empty", "PDF=", "jobs=", "cache=", "cache-size=",
+		"cache-hash", "dedup=", "prune-cache", "update", "full-quality",
+		"scan-threads=", "item-memory=", "split-items", "sprites", "search-index",
+		"search-exif", "thumb-format=",
+		"thumb-bytes=", "placeholder=", "font-thumbnail-text=", "poster-time=",
+		"poster-command=", "copy-mode=", "progress=", "stats", "stats-file=",
+		"slowest=", "profile=", "batch=", "watch", "watch-delay=", "watch-poll="]
+
 def parse_args(argv):#{{{
 	"""
 	parse switches and arguments
 	returns array of pages with files/directories (empty string is page break)
 		e.g. [ [item1_on_page1, item2_on_page1, ...], [item1_on_page2, ...], ... ]
 	"""
-	global title, resolution, gdir, url, d, cp, force, local, page, \
-			font_render, font_size, font_text, title_page, empty, pdfto
+	global title, resolution, gdir, url, d, cp, force, local, page, thumbnail_resolutions, \
+			font_render, font_size, font_text, title_page, empty, pdfto, jobs, \
+			cachedir, cache_size, cache_hash, prune_cache, update, \
+			fast_thumbnails, scan_threads, split_items, sprites, thumb_format, thumb_bytes, \
+			placeholder, \
+			font_thumbnail_text, poster_time, poster_command, copy_mode, \
+			progress_mode, stats, stats_file, slowest, profile_file, batch_file, \
+			watch, watch_delay, watch_poll, item_memory, dedup_mode, \
+			search_index, search_exif
 
 	allfiles = []
 
 	try:
-		opts, args = getopt.gnu_getopt(argv, "ht:r:d:u:cflx:p:TeP:",
-				["help", "title=", "resolution=", "directory=", "url=",
-					"template=", "copy", "force", "local", "render=", "page=",
-					"title-page", "empty", "PDF="])
+		opts, args = getopt.gnu_getopt(argv, short_options, long_options)
 	except getopt.GetoptError:
 		usage()
 		sys.exit(2)
@@ -261,14 +1169,20 @@ def parse_args(argv):#{{{
 			d = arg
 		elif opt in ("-r", "--resolution"):
 			try:
-				resolution = int(arg)
-				if resolution<0:
-					resolution = 0
+				res = [max(0, int(x)) for x in arg.split(',')]
+				resolution = res[0]
+				thumbnail_resolutions = sorted( set(res[1:]) - set([resolution, 0]) )
 			except:
-				print("ERROR: Resolution must be a single number!")
+				print("ERROR: Resolution must be a number or comma separated list of numbers!")
 				sys.exit(1)
 		elif opt in ("-c", "--copy"):
 			cp = copy
+		elif opt == "--copy-mode":
+			cp = copy
+			copy_mode = arg.lower()
+			if copy_mode not in copy_methods:
+				print("ERROR: Copy mode can be only REFLINK, HARDLINK or COPY!")
+				sys.exit(1)
 		elif opt in ("-l", "--local"):
 			local = True
 		elif opt in ("-f", "--force"):
@@ -281,6 +1195,8 @@ def parse_args(argv):#{{{
 			except:
 				usage()
 				sys.exit(1)
+		elif opt == "--font-thumbnail-text":
+			font_thumbnail_text = arg
 		elif opt in ("-p", "--page"):
 			try:
 				page = int(arg)
@@ -296,6 +1212,121 @@ def parse_args(argv):#{{{
 			if pdfto not in ["pdf", "html", "png", "svg"]:
 				print("ERROR: PDF can be converted only to HTML, PNG or SVG!")
 				sys.exit(1)
+		elif opt in ("-S", "--split-items"):
+			split_items = True
+		elif opt == "--sprites":
+			sprites = True
+		elif opt == "--search-index":
+			search_index = True
+		elif opt == "--search-exif":
+			search_index = search_exif = True
+		elif opt in ("-U", "--update"):
+			update = True
+		elif opt == "--scan-threads":
+			try:
+				scan_threads = int(arg)
+				if scan_threads<0:
+					scan_threads = 0
+			except:
+				print("ERROR: Number of scan threads must be a single number!")
+				sys.exit(1)
+		elif opt == "--item-memory":
+			try:
+				item_memory = max( 0, int(arg) )
+			except:
+				print("ERROR: Item memory must be a single number!")
+				sys.exit(1)
+		elif opt == "--full-quality":
+			fast_thumbnails = False
+		elif opt == "--thumb-format":
+			thumb_format = arg.lower()
+			if thumb_format == "jpg":
+				thumb_format = "jpeg"
+			if thumb_format not in ["png", "jpeg", "webp", "auto"]:
+				print("ERROR: Thumbnail format can be only PNG, JPEG, WebP or AUTO!")
+				sys.exit(1)
+		elif opt == "--thumb-bytes":
+			try:
+				thumb_bytes = int(arg)
+				if thumb_bytes<0:
+					thumb_bytes = 0
+			except:
+				print("ERROR: Thumbnail size must be a single number!")
+				sys.exit(1)
+		elif opt == "--placeholder":
+			placeholder = arg.lower()
+			if placeholder not in ["none", "color", "image"]:
+				print("ERROR: Placeholder can be only NONE, COLOR or IMAGE!")
+				sys.exit(1)
+		elif opt in ("-j", "--jobs"):
+			try:
+				jobs = int(arg)
+				if jobs<0:
+					jobs = 0
+			except:
+				print("ERROR: Jobs must be a single number!")
+				sys.exit(1)
+		elif opt == "--poster-time":
+			try:
+				poster_time = max( 0.0, float(arg) )
+			except:
+				print("ERROR: Poster time must be a number!")
+				sys.exit(1)
+		elif opt == "--poster-command":
+			poster_command = arg
+		elif opt == "--cache":
+			cachedir = arg
+		elif opt == "--cache-size":
+			try:
+				cache_size = int(arg)
+				if cache_size<0:
+					cache_size = 0
+			except:
+				print("ERROR: Cache size must be a single number!")
+				sys.exit(1)
+		elif opt == "--cache-hash":
+			cache_hash = True
+		elif opt == "--dedup":
+			dedup_mode = arg.lower()
+			if dedup_mode not in ["none", "keep", "collapse"]:
+				print("ERROR: Dedup can be only NONE, KEEP or COLLAPSE!")
+				sys.exit(1)
+		elif opt == "--prune-cache":
+			prune_cache = True
+		elif opt == "--progress":
+			progress_mode = arg.lower()
+			if progress_mode not in ["bar", "json", "none"]:
+				print("ERROR: Progress can be only BAR, JSON or NONE!")
+				sys.exit(1)
+		elif opt == "--stats":
+			stats = True
+		elif opt == "--stats-file":
+			stats = True
+			stats_file = arg
+		elif opt == "--slowest":
+			try:
+				slowest = max( 0, int(arg) )
+			except:
+				print("ERROR: Number of slowest items must be a single number!")
+				sys.exit(1)
+		elif opt == "--profile":
+			profile_file = arg
+		elif opt == "--batch":
+			batch_file = arg
+		elif opt == "--watch":
+			watch = True
+		elif opt == "--watch-delay":
+			try:
+				watch_delay = max( 0.0, float(arg) )
+			except:
+				print("ERROR: Watch delay must be a number!")
+				sys.exit(1)
+		elif opt == "--watch-poll":
+			try:
+				watch_poll = max( 0.0, float(arg) )
+			except:
+				print("ERROR: Watch poll interval must be a number!")
+				sys.exit(1)
 
 	# no PIL: warnings, errors
 	if not has_pil:
@@ -307,6 +1338,9 @@ def parse_args(argv):#{{{
 		if resolution:
 			print("WARNING: Thumbnails not generated -- please install Python Imaging Library (PIL) module.")
 			resolution = 0
+	elif thumb_format == "webp" and not has_webp():
+		print("ERROR: Python Imaging Library (PIL) module was built without WebP support.")
+		sys.exit(10)
 
 	try:
 		gdir = gdir % title
@@ -345,7 +1379,10 @@ def parse_args(argv):#{{{
 #}}}
 
 def clean_gallery():#{{{
-	global rm_error, d, gdir, force
+	global rm_error, d, gdir, force, olditemdir
+
+	# files of gallery built by this script are removed
+	remove = force or rebuild
 
 	if not os.path.isdir(gdir):
 		os.makedirs(gdir)
@@ -358,28 +1395,50 @@ def clean_gallery():#{{{
 		link = links[f]
 		if os.path.islink(link):
 			os.remove(link)
-		elif force and os.path.isfile(link):
+		elif remove and os.path.isfile(link):
 			os.remove(link)
 		elif os.path.isdir(link):
-			if force:
+			if remove:
 				shutil.rmtree(link)
-			else:
+			elif not (update and cp == copy):
 				exit(rm_error)
 		cp( os.path.abspath(f), link )
 
-	# clean items directory
 	itemdir = gdir+S+"items"
+	thumbdir = gdir+S+"thumbs"
+
+	# keep items and thumbnails of updated gallery
+	if update:
+		# directories are linked again if they still contain only items
+		for link in manifest.get('dirs', []):
+			if os.path.islink(gdir +S+ link):
+				os.remove(gdir +S+ link)
+		if not local and not os.path.isdir(itemdir):
+			os.mkdir(itemdir)
+		shutil.copyfile(d+S+"config.js", gdir+S+"config.js")
+		return
+
+	# clean items directory
 	if os.path.isdir(itemdir):
-		for f in walk(itemdir):
-			# TODO: port
-			if not (os.path.islink(f) or force):
-				exit(rm_error)
-		shutil.rmtree(itemdir)
+		if not remove:
+			# links to directories are not followed
+			for root, dirs, files in os.walk(itemdir):
+				for f in files:
+					# TODO: port
+					if not os.path.islink(root +S+ f):
+						exit(rm_error)
+		if cp == copy and not local:
+			# copied files are reused if they didn't change (see copy_file())
+			olditemdir = gdir+S+"items.old"
+			if os.path.isdir(olditemdir):
+				shutil.rmtree(olditemdir)
+			os.rename(itemdir, olditemdir)
+		else:
+			shutil.rmtree(itemdir)
 
 	# clean thumbnail directory
-	thumbdir = gdir+S+"thumbs"
 	if os.path.isdir(thumbdir):
-		if not force:
+		if not remove:
 			exit(rm_error)
 		shutil.rmtree(thumbdir)
 
@@ -390,10 +1449,10 @@ def clean_gallery():#{{{
 	shutil.copyfile(d+S+"config.js", gdir+S+"config.js")
 #}}}
 
-def addFont(fontfile, cssfile):#{{{
-	global re_fontname, gdir
+def font_path(fontfile):#{{{
+	""" return path to font file of item """
+	global gdir
 
-	# font file path
 	f = fontfile
 	if not local and is_local(fontfile):
 		f = gdir +S+ f
@@ -402,127 +1461,342 @@ def addFont(fontfile, cssfile):#{{{
 	if not is_local(f):
 		exit("ERROR: Don't know how to handle remote fonts!")
 
-	# font name
-	fontname = None
-	try:
-		font = ImageFont.truetype(f,8)
-		name = font.getname()
-		fontname = name[0]
-		if name[1]:
-			fontname = fontname + " " + name[1]
-	except Exception as e:
-		print("ERROR: "+str(e)+" (file: \""+fontfile+"\")")
-
-	# render font
-	outfile = fontfile
-	link = None
-	if font_render:
-		outfile = "items" +S+ fontfile + ".png"
-		link = fontfile
+	return f
+#}}}
+
+def font_job(job):#{{{
+	"""
+	read font name (if name is None), render font (if outfile is set)
+	and create font subset for thumbnail (if subsetfile is set)
+	in worker process, returns ((family, style) or name, list of errors)
+	"""
+	f, name, outfile, size, text, subsetfile = job
+	errors = []
+
+	if name is None:
 		try:
-			renderFont(f, font_size, font_text, gdir +S+ outfile)
+			name = ImageFont.truetype(f,8).getname()
 		except Exception as e:
-			print("ERROR: "+str(e)+" (file: \""+fontfile+"\")")
-	else:
-		p = from_locale(to_url(fontfile))
-		cssfile.write("@font-face{font-family:"+re_fontname.sub("_", p)+";src:url('"+p+"');}\n")
+			errors.append( str(e) )
 
-	return outfile, fontname, link
+	if outfile:
+		try:
+			renderFont(f, size, text, outfile)
+		except Exception as e:
+			errors.append( str(e) )
+
+	if subsetfile:
+		try:
+			createFontSubset(f, font_thumbnail_text, subsetfile)
+		except Exception as e:
+			errors.append( "Cannot create font subset: " + str(e) )
+
+	return name, errors
+#}}}
+
+def createFontSubset(fontfile, text, outfile):#{{{
+	""" save font with only glyphs needed for text (WOFF2 or WOFF) """
+	options = fontsubset.Options()
+	options.flavor = font_subset_format
+	font = fontsubset.load_font(fontfile, options)
+	try:
+		subsetter = fontsubset.Subsetter(options)
+		subsetter.populate( text=from_locale(text) )
+		subsetter.subset(font)
+
+		makedirs( dirname(outfile) )
+		fontsubset.save_font(font, outfile, options)
+	finally:
+		font.close()
+#}}}
+
+def fontface(fontfile):#{{{
+	""" return CSS font-face definition for font """
+	p = from_locale(to_url(fontfile))
+	return "@font-face{font-family:"+re_fontname.sub("_", p)+";src:url('"+p+"');}\n"
+#}}}
+
+def thumbnail_fontface(fontfile, ext):#{{{
+	"""
+	return CSS font-face definition for font subset used in thumbnails,
+	font family name is prefixed with "thumb_"
+	"""
+	p = from_locale(to_url(fontfile))
+	url = "thumbs/" + p.replace(':','_') + "." + ext
+	return "@font-face{font-family:thumb_"+re_fontname.sub("_", p)+ \
+			";src:url('"+url+"') format('"+ext+"');}\n"
+#}}}
+
+def text_size(font, text):#{{{
+	""" return width and height of rendered text """
+	# ImageFont.getsize() was removed in newer versions of PIL (Pillow)
+	if hasattr(font, 'getbbox'):
+		box = font.getbbox(text)
+		return box[2], box[3]
+	return font.getsize(text)
 #}}}
 
 def renderFont(fontfile, size, text, outfile):#{{{
 	f = ImageFont.truetype(fontfile, size, encoding="unic")
 
+	# measure lines first so all lines are drawn into single image
+	lines = []
 	w = 0
-	h = size/2
-	im = Image.new("RGB", (w,h), "white")
-
-	# render lines
+	h = size//2
 	for line in ( from_locale(text) +'\n').split('\n'):
 		if line:
-			w2,h2 = f.getsize(line)
+			w2,h2 = text_size(f, line)
 			w2 = w2+size
-			h2 = h2
-			im2 = Image.new("RGB", (w2,h2), "white")
-
-			# render line
-			draw = ImageDraw.Draw(im2)
-			draw.text( (size/2,0), line, fill="black", font=f )
 		else:
 			# empty line
 			w2 = 0
-			h2 = size/2
-			im2 = Image.new("RGB", (w2,h2), "white")
-
-		w3 = max(w,w2)
-		h3 = h+h2
-		im3 = Image.new("RGB", (w3,h3), "white")
+			h2 = size//2
+		lines.append( (line, h) )
+		w, h = max(w,w2), h+h2
 
-		# join images
-		im3.paste( im, (0,0,w,h) )
-		im3.paste( im2, (0,h,w2,h3) )
-
-		im = im3
-		w, h = w3, h3
+	# render lines
+	im = Image.new("RGB", (w,h), "white")
+	draw = ImageDraw.Draw(im)
+	for line, y in lines:
+		if line:
+			draw.text( (size//2,y), line, fill="black", font=f )
 
-	d = dirname(outfile)
-	if not os.path.isdir(d):
-		os.makedirs(d)
+	makedirs( dirname(outfile) )
 	im.save(outfile, "PNG")
 #}}}
 
-def renderPDF(pdffile):#{{{
-	sys.stdout.write("Generating pages for \"" + pdffile + "\" ... ")
-	sys.stdout.flush()
+def font_index_file():#{{{
+	""" return path to font index in cache or None if cache is disabled """
+	return cachedir and cachedir +S+ "fonts.json" or None
+#}}}
 
-	outdir = pdffile + "_pages"
-	itemdir = gdir +S+ "items"
-	os.makedirs(itemdir +S+ outdir)
+def load_font_index():#{{{
+	"""
+	return font index -- family and style of font files from previous builds
+		{ "real path": [size, mtime, family, style], ... }
+	"""
+	global loaded_font_index
 
-	pages = []
-	if pdfto == "pdf":
-		pages = [pdffile]
-	elif pdfto == "html":
-		outfile = outdir +S+ "p.html"
-		try:
-			res = subprocess.call(["pdftohtml", "-p", "-c", pdffile, itemdir +S+ outfile])
-			if res == 0:
-				pages.append(outfile)
-				print("DONE")
-				pages = [outdir +S+ f for f in os.listdir(itemdir +S+ outdir) if f.startswith("p-")]
-			else:
-				print("ERROR")
-				exit(1)
-		except:
-			print("NOT CONVERTED\nNOTE: To convert PDF pages to HTML pdftohtml application must be installed.")
-	elif pdfto == "svg":
-		outfile = outdir +S+ "%04d.svg"
+	f = font_index_file()
+	if not f or not os.path.exists(f):
+		return {}
+	try:
+		# index is read again only if it changed since previous build
+		st = os.stat(f)
+		key = (f, st.st_size, st.st_mtime)
+		if loaded_font_index[0] != key:
+			indexfile = codecs.open(f, "r", "utf-8")
+			try:
+				loaded_font_index = (key, json.load(indexfile))
+			finally:
+				indexfile.close()
+		return dict(loaded_font_index[1])
+	except (IOError, OSError, ValueError) as e:
+		print("WARNING: Cannot read font index: "+str(e))
+		return {}
+#}}}
+
+def write_font_index(index):#{{{
+	global loaded_font_index
+
+	f = font_index_file()
+	if not f:
+		return
+	try:
+		if not os.path.isdir(cachedir):
+			os.makedirs(cachedir)
+		indexfile = codecs.open(f + ".tmp", "w", "utf-8")
 		try:
-			res = subprocess.call(["pdf2svg", pdffile, itemdir +S+ outfile, "all"])
-			if res == 0:
-				pages.append(outfile)
-				print("DONE")
-				pages = [outdir +S+ f for f in os.listdir(itemdir +S+ outdir)]
-			else:
-				print("ERROR")
-				exit(1)
-		except:
-			print("NOT CONVERTED\nNOTE: To convert PDF pages to SVG pdf2svg application must be installed (more info at: http://www.cityinthesky.co.uk/pdf2svg.html).")
-	elif pdfto == "png":
-		outfile = outdir +S+ "p.html"
+			indexfile.write( to_unicode(json.dumps(index)) )
+		finally:
+			indexfile.close()
+		replace_file(f + ".tmp", f)
+	except (IOError, OSError) as e:
+		print("WARNING: Cannot write font index: "+str(e))
+		return
+
+	try:
+		st = os.stat(f)
+		loaded_font_index = ( (f, st.st_size, st.st_mtime), dict(index) )
+	except OSError:
+		pass
+#}}}
+
+def pdf_page_count(pdffile):#{{{
+	""" return number of pages in PDF file (0 if unknown) """
+	try:
+		p = subprocess.Popen(["pdfinfo", pdffile], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		out = p.communicate()[0]
+	except OSError:
+		return 0
+	m = re.search(br'^Pages:\s*(\d+)', out, re.MULTILINE)
+	return m and int(m.group(1)) or 0
+#}}}
+
+def pdf_commands(pdffile, outdir):#{{{
+	"""
+	return commands which convert PDF file to pages in outdir,
+	large documents are split to page ranges which can be converted concurrently
+	"""
+	if pdfto == "html":
+		# pdftohtml writes index and outline files shared by all pages
+		return [["pdftohtml", "-p", "-c", pdffile, outdir +S+ "p.html"]]
+
+	ranges = []
+	count = pdf_page_count(pdffile)
+	step = max( pdf_range_size, -(-count//(jobs or multiprocessing.cpu_count())) )
+	if count > step:
+		ranges = [(first, min(first+step-1, count)) for first in range(1, count+1, step)]
+
+	if pdfto == "svg":
+		if not ranges:
+			return [["pdf2svg", pdffile, outdir +S+ "%04d.svg", "all"]]
+		# pdf2svg converts either single page or whole document
+		return [["pdf2svg", pdffile, outdir +S+ "%04d.svg" % page, str(page)]
+				for first, last in ranges for page in range(first, last+1)]
+
+	# pdftoppm names pages by page number padded to width of page count
+	# so page ranges produce same files
+	if not ranges:
+		return [["pdftoppm", "-png", pdffile, outdir +S+ "p.html"]]
+	return [["pdftoppm", "-png", "-f", str(first), "-l", str(last), pdffile, outdir +S+ "p.html"]
+			for first, last in ranges]
+#}}}
+
+def pdf_pages(outdir):#{{{
+	""" return rendered pages in outdir (relative to "items/") """
+	files = os.listdir(gdir +S+ "items" +S+ outdir)
+	if pdfto == "html":
+		files = [f for f in files if f.startswith("p-")]
+	return [outdir +S+ f for f in files]
+#}}}
+
+def run_command(cmd):#{{{
+	""" run command and return its exit status or None if it cannot be executed """
+	try:
+		return subprocess.call(cmd)
+	except OSError:
+		return None
+#}}}
+
+def pdf_cache_key(pdffile):#{{{
+	""" return key of rendered PDF pages in cache """
+	key = "pdf:%s:%s" % (file_hash(pdffile), pdfto)
+	return hashlib.sha1( key.encode('utf-8') ).hexdigest()
+#}}}
+
+def cached_pdf(key, outdir):#{{{
+	""" link cached PDF pages to outdir, return False if not cached """
+	f = cache_file(key)
+	try:
+		listfile = open(f + ".files")
 		try:
-			res = subprocess.call(["pdftoppm", "-png", pdffile, itemdir +S+ outfile])
-			if res == 0:
-				pages.append(outfile)
-				print("DONE")
-				pages = [outdir +S+ f for f in os.listdir(itemdir +S+ outdir)]
-			else:
-				print("ERROR")
-				exit(1)
-		except:
-			print("NOT CONVERTED\nNOTE: To convert PDF pages to images pdftoppm application must be installed.")
+			names = json.load(listfile)
+		finally:
+			listfile.close()
+
+		for name in names:
+			link_or_copy(f +S+ name, outdir +S+ name)
+			# mark page as recently used
+			os.utime(f +S+ name, None)
+	except (IOError, OSError, ValueError):
+		# remove pages linked before failure
+		for name in os.listdir(outdir):
+			os.remove(outdir +S+ name)
+		return False
+
+	return True
+#}}}
 
-	return pages;
+def cache_pdf(key, outdir):#{{{
+	""" store rendered PDF pages in cache """
+	f = cache_file(key)
+	try:
+		if os.path.isdir(f):
+			shutil.rmtree(f)
+		os.makedirs(f)
+		names = sorted( os.listdir(outdir) )
+		for name in names:
+			link_or_copy(outdir +S+ name, f +S+ name)
+
+		# list of files is written last so incomplete entries are ignored
+		listfile = open(f + ".files", "w")
+		try:
+			json.dump(names, listfile)
+		finally:
+			listfile.close()
+	except (IOError, OSError) as e:
+		print("WARNING: Cannot store PDF pages in cache: "+str(e))
+#}}}
+
+def render_pdfs(pdfs):#{{{
+	"""
+	convert PDF files to pages (see --PDF) and add pages to items,
+	pdfs is list of (pdffile, items, manifest_entry) (see add_file()),
+	conversions of all files and page ranges run concurrently
+	"""
+	itemdir = gdir +S+ "items"
+	keys = [None]*len(pdfs)
+	commands = []
+	for i, (pdffile, items, entry) in enumerate(pdfs):
+		outdir = itemdir +S+ pdffile + "_pages"
+		os.makedirs(outdir)
+		if pdfto == "pdf":
+			continue
+
+		if cachedir:
+			try:
+				keys[i] = pdf_cache_key(pdffile)
+			except (IOError, OSError):
+				pass # error is reported when converting file
+			if keys[i] and cached_pdf(keys[i], outdir):
+				keys[i] = None
+				continue
+
+		for cmd in pdf_commands(pdffile, outdir):
+			commands.append( (i, cmd) )
+
+	# exit status of each PDF file -- None if converter is missing
+	status = {}
+	count_items( len(pdfs) )
+	if commands:
+		n = jobs or multiprocessing.cpu_count()
+		pool = worker_pool( ThreadPool, pools is None and min(n, len(commands)) or n )
+		try:
+			results = pool.map( timed_job, [(run_command, cmd) for i, cmd in commands] )
+		finally:
+			release_pool(pool)
+		for (i, cmd), (seconds, res) in zip(commands, results):
+			record_time( seconds, " ".join(cmd) )
+			if res is None or status.get(i, 0) is not None and res != 0:
+				status[i] = res
+
+	for i, (pdffile, items, entry) in enumerate(pdfs):
+		sys.stdout.write("Generating pages for \"" + pdffile + "\" ... ")
+		outdir = pdffile + "_pages"
+
+		res = status.get(i, 0)
+		if res is None:
+			print("NOT CONVERTED\n" + pdf_converter_notes[pdfto])
+			if entry:
+				itemless_entries.append( (pdffile, entry) )
+			continue
+		elif res != 0:
+			print("ERROR")
+			exit(1)
+		print("DONE")
+
+		if pdfto == "pdf":
+			pages = [pdffile]
+		else:
+			pages = pdf_pages(outdir)
+			if keys[i]:
+				cache_pdf(keys[i], itemdir +S+ outdir)
+
+		for page in pages:
+			items.append( ["items" +S+ page, {'.link':"items" +S+ pdffile}, pdffile, entry] )
+		if not pages and entry:
+			itemless_entries.append( (pdffile, entry) )
 #}}}
 
 def is_local(filename):#{{{
@@ -535,21 +1809,20 @@ def find_items(ff):#{{{
 	""" return unfiltered list of items from specified directories """
 	global gdir
 
-	abs_gdir = os.path.abspath(gdir)
-
 	# return remote file name
 	if not is_local(ff):
 		yield ff
 	else:
-		# recursively look for other files
-		for f in walk(ff):
-			abs_f = os.path.abspath(f)
-			# ignore gallery generated directories
-			if abs_f.startswith(abs_gdir+S+"files"+S) or \
-			   abs_f.startswith(abs_gdir+S+"items"+S) or \
-			   abs_f.startswith(abs_gdir+S+"thumbs"+S):
-				continue
+		# ignore gallery generated directories
+		abs_gdir = os.path.abspath(gdir)
+		skip = set( [abs_gdir+S+"files", abs_gdir+S+"items", abs_gdir+S+"items.old", abs_gdir+S+"thumbs"] )
+		abs_ff = os.path.abspath(ff)
+		for d in skip:
+			if abs_ff == d or abs_ff.startswith(d+S):
+				return
 
+		# recursively look for other files
+		for f in walk(ff, skip):
 			yield f
 #}}}
 
@@ -563,253 +1836,2255 @@ class Type:
 	PDF = 5
 	TAG = 6
 
-def item_type(f):
-	global re_img, re_font, re_vid, re_tag
-
-	types = {
-		Type.IMAGE: re_img,
-		Type.FONT:  re_font,
-		Type.VIDEO: re_vid,
-		Type.HTML:  re_html,
-		Type.PDF:   re_pdf,
-		Type.TAG:   re_tag
+# item types by file extension
+extension_types = {
+	'.jpg': Type.IMAGE, '.png': Type.IMAGE, '.apng': Type.IMAGE,
+	'.gif': Type.IMAGE, '.svg': Type.IMAGE,
+	'.otf': Type.FONT, '.ttf': Type.FONT,
+	'.mp4': Type.VIDEO, '.mov': Type.VIDEO, '.flv': Type.VIDEO,
+	'.ogg': Type.VIDEO, '.mp3': Type.VIDEO, '.wav': Type.VIDEO,
+	'.html': Type.HTML,
+	'.pdf': Type.PDF
 	}
 
-	for t, re in types.items():
-		if re.search(f) != None:
-			return t
+def item_type(f):
+	global re_tag
+
+	if f.startswith("$(") and re_tag.search(f) != None:
+		return Type.TAG
+
+	i = f.rfind('.')
+	if i == -1:
+		return Type.UNKNOWN
+
+	return extension_types.get( f[i:].lower(), Type.UNKNOWN )
+#}}}
+
+def source_entry(filename):#{{{
+	""" return new manifest entry for local file or None if file is not accessible """
+	# file in unchanged directory of watched gallery
+	cache = None
+	if stat_cache is not None:
+		cache = stat_cache.setdefault( os.path.normpath(os.path.dirname(filename)), {} )
+		if filename in cache:
+			return dict(cache[filename], items=[])
+
+	try:
+		st = os.stat(filename)
+	except OSError:
+		return None
+
+	entry = {
+		'source': os.path.abspath(filename),
+		'size': st.st_size,
+		'mtime': st.st_mtime,
+		'items': []
+		}
+	if cache is not None:
+		cache[filename] = entry
+		entry = dict(entry, items=[])
+	return entry
+#}}}
+
+def remove_items(entry):#{{{
+	""" remove files created in gallery for manifest entry in previous build """
+	paths = [(item[0], item[1].get('.thumbnail_ext', 'png')) for item in entry['items']]
+	if entry.get('link'):
+		paths.append( (entry['link'], 'png') )
+
+	for path, ext in paths:
+		path = path.replace(':','_')
+		thumb = gdir +S+ "thumbs" +S+ path
+		for f in [gdir +S+ path, thumb + "." + ext, thumb + ".poster.jpg"] + \
+				["%s@%d.%s" % (thumb, res, ext) for res in thumbnail_resolutions]:
+			if is_gallery_file(f) and (os.path.islink(f) or os.path.isfile(f)):
+				os.remove(f)
+
+	if entry.get('pages'):
+		pages = gdir +S+ entry['pages']
+		if os.path.isdir(pages):
+			shutil.rmtree(pages)
+#}}}
 
-	return Type.UNKNOWN
+def is_gallery_file(f):#{{{
+	""" return False if file is in source directory linked to gallery """
+	return os.path.realpath( os.path.dirname(f) ).startswith( os.path.realpath(gdir) + S )
 #}}}
 
-def gallery_items(files, allitems):#{{{
+def remove_old_items():#{{{
+	""" remove items of previous build which were not reused """
+	global olditemdir
+	if olditemdir:
+		shutil.rmtree(olditemdir)
+		olditemdir = None
+#}}}
+
+def remove_stale_items():#{{{
+	""" remove items of files which were removed since previous build """
+	for f, entry in manifest.get('files', {}).items():
+		if f not in new_sources:
+			remove_items(entry)
+#}}}
+
+def gallery_items(files, pdfs):#{{{
 	"""
 	finds all usable items in specified files/directories (argument),
-	copy items to "items/" (if --local not set),
-	return items
+	PDF files are appended to pdfs to be rendered later (see render_pdfs()),
+	return list of (sorter, linked_directories) for each file/directory,
+	items are [name, properties, source_file, manifest_entry]
+	and are linked to "items/" when sorted (see add_sorted())
 	"""
-	global re_img, re_font, re_vid, gdir
-
-	imgdir = gdir+S+"items"
+	oldfiles = manifest.get('files', {})
+	found = []
 	# find items in input files/directories
 	for ff in files:
-		items = {}
-		for f in find_items(ff):
-			# filetype (image, font, audio/video)
-			t = item_type(f)
-
-			if t>0:
-				# file is local and not viewed locally
-				if not local and is_local(f):
-					destdir = dirname(f)
-					basename = os.path.basename(f)
-					fdir = imgdir +S+ destdir
-					if not os.path.isdir(fdir):
-						os.makedirs(fdir)
-					cp( os.path.abspath(f), fdir +S+ basename )
-
-				# TODO: fetch remote PDF before rendering
-				if t == Type.PDF:
-					for page in renderPDF(f):
-						items["items" +S+ page] = {'.link':"items" +S+ f}
-				else:
-					f = "items" +S+ (destdir and destdir+S or "") + os.path.basename(f)
-					items[f] = {}
+		sorter = ItemSorter()
+		start = len(pdfs)
+		itemless = len(itemless_entries)
+
+		phase("scan")
+		def scan():
+			for f in find_items(ff):
+				count_items(1)
+				add_file(f, sorter, pdfs, oldfiles)
+				yield f
+
+		# directories with only gallery items are linked as whole
+		linked = set()
+		if cp == os.symlink and not local and is_local(ff) and os.path.isdir(ff):
+			linked = link_directories(ff, scan())
+		else:
+			for f in scan():
+				pass
+		found.append( (sorter, linked) )
+
+		# PDF files are linked even if they have no pages
+		phase("link")
+		for pdffile, items, entry in pdfs[start:]:
+			link_file(pdffile, entry, linked)
+		for f, entry in itemless_entries[itemless:]:
+			link_file(f, entry, linked)
+
+	return found
+#}}}
 
-		add_sorted(items, allitems)
+def add_file(f, items, pdfs, oldfiles):#{{{
+	"""
+	add items of file f to items (see ItemSorter), items of unchanged
+	file are reused from previous build (oldfiles)
+	"""
+	# filetype (image, font, audio/video)
+	t = item_type(f)
+	if t <= 0:
+		return
+
+	# remember source file in build manifest
+	entry = is_local(f) and source_entry(f) or None
+	if entry:
+		if update:
+			new_sources.add(f)
+		# only files with same size are compared (see Deduplicator),
+		# empty files are not copies of each other
+		if dedup_mode != "none" and t != Type.PDF and entry['size']:
+			file_sizes[entry['size']] = file_sizes.get(entry['size'], 0) + 1
+
+		old = oldfiles.get(f)
+		if old:
+			if old['source'] == entry['source'] and \
+			   old['size'] == entry['size'] and \
+			   old['mtime'] == entry['mtime']:
+				# reuse items of unchanged file
+				if 'pages' in old:
+					entry['pages'] = old['pages']
+				if stat_cache is not None and old.get('link'):
+					# link from previous update of watched gallery
+					entry['link'] = old['link']
+				for name, props in old['items']:
+					items.append( [name, props, f, entry] )
+					unchanged_items.add(name)
+				if not old['items']:
+					itemless_entries.append( (f, entry) )
+				return
+			else:
+				# file modified
+				remove_items(old)
+
+	# TODO: fetch remote PDF before rendering
+	if t == Type.PDF:
+		if entry:
+			entry['pages'] = "items" +S+ f + "_pages"
+		pdfs.append( (f, items, entry) )
+	else:
+		destdir = dirname(f)
+		name = "items" +S+ (destdir and destdir+S or "") + os.path.basename(f)
+		items.append( [name, {}, f, entry] )
+#}}}
+
+def link_file(f, entry, linked):#{{{
+	"""
+	link local file to items directory (if --local not set) unless it's in
+	one of linked directories, path to link is kept in manifest entry
+	"""
+	if local or not is_local(f) or in_linked_dir(f, linked):
+		if entry:
+			entry.pop('link', None)
+	elif not entry:
+		link_item(f)
+	elif not entry.get('link'):
+		entry['link'] = link_item(f)
+#}}}
+
+def link_item(f):#{{{
+	""" link (or copy) file to items directory, return path to link in gallery """
+	destdir = dirname(f)
+	basename = os.path.basename(f)
+	fdir = gdir +S+ "items" +S+ destdir
+	if not os.path.isdir(fdir):
+		os.makedirs(fdir)
+	# link from previous build is kept
+	if not (cp == os.symlink and os.path.islink(fdir +S+ basename)):
+		cp( os.path.abspath(f), fdir +S+ basename )
+	return "items" +S+ (destdir and destdir+S or "") + basename
+#}}}
+
+def in_linked_dir(f, linked):#{{{
+	""" return True if file is in one of linked directories """
+	if not linked:
+		return False
+	d = os.path.dirname(f)
+	while d:
+		if d in linked:
+			return True
+		parent = os.path.dirname(d)
+		if parent == d:
+			break
+		d = parent
+	return False
+#}}}
+
+def link_directories(ff, files):#{{{
+	"""
+	link topmost subdirectories of ff (or ff itself) which contain only
+	gallery items to items directory, return set of linked directories,
+	files in other directories are linked separately
+	"""
+	root = ff.rstrip(S) or S
+	if ff == ".":
+		root = ""
+
+	# directories which contain (even in subdirectories) files other than
+	# items or files created by gallery (PDF pages, rendered fonts)
+	mixed = set()
+	def mark(d):
+		while d not in mixed:
+			mixed.add(d)
+			parent = os.path.dirname(d)
+			if d == root or parent == d:
+				break
+			d = parent
+
+	dirs = set()
+	for f in files:
+		d = os.path.dirname(f)
+		t = item_type(f)
+		if t <= 0 or t == Type.PDF or (t == Type.FONT and font_render):
+			mark(d)
+		else:
+			while d not in dirs:
+				dirs.add(d)
+				parent = os.path.dirname(d)
+				if d == root or parent == d:
+					break
+				d = parent
+
+	# gallery inside the directory
+	abs_ff = os.path.abspath(ff)
+	abs_gdir = os.path.abspath(gdir)
+	if abs_gdir.startswith(abs_ff + S):
+		mark( (root and root+S or "") + abs_gdir[len(abs_ff)+1:] )
+
+	linked = set()
+	for d in dirs:
+		if d in mixed or (d != root and os.path.dirname(d) not in mixed):
+			continue
+		# path must be inside items directory
+		parts = d.split(S)
+		if not d or "." in parts or ".." in parts:
+			continue
+		if link_directory(d):
+			linked.add(d)
+
+	return linked
+#}}}
+
+def link_directory(d):#{{{
+	""" create symbolic link to directory in items directory, return True on success """
+	link = "items" +S+ d.replace(':','_')
+	dest = gdir +S+ link
+	src = os.path.abspath(d)
+
+	if os.path.islink(dest):
+		os.remove(dest)
+	elif os.path.isdir(dest):
+		# replace links to files created by previous build
+		for root, dirs, files in os.walk(dest):
+			for f in files:
+				if not os.path.islink(root +S+ f):
+					return False
+		shutil.rmtree(dest)
+
+	parent = os.path.dirname(dest)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	try:
+		os.symlink(src, dest)
+	except OSError:
+		return False
+
+	new_manifest['dirs'].append(link)
+	return True
+#}}}
+
+def is_copy(item):#{{{
+	""" return True if item is new copy of other item (see --dedup) """
+	return item[0] in duplicate_items and item[0] not in unchanged_items
+#}}}
+
+def copied_items(items, originals):#{{{
+	"""
+	return list of (first_item, item) for items which are new copies of
+	other items (see is_copy()), originals (name of first item -> item)
+	are updated with items
+	"""
+	copies = []
+	for item in items:
+		if item[0] in originals:
+			originals[item[0]] = item
+		elif is_copy(item):
+			orig = originals.get( duplicate_items[item[0]] )
+			if orig:
+				copies.append( (orig, item) )
+	return copies
+#}}}
+
+def share_font(orig, font, cssfile):#{{{
+	""" use name, rendered image and subset of font orig for its copy """
+	props = orig[1]
+	if '.alias' in props:
+		font[1]['.alias'] = props['.alias']
+
+	try:
+		if font_render:
+			# rendered image is replaced when font changes so it's not linked
+			outfile = "items" +S+ font[0] + ".png"
+			if os.path.exists(gdir +S+ orig[0]):
+				makedirs( os.path.dirname(gdir +S+ outfile) )
+				shutil.copyfile(gdir +S+ orig[0], gdir +S+ outfile)
+			font[1]['.link'] = to_url(font[0])
+			font[0] = outfile
+			duplicate_items[outfile] = orig[0]
+			return
+
+		cssfile.write( fontface(font[0]) )
+		ext = props.get('.font_subset')
+		if ext:
+			subsetfile = thumbnail_file(font[0], font[1]) + "." + ext
+			makedirs( os.path.dirname(subsetfile) )
+			shutil.copyfile(thumbnail_file(orig[0], props) + "." + ext, subsetfile)
+			font[1]['.font_subset'] = ext
+			cssfile.write( thumbnail_fontface(font[0], ext) )
+	except (IOError, OSError) as e:
+		print("ERROR: "+str(e)+" (file: \""+font[0]+"\")")
 #}}}
 
 def create_fontfaces(items):#{{{
+	"""
+	write font faces to "fonts.css", set names of fonts and render fonts,
+	items are processed in chunks, returns stream of updated items
+	"""
 	cssfile = codecs.open( gdir +S+ "fonts.css", "w", "utf-8" )
 
-	fonts = [font for font in filter(lambda x: re_font.search(x[0]), items)]
-
 	# number of fonts
-	n = len(fonts)
+	n = sum(1 for item in items if re_font.search(item[0]))
+	count_items(n)
 	if n == 0:
-		return # no fonts
+		cssfile.close()
+		return items # no fonts
+
+	index = load_font_index()
+	index_changed = False
 
 	# progress bar
 	i = 0
-	bar = ">" + (" "*progress_len)
-	sys.stdout.write( "Creating fontfaces: [%s] %d/%d\r"%(bar,0,n) )
-
-	for font in fonts:
-		# if file is font: create font-face line in css or render it
-		f, alias, link = addFont(font[0], cssfile)
-		font[0] = f
-
-		props = font[1]
-		if alias:
-			props['.alias'] = alias
-		if link:
-			props['.link'] = to_url(link)
-
-		# show progress bar
-		i=i+1
-		l = int(i*progress_len/n)
-		bar = ("="*l) + ">" + (" "*(progress_len-l))
-		sys.stdout.write( "Creating fontfaces: [%s] %d/%d%s"%(bar,i,n,i==n and "\n" or "\r") );
-		sys.stdout.flush()
+	show_progress("Creating fontfaces", i, n)
+
+	originals = dict.fromkeys( duplicate_items.values() )
+	out = ItemStream()
+	for chunk in chunks(items):
+		done = i
+		copies = copied_items(chunk, originals)
+		fontjobs = []
+		for font in chunk:
+			if not re_font.search(font[0]) or is_copy(font):
+				continue
+			if font[0] in unchanged_items:
+				# font name is known from previous build
+				cssfile.write( fontface(font[0]) )
+				if '.font_subset' in font[1]:
+					cssfile.write( thumbnail_fontface(font[0], font[1]['.font_subset']) )
+				i=i+1
+				continue
+
+			f = font_path(font[0])
+
+			# font name from index
+			name = None
+			key = os.path.realpath(f)
+			try:
+				st = os.stat(f)
+				entry = index.get(key)
+				if entry and entry[:2] == [st.st_size, st.st_mtime]:
+					name = entry[2:]
+			except OSError:
+				st = None
+
+			# render font or create font-face line in css
+			outfile = None
+			subsetfile = None
+			if font_render:
+				outfile = "items" +S+ font[0] + ".png"
+			else:
+				cssfile.write( fontface(font[0]) )
+				if fontsubset and font_thumbnail_text:
+					subsetfile = thumbnail_file(font[0], font[1]) + "." + font_subset_format
+
+			fontjobs.append( (font, key, st, (f, name, outfile and gdir +S+ outfile, font_size, font_text, subsetfile)) )
+
+		if i > done:
+			show_progress("Creating fontfaces", i, n)
+
+		# fonts with known name which are not rendered don't need to be opened
+		openjobs = [(font, job) for font, key, st, job in fontjobs if job[1] is None or job[2] or job[5]]
+		results = parallel_map( font_job, [job for font, job in openjobs],
+				[font[0] for font, job in openjobs] )
+		for font, key, st, job in fontjobs:
+			f, name, outfile, size, text, subsetfile = job
+			if name is None or outfile or subsetfile:
+				name, errors = next(results)
+				for error in errors:
+					print("ERROR: "+error+" (file: \""+font[0]+"\")")
+				if name and st and job[1] is None:
+					index[key] = [st.st_size, st.st_mtime] + list(name)
+					index_changed = True
+
+			if subsetfile and os.path.exists(subsetfile):
+				font[1]['.font_subset'] = font_subset_format
+				cssfile.write( thumbnail_fontface(font[0], font_subset_format) )
+
+			props = font[1]
+			if name:
+				props['.alias'] = name[1] and name[0] + " " + name[1] or name[0]
+			if outfile:
+				props['.link'] = to_url(font[0])
+				font[0] = "items" +S+ font[0] + ".png"
+
+			# show progress bar
+			i=i+1
+			show_progress("Creating fontfaces", i, n)
+
+		# copies of fonts use results of first font (see --dedup)
+		for orig, font in copies:
+			if re_font.search(font[0]):
+				share_font(orig, font, cssfile)
+				i=i+1
+				show_progress("Creating fontfaces", i, n)
+
+		out.extend(chunk)
 
 	cssfile.close()
+	items.close()
+
+	if index_changed:
+		write_font_index(index)
+
+	return out
+#}}}
+
+def has_webp():#{{{
+	""" return True if PIL can write WebP images """
+	try:
+		from PIL import features
+		return features.check('webp')
+	except Exception:
+		return False
+#}}}
+
+def encode_image(im, fmt, **options):#{{{
+	""" return image encoded in given format """
+	buf = io.BytesIO()
+	im.save(buf, fmt, **options)
+	return buf.getvalue()
+#}}}
+
+def encode_png(im, budget):#{{{
+	""" return PNG data, colors are reduced if data exceed budget """
+	data = encode_image(im, "PNG")
+	if budget and len(data) > budget and im.mode in ("RGB", "RGBA"):
+		try:
+			data = min( data, encode_image(im.quantize(256), "PNG", optimize=True), key=len )
+		except ValueError:
+			pass # cannot quantize image in this mode
+	return data
+#}}}
+
+def encode_lossy(im, fmt, budget):#{{{
+	"""
+	return image data in lossy format (JPEG or WebP),
+	quality is lowered until data fit in budget
+	"""
+	if fmt == "JPEG" or ('A' not in im.mode and 'transparency' not in im.info):
+		if im.mode not in ("RGB", "L"):
+			# JPEG has no alpha channel -- transparent areas are white
+			im = im.convert("RGBA")
+			bg = Image.new("RGB", im.size, (255,255,255))
+			bg.paste(im, mask=im.split()[3])
+			im = bg
+	elif im.mode != "RGBA":
+		im = im.convert("RGBA")
+
+	data = encode_image(im, fmt, quality=thumb_quality)
+	if budget and len(data) > budget:
+		# find highest quality which fits in budget
+		lo, hi = 5, thumb_quality - 1
+		data = encode_image(im, fmt, quality=lo)
+		while lo < hi:
+			q = (lo + hi + 1)//2
+			d = encode_image(im, fmt, quality=q)
+			if len(d) <= budget:
+				data, lo = d, q
+			else:
+				hi = q - 1
+	return data
 #}}}
 
-def create_thumbnail(filename, resolution, outfile):#{{{
-	# create directory for output file
-	d = dirname(outfile)
-	if not os.path.exists(d):
-		os.makedirs(d)
+def encode_jpeg(im, budget):#{{{
+	return encode_lossy(im, "JPEG", budget)
+#}}}
+
+def encode_webp(im, budget):#{{{
+	return encode_lossy(im, "WEBP", budget)
+#}}}
+
+# thumbnail format -> (file extension, encoder)
+thumbnail_encoders = {
+	'png': ('png', encode_png),
+	'jpeg': ('jpg', encode_jpeg),
+	'webp': ('webp', encode_webp)
+	}
+
+def is_flat_image(im):#{{{
+	""" return True if image is transparent or has only few colors """
+	if 'A' in im.mode or 'transparency' in im.info:
+		alpha = im.convert("RGBA").split()[3]
+		if alpha.getextrema()[0] < 255:
+			return True
+	return im.getcolors(256) is not None
+#}}}
+
+def thumbnail_encoder(im):#{{{
+	"""
+	return file extension and encoder for thumbnail of image,
+	"auto" format is PNG for drawings and transparent images and JPEG for photos
+	"""
+	fmt = thumb_format
+	if fmt == "auto":
+		if im.format != "JPEG" and is_flat_image(im):
+			fmt = "png"
+		else:
+			fmt = "jpeg"
+	return thumbnail_encoders[fmt]
+#}}}
+
+def save_thumbnail(data, filename):#{{{
+	# don't overwrite hard linked thumbnail from cache
+	if os.path.exists(filename):
+		os.remove(filename)
+	f = open(filename, "wb")
+	try:
+		f.write(data)
+	finally:
+		f.close()
+#}}}
+
+def create_thumbnail(filename, resolution, outfile, extra=()):#{{{
+	"""
+	create thumbnail "<outfile>.<ext>" and thumbnails "<outfile>@<res>.<ext>"
+	for additional resolutions (from single decoded image),
+	return size of the thumbnail, list of created additional resolutions,
+	file extension and placeholder (see thumbnail_placeholder())
+	"""
+	makedirs( dirname(outfile) )
 
 	im = Image.open(filename)
+	orig = im.size
 
 	# better scaling quality when image is in RGB or RGBA
 	#if not im.mode.startswith("RGB"):
 		#im = im.convert("RGB")
 
-	# scale and save
-	im.thumbnail( (resolution,resolution), Image.ANTIALIAS )
-	im.save( outfile + ".png", "PNG", quality=60 )
+	# scale down gradually from the highest resolution
+	resolutions = sorted( set([resolution] + list(extra)), reverse=True )
+	if fast_thumbnails:
+		im = reduced_image(im, resolutions[0])
+
+	# choose format before resampling blends colors
+	ext, encode = thumbnail_encoder(im)
+
+	size = None
+	done = []
+	sizes = [fit_size(orig, resolution)]
+	for res in resolutions:
+		# skip thumbnails with same size
+		if res != resolution:
+			if fit_size(orig, res) in sizes:
+				continue
+			sizes.append( fit_size(orig, res) )
+
+		if fast_thumbnails:
+			im.thumbnail( (res,res), ANTIALIAS )
+		else:
+			try:
+				# newer PIL decodes JPEG in lower resolution by default
+				im.thumbnail( (res,res), ANTIALIAS, reducing_gap=None )
+			except TypeError:
+				im.thumbnail( (res,res), ANTIALIAS )
+
+		# budget for additional thumbnails is proportional to their area
+		budget = thumb_bytes*res*res//(resolution*resolution)
+		if res == resolution:
+			save_thumbnail( encode(im, budget), outfile + "." + ext )
+			size = im.size
+		else:
+			save_thumbnail( encode(im, budget), "%s@%d.%s" % (outfile, res, ext) )
+			done.append(res)
+
+	# placeholder from the smallest thumbnail
+	return size, sorted(done), ext, thumbnail_placeholder(im)
+#}}}
+
+def thumbnail_placeholder(im):#{{{
+	"""
+	return dominant color ("#rrggbb") or data URL of tiny PNG image shown
+	before thumbnail is loaded (see --placeholder), images with transparency
+	have no placeholder (it would be visible through the thumbnail)
+	"""
+	if placeholder == "none" or 'A' in im.mode or 'transparency' in im.info:
+		return None
+
+	im = im.convert("RGB")
+	im.thumbnail( (placeholder_size, placeholder_size), ANTIALIAS )
+	if placeholder == "color":
+		im = im.quantize(8)
+		count, color = max( im.getcolors() )
+		return "#%02x%02x%02x" % tuple( im.getpalette()[color*3:color*3+3] )
+
+	# browser blurs the image when it's scaled up
+	data = io.BytesIO()
+	im.save(data, "PNG", optimize=True)
+	return "data:image/png;base64," + base64.b64encode( data.getvalue() ).decode('ascii')
+#}}}
+
+def fit_size(size, resolution):#{{{
+	""" return size of image scaled down to fit in resolution x resolution """
+	w, h = size
+	m = max(w, h)
+	if m <= resolution:
+		return w, h
+	return max(1, w*resolution//m), max(1, h*resolution//m)
+#}}}
+
+def tiff_entries(tiff, order, ifd):#{{{
+	"""
+	return entries of TIFF IFD at offset ifd (tag -> (type, count, value field))
+	and offset of next IFD
+	"""
+	n = struct.unpack(order+'H', tiff[ifd:ifd+2])[0]
+	entries = {}
+	for i in range(n):
+		entry = tiff[ifd+2+i*12:ifd+14+i*12]
+		tag, typ, count = struct.unpack(order+'HHL', entry[:8])
+		entries[tag] = (typ, count, entry[8:])
+	return entries, struct.unpack(order+'L', tiff[ifd+2+n*12:ifd+6+n*12])[0]
+#}}}
+
+def tiff_long(order, entry):#{{{
+	""" return value of TIFF entry of type LONG or 0 """
+	if not entry or entry[0] not in (4, 13): # LONG or IFD
+		return 0
+	return struct.unpack(order+'L', entry[2])[0]
+#}}}
 
-	return im.size
+def tiff_string(tiff, order, entry):#{{{
+	""" return value of TIFF entry of type ASCII or empty string """
+	if not entry or entry[0] != 2:
+		return ""
+	typ, count, value = entry
+	# longer strings are stored at offset in value field
+	if count > 4:
+		offset = struct.unpack(order+'L', value)[0]
+		value = tiff[offset:offset+count]
+	return value[:count].split(b'\x00')[0].decode('utf-8', 'replace').strip()
+#}}}
+
+def exif_thumbnail(im):#{{{
+	""" return thumbnail embedded in EXIF data of JPEG image or None """
+	exif = im.info.get('exif')
+	if not exif or exif[:6] != b'Exif\x00\x00':
+		return None
+
+	try:
+		# TIFF structure: header, IFD0 (image), IFD1 (thumbnail)
+		tiff = exif[6:]
+		order = tiff[:2] == b'MM' and '>' or '<'
+		ifd = struct.unpack(order+'L', tiff[4:8])[0]
+		ifd = tiff_entries(tiff, order, ifd)[1]
+		if not ifd:
+			return None
+
+		entries = tiff_entries(tiff, order, ifd)[0]
+		offset = tiff_long( order, entries.get(0x0201) ) # JPEGInterchangeFormat
+		length = tiff_long( order, entries.get(0x0202) ) # JPEGInterchangeFormatLength
+		if not offset or not length:
+			return None
+
+		thumb = Image.open( io.BytesIO(tiff[offset:offset+length]) )
+		thumb.load()
+		return thumb
+	except Exception:
+		return None
+#}}}
+
+def reduced_image(im, resolution):#{{{
+	"""
+	return image decoded in lowest resolution sufficient for thumbnail,
+	JPEG is decoded with DCT scaling or replaced by EXIF thumbnail,
+	other images are reduced before resampling
+	"""
+	w, h = im.size
+	tw, th = fit_size(im.size, resolution)
+	if (tw, th) == (w, h):
+		return im
+
+	if im.format == "JPEG":
+		# EXIF thumbnail must be big enough and have same aspect ratio
+		# (some cameras add black borders)
+		thumb = exif_thumbnail(im)
+		if thumb:
+			ew, eh = thumb.size
+			if ew >= tw and eh >= th and abs(ew*h - eh*w) <= max(w, h):
+				return thumb
+
+		im.draft(im.mode, (tw, th))
+	elif hasattr(im, 'reduce') and im.mode in ("L", "LA", "RGB", "RGBA"):
+		factor = min(w//tw, h//th)
+		if factor > 1:
+			im = im.reduce(factor)
+
+	return im
+#}}}
+
+def link_or_copy(src, dest):#{{{
+	""" create hard link of file src, copy the file if linking fails """
+	if os.path.exists(dest):
+		os.remove(dest)
+	try:
+		os.link(src, dest)
+	except (OSError, AttributeError):
+		shutil.copyfile(src, dest)
+#}}}
+
+def file_hash(filename):#{{{
+	""" return SHA-1 hash of file content """
+	h = hashlib.sha1()
+	f = open(filename, 'rb')
+	try:
+		for chunk in iter(lambda: f.read(1<<20), b''):
+			h.update(chunk)
+	finally:
+		f.close()
+	return h.hexdigest()
+#}}}
+
+def partial_hash(filename):#{{{
+	""" return SHA-1 hash of first and last 64 KiB of file """
+	h = hashlib.sha1()
+	f = open(filename, 'rb')
+	try:
+		h.update( f.read(1<<16) )
+		size = os.fstat( f.fileno() ).st_size
+		if size > 1<<16:
+			f.seek( max(1<<16, size - (1<<16)) )
+			h.update( f.read() )
+	finally:
+		f.close()
+	return h.hexdigest()
+#}}}
+
+class Deduplicator(object):#{{{
+	"""
+	finds files with same content as previously added files (see --dedup),
+	files are compared by size (see file_sizes), then by hash of first and
+	last block and only then by hash of whole content
+	"""
+	def __init__(self):
+		# (size, partial hash) -> [filename or None if hashed, item name]
+		self.partial = {}
+		# (size, hash) -> item name
+		self.full = {}
+		self.count = 0
+
+	def original(self, filename, size, name):
+		""" return name of first item with same content as filename or None """
+		if file_sizes.get(size, 0) < 2:
+			return None
+
+		try:
+			key = (size, partial_hash(filename))
+			first = self.partial.get(key)
+			if first is None:
+				self.partial[key] = [filename, name]
+				return None
+
+			# whole content is read only if there are more candidates
+			if first[0]:
+				self.full.setdefault( (size, file_hash(first[0])), first[1] )
+				first[0] = None
+			key = (size, file_hash(filename))
+		except (IOError, OSError):
+			return None # error is reported when creating thumbnail
+
+		orig = self.full.setdefault(key, name)
+		if orig == name:
+			return None
+		self.count = self.count + 1
+		return orig
+#}}}
+
+def thumbnail_cache_key(filename, resolution):#{{{
+	"""
+	return key of thumbnail in cache,
+	key is computed from real file path, size and modification time
+	or from file content (--cache-hash)
+	"""
+	if cache_hash:
+		key = "sha1:" + file_hash(filename)
+	else:
+		st = os.stat(filename)
+		key = "%s:%d:%r" % (os.path.realpath(filename), st.st_size, st.st_mtime)
+	key = "%s:%d" % (key, resolution)
+	if thumbnail_resolutions:
+		key = key + "@" + ",".join( [str(x) for x in thumbnail_resolutions] )
+	if not fast_thumbnails:
+		key = key + ":full"
+	if thumb_format != "png" or thumb_bytes:
+		key = "%s:%s:%d" % (key, thumb_format, thumb_bytes)
+	if placeholder != "none":
+		key = "%s:placeholder:%s" % (key, placeholder)
+	if re_vid.search(filename):
+		key = "%s:poster:%r:%s" % (key, poster_time, poster_command)
+
+	# file names which are not valid UTF-8 contain surrogate escapes
+	return hashlib.sha1( key.encode('utf-8', 'surrogateescape') ).hexdigest()
+#}}}
+
+def link_thumbnails(src, dest, extra, ext, poster=False):#{{{
+	"""
+	link thumbnail "<src>.<ext>", thumbnails in additional resolutions
+	and video poster (if poster is True) to dest
+	"""
+	makedirs( os.path.dirname(dest) )
+	link_or_copy(src + "." + ext, dest + "." + ext)
+	for res in extra:
+		link_or_copy( "%s@%d.%s" % (src, res, ext), "%s@%d.%s" % (dest, res, ext) )
+	if poster:
+		link_or_copy(src + ".poster.jpg", dest + ".poster.jpg")
+#}}}
+
+def cache_file(key):#{{{
+	""" return path to cache entry without extension """
+	return cachedir +S+ key[:2] +S+ key
+#}}}
+
+def cached_thumbnail(key, outfile, poster=False):#{{{
+	"""
+	link cached thumbnails (and video poster if poster is True) to outfile
+	and return thumbnail size, list of additional resolutions, file
+	extension and placeholder or None if not cached
+	"""
+	f = cache_file(key)
+	try:
+		sizefile = open(f + ".size")
+		try:
+			lines = sizefile.read().split("\n")
+		finally:
+			sizefile.close()
+		# "<width> <height> [<resolution>...] [<extension>]" and placeholder
+		# on second line
+		size = lines[0].split()
+		placeholder = len(lines) > 1 and lines[1].strip() or None
+		ext = "png"
+		if size and not size[-1].isdigit():
+			ext = size.pop()
+		size = [int(x) for x in size]
+		size, extra = size[:2], size[2:]
+
+		link_thumbnails(f, outfile, extra, ext, poster)
+		if poster:
+			os.utime(f + ".poster.jpg", None)
+
+		# mark thumbnail as recently used
+		os.utime(f + "." + ext, None)
+	except (IOError, OSError, ValueError):
+		return None
+
+	return size, extra, ext, placeholder
+#}}}
+
+def cache_thumbnail(key, outfile, size, extra, ext, placeholder=None):#{{{
+	""" store thumbnails in cache """
+	f = cache_file(key)
+	try:
+		link_thumbnails(outfile, f, extra, ext, os.path.exists(outfile + ".poster.jpg"))
+
+		# thumbnail size is written last so incomplete entries are ignored
+		sizefile = open(f + ".size", "w")
+		try:
+			sizefile.write( " ".join([str(x) for x in list(size) + list(extra)] + [ext]) )
+			if placeholder:
+				sizefile.write( "\n" + placeholder )
+		finally:
+			sizefile.close()
+	except (IOError, OSError) as e:
+		print("WARNING: Cannot store thumbnail in cache: "+str(e))
+#}}}
+
+def cached_no_frame(key):#{{{
+	""" return True if cache remembers that video has no frame for poster """
+	try:
+		# mark entry as recently used
+		os.utime(cache_file(key) + ".noframe", None)
+	except OSError:
+		return False
+	return True
+#}}}
+
+def cache_no_frame(key):#{{{
+	"""
+	remember that video (e.g. audio file) has no frame for poster so
+	poster_command is not run again for the same file (see thumbnail_cache_key())
+	"""
+	f = cache_file(key)
+	try:
+		makedirs( os.path.dirname(f) )
+		open(f + ".noframe", "w").close()
+	except (IOError, OSError) as e:
+		print("WARNING: Cannot store thumbnail in cache: "+str(e))
+#}}}
+
+def prune_thumbnail_cache():#{{{
+	"""
+	remove least recently used thumbnails and PDF pages until cache fits
+	in cache_size
+	"""
+	if not cachedir or not os.path.isdir(cachedir):
+		return
+
+	# all files of entry are removed together (thumbnails, ".size" file and
+	# video poster -- see cache_thumbnail(), directory with PDF pages and
+	# ".files" list -- see cache_pdf()), last use is the newest file of entry,
+	# other files (e.g. font index) are kept
+	entries = {}
+	total = 0
+	for shard in os.listdir(cachedir):
+		shardpath = cachedir +S+ shard
+		if len(shard) != 2 or not os.path.isdir(shardpath):
+			continue
+		for name in os.listdir(shardpath):
+			path = shardpath +S+ name
+			entry = shardpath +S+ re.split(r'[.@]', name, 1)[0]
+			files = [path]
+			if os.path.isdir(path):
+				files = [path +S+ f for f in os.listdir(path)]
+			mtime, size, paths = entries.get( entry, (0, 0, []) )
+			for f in files:
+				try:
+					st = os.stat(f)
+				except OSError:
+					continue
+				mtime = max(mtime, st.st_mtime)
+				size = size + st.st_size
+				total = total + st.st_size
+			entries[entry] = (mtime, size, paths + [path])
+
+	limit = cache_size*1024*1024
+	for mtime, entry in sorted( [(x[0], entry) for entry, x in entries.items()] ):
+		if total <= limit:
+			break
+		mtime, size, paths = entries[entry]
+		for f in paths:
+			try:
+				if os.path.isdir(f):
+					shutil.rmtree(f)
+				else:
+					os.remove(f)
+			except OSError:
+				pass
+		total = total - size
+#}}}
+
+def thumbnail_job(job):#{{{
+	"""
+	create_thumbnail() wrapper for worker processes,
+	returns ((size, additional_resolutions, extension), error)
+	"""
+	infile, resolution, outfile, extra = job
+	try:
+		if re_vid.search(infile):
+			# thumbnail of video is created from poster frame
+			posterfile = outfile + ".poster.jpg"
+			if not extract_poster(infile, posterfile):
+				return None, None # no video stream (e.g. audio file)
+			infile = posterfile
+		return create_thumbnail(infile, resolution, outfile, extra), None
+	except Exception as e:
+		return None, str(e)
+#}}}
+
+def extract_poster(filename, outfile):#{{{
+	"""
+	save video frame at poster_time (or first frame if video is shorter)
+	to outfile using poster_command, return False if no frame was saved
+	"""
+	makedirs( dirname(outfile) )
+	devnull = open(os.devnull, "w")
+	try:
+		for t in (poster_time, 0):
+			if os.path.exists(outfile):
+				os.remove(outfile)
+			args = {'input': filename, 'output': outfile, 'time': t}
+			subprocess.call( [arg % args for arg in shlex.split(poster_command)],
+					stdout=devnull, stderr=devnull )
+			if os.path.exists(outfile) and os.path.getsize(outfile):
+				return True
+			if not poster_time:
+				break
+	finally:
+		devnull.close()
+	return False
+#}}}
+
+def has_command(command):#{{{
+	""" return True if program of command line exists """
+	args = shlex.split(command)
+	if not args:
+		return False
+	if os.path.dirname(args[0]):
+		return os.access(args[0], os.X_OK)
+	for path in os.environ.get('PATH', '').split(os.pathsep):
+		if os.access(os.path.join(path, args[0]), os.X_OK):
+			return True
+	return False
+#}}}
+
+def timed_job(job):#{{{
+	""" call fn(arg) for job (fn, arg) in worker process, returns (seconds, result) """
+	fn, arg = job
+	t = time.time()
+	res = fn(arg)
+	return time.time() - t, res
+#}}}
+
+def parallel_map(fn, args, names=None):#{{{
+	"""
+	yields fn(arg) for every arg in the same order as args,
+	with --stats duration of each call is recorded with name from names
+	"""
+	if not (stats and names):
+		for res in pool_map(fn, args):
+			yield res
+		return
+
+	results = pool_map( timed_job, [(fn, arg) for arg in args] )
+	for name, (seconds, res) in zip(names, results):
+		record_time(seconds, name)
+		yield res
+#}}}
+
+def pool_map(fn, args):#{{{
+	"""
+	yields fn(arg) for every arg in the same order as args,
+	calls are distributed to process pool if more than one job is allowed
+	"""
+	size = jobs or multiprocessing.cpu_count()
+	n = min(size, len(args))
+	if n < 2:
+		for arg in args:
+			yield fn(arg)
+		return
+
+	# kept pools have fixed size
+	pool = worker_pool( multiprocessing.Pool, pools is None and n or size )
+	try:
+		# small chunks keep the progress bar responsive
+		chunksize = max( 1, min(16, len(args)//(n*8)) )
+		for res, usage in pool.imap( accounted_job, [(fn, arg) for arg in args], chunksize ):
+			add_worker_usage(usage)
+			yield res
+	except GeneratorExit:
+		# remaining results are not needed, kept pool finishes pending jobs
+		release_pool(pool, pools is None)
+		raise
+	except:
+		release_pool(pool, True)
+		raise
+	release_pool(pool)
+#}}}
+
+def init_worker(options):#{{{
+	""" set options in new worker process (see worker_options) """
+	globals().update(options)
+#}}}
+
+def worker_pool(kind, n):#{{{
+	"""
+	return pool of kind multiprocessing.Pool or ThreadPool with n workers,
+	pool is kept for next use if GalleryBuilder keeps pools
+	"""
+	key = (kind, n)
+	if pools is not None and key in pools:
+		return pools[key]
+
+	if kind is ThreadPool:
+		pool = ThreadPool(n)
+	else:
+		options = dict( (name, globals()[name]) for name in worker_options )
+		pool = multiprocessing.Pool(n, init_worker, (options,))
+
+	if pools is not None:
+		pools[key] = pool
+	return pool
+#}}}
+
+def release_pool(pool, terminate=False):#{{{
+	""" close pool unless it's kept for next use, pool is always terminated on error """
+	if pools is not None and pool in pools.values():
+		if not terminate:
+			return
+		for key in [key for key in pools if pools[key] is pool]:
+			del pools[key]
+
+	# finished worker processes are already accounted by each job
+	usage = (cpu_time(),) + io_counters()
+	if terminate:
+		pool.terminate()
+	else:
+		pool.close()
+	pool.join()
+	if not isinstance(pool, ThreadPool):
+		usage2 = (cpu_time(),) + io_counters()
+		for i in range(3):
+			reaped_usage[i] = reaped_usage[i] + usage2[i] - usage[i]
+#}}}
+
+def set_poster_prop(props, outfile):#{{{
+	""" set '.poster' property to URL of video poster if it exists """
+	if os.path.exists(outfile + ".poster.jpg"):
+		url = outfile[len(gdir)+1:] + ".poster.jpg"
+		props['.poster'] = url.replace(S, '/')
+#}}}
+
+def set_thumbnail_props(props, size, extra, ext, placeholder=None):#{{{
+	props['.thumbnail_size'] = list(size)
+	if extra:
+		props['.thumbnail_resolutions'] = list(extra)
+	if ext != "png":
+		props['.thumbnail_ext'] = ext
+	if placeholder:
+		props['.placeholder'] = placeholder
 #}}}
 
 def create_thumbnails(items):#{{{
+	"""
+	create thumbnails of images and videos,
+	items are processed in chunks, returns stream of updated items
+	"""
 	global local, resolution, force, gdir
 
 	thumbdir = gdir+S+"thumbs"
 
-	images = [img for img in filter(lambda x: re_img.search(x[0]), items)]
+	def is_image(item):
+		return re_img.search(item[0]) and item[0] not in unchanged_items
+	def is_video(item):
+		return re_vid.search(item[0]) and item[0] not in unchanged_items and is_local(item[0])
 
 	# number of images
-	n = len(images)
+	n = sum(1 for item in items if is_image(item))
+
+	# thumbnails of local videos are created from poster frames
+	videos = False
+	if poster_command:
+		m = sum(1 for item in items if is_video(item))
+		if m and not has_command(poster_command):
+			print("WARNING: Thumbnails of videos not generated -- command \""+poster_command+"\" not found.")
+		elif m:
+			videos = True
+			n = n + m
+
+	count_items(n)
 	if n == 0:
-		return # no images
+		return items # no images
 
 	# create thumbnail directory
-	os.makedirs(thumbdir)
+	if not os.path.isdir(thumbdir):
+		os.makedirs(thumbdir)
 
 	# progress bar
 	i = 0
-	bar = ">" + (" "*progress_len)
-	sys.stdout.write( "Creating thumbnails: [%s] %d/%d\r"%(bar,0,n) )
-
-	lines = "var ls=[\n"
-	for img in images:
-		f = img[0]
-		props = img[1]
-		w = h = 0
-		try:
+	show_progress("Creating thumbnails", i, n)
+
+	created = False
+	originals = dict.fromkeys( duplicate_items.values() )
+	out = ItemStream()
+	for chunk in chunks(items):
+		copies = copied_items(chunk, originals)
+		images = [item for item in chunk if is_image(item) and not is_copy(item)]
+		if videos:
+			images = images + [item for item in chunk if is_video(item) and not is_copy(item)]
+
+		done = i
+		thumbjobs = []
+		for img in images:
+			f = img[0]
+			props = img[1]
 			if '.link' in props:
 				# use rendered image in '<gallery>/items/<filename>.png'
 				infile = gdir +S+ f.replace(':','_')
-				if local:
-					outfile = thumbdir +S+ f.replace(':','_')
-				else:
-					outfile = thumbdir +S+ f.replace(':','_')
 			else:
-				if not local and is_local(f):
-					infile = gdir +S+ f.replace(':','_')
-				else:
-					infile = os.path.abspath(f)
-				outfile = thumbdir +S+ to_url(f).replace(':','_')
+				infile = item_file(f)
+			outfile = thumbnail_file(f, props)
+
+			# use thumbnail from cache
+			key = None
+			if cachedir:
+				try:
+					key = thumbnail_cache_key(infile, resolution)
+				except (IOError, OSError):
+					pass # error is reported when creating thumbnail
+				res = key and cached_thumbnail(key, outfile, bool(re_vid.search(f)))
+				if res:
+					set_thumbnail_props(props, *res)
+					set_poster_prop(props, outfile)
+				if res or key and re_vid.search(f) and cached_no_frame(key):
+					i=i+1
+					continue
+
+			thumbjobs.append( (img, key, (infile, resolution, outfile, thumbnail_resolutions)) )
+
+		if i > done:
+			show_progress("Creating thumbnails", i, n)
+
+		results = parallel_map( thumbnail_job, [job[2] for job in thumbjobs],
+				[img[0] for img, key, job in thumbjobs] )
+		for (img, key, job), (res, error) in zip(thumbjobs, results):
+			if error is None:
+				if res:
+					set_thumbnail_props(img[1], *res)
+					set_poster_prop(img[1], job[2])
+					if key:
+						cache_thumbnail(key, job[2], *res)
+				elif key and re_vid.search(img[0]):
+					cache_no_frame(key)
+			else:
+				print("ERROR: "+error+" (file: \""+img[0]+"\")")
 
-			w,h = create_thumbnail(infile, resolution, outfile)
-			props['.thumbnail_size'] = [w,h]
-		except Exception as e:
-			print("ERROR: "+str(e)+" (file: \""+f+"\")")
+			# show progress bar
+			i=i+1
+			show_progress("Creating thumbnails", i, n)
 
-		# show progress bar
-		i=i+1
-		l = int(i*progress_len/n)
-		bar = ("="*l) + ">" + (" "*(progress_len-l))
-		sys.stdout.write( "Creating thumbnails: [%s] %d/%d%s"%(bar,i,n,i==n and "\n" or "\r") );
-		sys.stdout.flush()
+		# copies of files use thumbnails of first file (see --dedup)
+		for orig, img in copies:
+			if is_image(img) or videos and is_video(img):
+				share_thumbnail(orig, img)
+				i=i+1
+				show_progress("Creating thumbnails", i, n)
+
+		created = created or bool(thumbjobs)
+		out.extend(chunk)
+
+	items.close()
+
+	if created and cachedir:
+		prune_thumbnail_cache()
 
 	print("Thumbnails successfully generated.")
+	return out
 #}}}
 
-def thumbnail_size(filename, resolution):#{{{
-	""" return same resolution as Image.thumbnail() """
+def share_thumbnail(orig, item):#{{{
+	""" link thumbnails of item orig for its copy """
+	props = orig[1]
+	if '.thumbnail_size' not in props:
+		return
+
+	extra = props.get('.thumbnail_resolutions', [])
+	ext = props.get('.thumbnail_ext', 'png')
+	outfile = thumbnail_file(item[0], item[1])
 	try:
-		im = Image.open(filename)
-		w,h = im.size
-		if w>h:
-			if w>resolution:
-				h = h*resolution/w
-				w = resolution
+		link_thumbnails(thumbnail_file(orig[0], props), outfile, extra, ext, '.poster' in props)
+	except (IOError, OSError) as e:
+		print("ERROR: "+str(e)+" (file: \""+item[0]+"\")")
+		return
+
+	set_thumbnail_props( item[1], props['.thumbnail_size'], extra, ext,
+			props.get('.placeholder') )
+	set_poster_prop(item[1], outfile)
+#}}}
+
+def thumbnail_file(f, props):#{{{
+	""" return path to thumbnail of item without extension """
+	if '.link' in props:
+		return gdir +S+ "thumbs" +S+ f.replace(':','_')
+	return gdir +S+ "thumbs" +S+ to_url(f).replace(':','_')
+#}}}
+
+def sprite_job(job):#{{{
+	"""
+	packs thumbnails into sprite sheets "<prefix>-<n>.<ext>",
+	returns ([sheet_url, x, y] for each thumbnail, error)
+	"""
+	sheetfile, prefix, thumbs, size, fmt = job
+	try:
+		# shelf packing -- highest thumbnails first
+		order = sorted( range(len(thumbs)), key=lambda i: -thumbs[i][2] )
+		positions = [None]*len(thumbs)
+		sheets = []
+		n = x = y = shelf = w = 0
+		for i in order:
+			tw, th = thumbs[i][1:]
+			if x + tw > size:
+				x, y, shelf = 0, y + shelf, 0
+			if y + th > size and (x or y):
+				sheets.append( (w, y + shelf) )
+				n, x, y, shelf, w = n+1, 0, 0, 0, 0
+			positions[i] = (n, x, y)
+			x = x + tw
+			shelf = max(shelf, th)
+			w = max(w, x)
+		sheets.append( (w, y + shelf) )
+
+		images = [Image.new("RGBA", sheet, (0,0,0,0)) for sheet in sheets]
+		for (f, tw, th), (n, x, y) in zip(thumbs, positions):
+			im = Image.open(f)
+			if im.mode != "RGBA":
+				im = im.convert("RGBA")
+			images[n].paste( im, (x, y) )
+
+		makedirs( os.path.dirname(sheetfile) )
+		ext, encode = thumbnail_encoders[fmt]
+		files = ["%s-%d.%s" % (sheetfile, n, ext) for n in range(len(images))]
+		for f, im in zip(files, images):
+			save_thumbnail( encode(im, 0), f )
+
+		# remove sheets of previous build
+		for f in glob.glob(sheetfile + "-*.*"):
+			if f not in files:
+				os.remove(f)
+
+		return [["%s-%d.%s" % (prefix, n, ext), x, y] for n, x, y in positions], None
+	except Exception as e:
+		return None, str(e)
+#}}}
+
+def create_sprites(items):#{{{
+	"""
+	pack thumbnails on each page into sprite sheets
+	and set '.sprite' property ([sheet_url, x, y]) of items,
+	pages are processed in chunks, returns stream of updated items
+	"""
+	out = ItemStream()
+	buffered = []
+	spritejobs = []
+	pageitems = []
+	pages = 1
+	for item in items:
+		buffered.append(item)
+		if not item[0]:
+			add_sprite_job(pageitems, pages, spritejobs)
+			pageitems = []
+			pages = pages + 1
+			# finished pages are processed in chunks
+			if len(buffered) >= stream_chunk:
+				run_sprite_jobs(spritejobs)
+				out.extend(buffered)
+				buffered = []
+				spritejobs = []
+		elif '.thumbnail_size' in item[1] and (re_img.search(item[0]) or re_vid.search(item[0])):
+			pageitems.append(item)
+	add_sprite_job(pageitems, pages, spritejobs)
+	run_sprite_jobs(spritejobs)
+	out.extend(buffered)
+	items.close()
+
+	# remove sheets of removed pages
+	for f in glob.glob( gdir +S+ "thumbs" +S+ "sprites" +S+ "page-*-*.*" ):
+		m = re.search(r'page-(\d+)-\d+\.\w+$', f)
+		if m and int(m.group(1)) > pages:
+			os.remove(f)
+
+	return out
+#}}}
+
+def add_sprite_job(pageitems, page, spritejobs):#{{{
+	""" append job for sprite sheets of n-th page unless the sheets are unchanged """
+	if not pageitems:
+		return
+
+	prefix = "thumbs/sprites/page-%d" % page
+	sheetfile = gdir +S+ "thumbs" +S+ "sprites" +S+ "page-%d" % page
+
+	# sheets of unchanged page are kept
+	for item in pageitems:
+		sprite = item[1].get('.sprite')
+		if not sprite or not sprite[0].startswith(prefix + "-") or \
+		   not os.path.exists( gdir +S+ sprite[0].replace('/', S) ):
+			break
+	else:
+		return
+
+	thumbs = [(thumbnail_file(item[0], item[1]) + "." + item[1].get('.thumbnail_ext', 'png'),) +
+			tuple(item[1]['.thumbnail_size']) for item in pageitems]
+	# lossy sheet only if no thumbnail on page needs lossless format
+	fmt = thumb_format
+	if fmt == "auto":
+		fmt = "png" in [item[1].get('.thumbnail_ext', 'png') for item in pageitems] and "png" or "jpeg"
+	spritejobs.append( (pageitems, (sheetfile, prefix, thumbs, sprite_size, fmt)) )
+#}}}
+
+def run_sprite_jobs(spritejobs):#{{{
+	""" create sprite sheets and set '.sprite' property of items """
+	count_items( sum([len(pageitems) for pageitems, job in spritejobs]) )
+	results = parallel_map( sprite_job, [job[1] for job in spritejobs],
+			[job[0] for pageitems, job in spritejobs] )
+	for (pageitems, job), (positions, error) in zip(spritejobs, results):
+		if error is None:
+			for item, pos in zip(pageitems, positions):
+				item[1]['.sprite'] = pos
 		else:
-			if h>resolution:
-				w = w*resolution/h
-				h = resolution
+			print("ERROR: "+error+" (sprite sheet: \""+job[1]+"\")")
+#}}}
 
-		return [w,h]
-	except:
-		return [0,0]
+def exif_orientation(exif):#{{{
+	""" return orientation (1 to 8) from EXIF data of JPEG image or 1 """
+	try:
+		tiff = exif[6:]
+		order = tiff[:2] == b'MM' and '>' or '<'
+		ifd = struct.unpack(order+'L', tiff[4:8])[0]
+		entry = tiff_entries(tiff, order, ifd)[0].get(0x0112) # Orientation
+		if entry and entry[0] == 3: # SHORT
+			return struct.unpack(order+'H', entry[2][:2])[0]
+	except Exception:
+		pass
+	return 1
 #}}}
 
-def write_items(items):#{{{
-	itemfile = codecs.open( gdir +S+ "items.js", "w", "utf-8" )
-	itemfile.write('var title = "'+title+'";\nvar ls=[\n');
+def jpeg_size(f, exif=None):#{{{
+	"""
+	return size from JPEG SOF segment (swapped if EXIF orientation rotates
+	image by 90 degrees, as browsers display it),
+	EXIF data (APP1 segment) are appended to list exif if it's not None
+	"""
+	orientation = 1
+	f.seek(2)
+	while True:
+		# find next marker
+		b = f.read(1)
+		while b and b != b'\xff':
+			b = f.read(1)
+		while b == b'\xff':
+			b = f.read(1)
+		if not b:
+			return None
+
+		marker = ord(b)
+		if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+			continue # marker without segment
+		if marker in (0xd9, 0xda):
+			return None # end of image or start of scan
+
+		length = struct.unpack('>H', f.read(2))[0]
+		if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+			h, w = struct.unpack('>xHH', f.read(5))
+			if 5 <= orientation <= 8:
+				return [h, w]
+			return [w, h]
+		if marker == 0xe1:
+			data = f.read(length-2)
+			if data[:6] == b'Exif\x00\x00':
+				orientation = exif_orientation(data)
+				if exif is not None:
+					exif.append(data)
+			continue
+		f.seek(length-2, 1)
+#}}}
+
+def mp4_size(f, start, end):#{{{
+	""" return size of first video track from MP4/QuickTime 'tkhd' box """
+	pos = start
+	while pos+8 <= end:
+		f.seek(pos)
+		size, box = struct.unpack('>L4s', f.read(8))
+		header = 8
+		if size == 1:
+			size = struct.unpack('>Q', f.read(8))[0]
+			header = 16
+		elif size == 0:
+			size = end - pos
+		if size < header:
+			return None
+
+		if box in (b'moov', b'trak'):
+			res = mp4_size(f, pos+header, pos+size)
+			if res:
+				return res
+		elif box == b'tkhd':
+			# skip version, flags, times, track ID, duration, layer, volume, matrix
+			version = ord(f.read(1))
+			f.seek(3 + (version == 1 and 32 or 20) + 52, 1)
+			w, h = struct.unpack('>LL', f.read(8))
+			# audio tracks have zero size
+			if w and h:
+				return [w >> 16, h >> 16]
+
+		pos = pos + size
+
+	return None
+#}}}
+
+def svg_size(f):#{{{
+	""" return size from width and height or viewBox of SVG root element """
+	head = f.read(8192).decode('utf-8', 'replace')
+	m = re.search(r'<svg\b[^>]*>', head)
+	if not m:
+		return None
+	tag = m.group(0)
+
+	def attr(name):
+		m = re.search(r'\s' + name + r'\s*=\s*["\']([^"\']*)["\']', tag)
+		return m and m.group(1).strip()
+
+	# width and height in pixels
+	w, h = attr('width'), attr('height')
+	if w and h:
+		w = re.match(r'^([\d.]+)(px)?$', w)
+		h = re.match(r'^([\d.]+)(px)?$', h)
+		if w and h:
+			return [int(float(w.group(1))), int(float(h.group(1)))]
+
+	box = attr('viewBox')
+	if box:
+		box = re.split(r'[\s,]+', box)
+		if len(box) == 4:
+			return [int(float(box[2])), int(float(box[3]))]
+
+	return None
+#}}}
+
+def probe_job(filename, exif=None):#{{{
+	"""
+	return [width, height] of image or video read only from file header
+	(JPEG, PNG, GIF, SVG, MP4/QuickTime) or None if size is unknown,
+	JPEG size respects EXIF orientation,
+	EXIF data of JPEG image are appended to list exif if it's not None
+	"""
+	try:
+		f = open(filename, 'rb')
+		try:
+			head = f.read(32)
+			if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+				return list( struct.unpack('>LL', head[16:24]) )
+			if head[:6] in (b'GIF87a', b'GIF89a'):
+				return list( struct.unpack('<HH', head[6:10]) )
+			if head[:2] == b'\xff\xd8':
+				return jpeg_size(f, exif)
+			if head[4:8] in (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip'):
+				f.seek(0, 2)
+				return mp4_size(f, 0, f.tell())
+			if filename.lower().endswith(".svg"):
+				f.seek(0)
+				return svg_size(f)
+		finally:
+			f.close()
+	except Exception:
+		pass
+
+	return None
+#}}}
+
+def exif_props(exif):#{{{
+	"""
+	return item properties with date the photo was taken ('.date') and
+	camera ('.camera') from EXIF data
+	"""
+	props = {}
+	try:
+		tiff = exif[6:]
+		order = tiff[:2] == b'MM' and '>' or '<'
+		ifd = struct.unpack(order+'L', tiff[4:8])[0]
+		entries = tiff_entries(tiff, order, ifd)[0]
+		make = tiff_string( tiff, order, entries.get(0x010f) ) # Make
+		model = tiff_string( tiff, order, entries.get(0x0110) ) # Model
+		date = tiff_string( tiff, order, entries.get(0x0132) ) # DateTime
+
+		# Exif IFD
+		ifd = tiff_long( order, entries.get(0x8769) )
+		if ifd:
+			entries = tiff_entries(tiff, order, ifd)[0]
+			date = tiff_string( tiff, order, entries.get(0x9003) ) or date # DateTimeOriginal
+	except Exception:
+		return props
+
+	# "YYYY:MM:DD HH:MM:SS" -> "YYYY-MM-DD HH:MM:SS"
+	m = re.match(r'^(\d{4}):(\d\d):(\d\d) (\d\d:\d\d:\d\d)', date)
+	if m and m.group(1) != "0000":
+		props['.date'] = "%s-%s-%s %s" % m.groups()
+
+	# model often contains name of manufacturer
+	if make and not model.lower().startswith( make.split()[0].lower() ):
+		model = (make + " " + model).strip()
+	if model:
+		props['.camera'] = model
+
+	return props
+#}}}
+
+def exif_probe_job(filename):#{{{
+	""" return size (see probe_job()) and properties from EXIF data of image """
+	exif = []
+	size = probe_job(filename, exif)
+	return size, exif and exif_props(exif[0]) or {}
+#}}}
+
+def item_file(f):#{{{
+	""" return path to local file of gallery item """
+	if not local and is_local(f):
+		return gdir +S+ f.replace(':','_')
+	return os.path.abspath(f)
+#}}}
+
+def probe_items(items):#{{{
+	"""
+	set '.original_size' property of images and videos from file headers
+	(and '.date' and '.camera' from EXIF data, see --search-exif),
+	items are processed in chunks, returns stream of updated items
+	"""
+	originals = dict.fromkeys( duplicate_items.values() )
+	out = ItemStream()
+	for chunk in chunks(items):
+		copies = copied_items(chunk, originals)
+		probed = [item for item in chunk
+				if item[0] and item[0] not in unchanged_items and is_local(item[0])
+				and item_type(item[0]) in (Type.IMAGE, Type.VIDEO) and not is_copy(item)]
+
+		files = [item_file(item[0]) for item in probed]
+		count_items( len(files) )
+		if search_exif:
+			results = parallel_map(exif_probe_job, files, [item[0] for item in probed])
+		else:
+			results = ( (size, {}) for size in
+					parallel_map(probe_job, files, [item[0] for item in probed]) )
+		for item, result in zip(probed, results):
+			size, props = result
+			if size:
+				item[1]['.original_size'] = size
+			item[1].update(props)
+
+		# copies of files have same size and EXIF data (see --dedup)
+		for orig, item in copies:
+			for key in ('.original_size', '.date', '.camera'):
+				if key in orig[1]:
+					item[1][key] = orig[1][key]
+		out.extend(chunk)
+	items.close()
+
+	return out
+#}}}
+
+def replace_file(src, dest):#{{{
+	""" rename file src to dest, existing dest is replaced """
+	try:
+		os.rename(src, dest)
+	except OSError:
+		# cannot rename to existing file on some platforms
+		os.remove(dest)
+		os.rename(src, dest)
+#}}}
+
+def to_unicode(string):#{{{
+	if has_python3 or not isinstance(string, str):
+		return string
+	else:
+		return string.decode( Locale )
+#}}}
+
+def js_string(text):#{{{
+	""" escape text for single quoted JavaScript string """
+	return text.replace('\\', '\\\\').replace("'", "\\'") \
+			.replace(u'\u2028', '\\u2028').replace(u'\u2029', '\\u2029')
+#}}}
+
+def encode_item(item, dirs):#{{{
+	"""
+	return item in compact format [directory_index, filename, properties],
+	directory_index is index in dirs (-1 if item path is not local),
+	new directories are added to dirs (dictionary path -> index),
+	empty list is page break
+	"""
+	name = item[0]
+	if not name:
+		return []
+
+	d = -1
+	if is_local(name):
+		i = name.rfind(S) + 1
+		d = dirs.setdefault(to_unicode(name[:i]), len(dirs))
+		name = name[i:]
 
+	res = [d, to_unicode(name)]
+	if len(item) > 1 and item[1]:
+		res.append(item[1])
+
+	return res
+#}}}
+
+def write_list(filename, head, items, tail):#{{{
+	"""
+	write items to JavaScript file as JSON text
+	(see decodeItems() in "files/gallery.js"),
+	the file is replaced at once
+	"""
+	itemfile = codecs.open( filename + ".tmp", "w", "utf-8" )
+	itemfile.write(head + 'JSON.parse(\'{"items":[')
+
+	dirs = {}
+	sep = ""
+	n = 0
 	for item in items:
-		itemfile.write( from_locale(str(item))+',\n' )
+		item = json.dumps( encode_item(item, dirs), separators=(',',':') )
+		itemfile.write( sep + js_string(item) )
+		sep = ","
+		n = n + 1
+
+	# directory table
+	dirs = [x[0] for x in sorted( dirs.items(), key=lambda x: x[1] )]
+	dirs = json.dumps( dirs, separators=(',',':') )
+	itemfile.write( '],"dirs":' + js_string(dirs) + "}')" + tail )
 
-	itemfile.write("];\n");
 	itemfile.close()
+	replace_file(filename + ".tmp", filename)
+	return n
 #}}}
 
-def add_sorted(items, allitems):#{{{
-	""" create pages of sorted items """
-	global page
+def write_items(items):#{{{
+	count_items( sum(1 for item in items if item[0]) )
+
+	# opened watched gallery is reloaded when version in "items-version.js"
+	# changes (see --watch)
+	version = None
+	head = 'var title = '+json.dumps(to_unicode(title))+';\n'
+	if scan_cache is not None:
+		version = int( time.time()*1000 )
+		head = head + 'var items_version = %d;\n' % version
+	# items can be searched using "search-index.js"
+	if search_index:
+		head = head + 'var search_index = true;\n'
+	# text of font thumbnails contains only characters in font subsets
+	if font_thumbnail_text:
+		head = head + 'var font_thumbnail_text = '+json.dumps(to_unicode(font_thumbnail_text))+';\n'
+
+	# replace items.js at once so opened gallery doesn't read incomplete file
+	if split_items:
+		write_item_pages(items, head)
+	else:
+		write_list( gdir +S+ "items.js", head + 'var ls = ', items, ";\n" )
 
-	def try_int(s):
-		"Convert to integer if possible."
-		try: return int(s)
-		except: return s
+	filename = gdir +S+ "items-version.js"
+	if version:
+		f = open(filename + ".tmp", "w")
+		try:
+			f.write( "itemsVersion(%d);\n" % version )
+		finally:
+			f.close()
+		replace_file(filename + ".tmp", filename)
+	elif os.path.exists(filename):
+		os.remove(filename)
+#}}}
 
-	def natsort_key(s):
-		"Used internally to get a tuple by which s is sorted."
-		import re
-		return map(try_int, re.findall(r'(\d+|\D+)', s))
+def write_item_pages(items, head):#{{{
+	"""
+	write items of each page to "items-page-<n>.js" and
+	list of pages (number of items and title) to "items.js"
+	"""
+	index = []
+	def write_page(pageitems):
+		n = len(index) + 1
+		write_list( gdir +S+ "items-page-%d.js" % n,
+				"itemsPage(%d, " % n, pageitems, ");\n" )
+
+		# page title is directory of first item
+		t = pageitems[0][0]
+		t = is_local(t) and os.path.dirname(t)[len("items"+S):] or ""
+		index.append( '{n:%d,title:%s}' % (len(pageitems), json.dumps(to_unicode(t))) )
+
+	# split items to pages, only items of current page are kept in memory
+	pageitems = []
+	for item in items:
+		if item[0]:
+			pageitems.append(item)
+		elif pageitems:
+			write_page(pageitems)
+			pageitems = []
+	if pageitems:
+		write_page(pageitems)
+
+	# remove pages of previous build
+	for f in glob.glob( gdir +S+ "items-page-*.js" ):
+		m = re.search(r'items-page-(\d+)\.js$', f)
+		if m and int(m.group(1)) > len(index):
+			os.remove(f)
+
+	filename = gdir +S+ "items.js"
+	itemfile = codecs.open( filename + ".tmp", "w", "utf-8" )
+	itemfile.write(head + 'var ls = [];\nvar item_pages = [\n')
+	for line in index:
+		itemfile.write(line+',\n')
+	itemfile.write("];\n")
+	itemfile.close()
+	replace_file(filename + ".tmp", filename)
+#}}}
+
+# words for item types in search index
+type_terms = {Type.IMAGE: "image", Type.FONT: "font", Type.VIDEO: "video",
+		Type.HTML: "html", Type.PDF: "pdf", Type.TAG: "tag"}
+
+def search_terms(item):#{{{
+	"""
+	return set of words (lowercase letters and digits) in path, alias, type,
+	date and camera of item
+	"""
+	name, props = item[0], item[1]
+	t = item_type(name)
+
+	text = [ props.get('.alias', ""), props.get('.camera', "") ]
+	if t != Type.TAG:
+		path = props.get('.link', name)
+		if path.startswith("items"+S):
+			path = path[len("items"+S):]
+		text.append(path)
+	text = re.sub( r'<[^>]*>', " ", to_unicode(" ".join(text)) ).lower()
+
+	terms = set( re_search_term.findall(text) )
+	if t in type_terms:
+		terms.add( type_terms[t] )
+
+	# year, month (YYYYMM) and day (YYYYMMDD) when photo was taken
+	date = props.get('.date')
+	if date:
+		date = date[:10].replace("-", "")
+		terms.update( (date[:4], date[:6], date) )
+
+	return terms
+#}}}
+
+def write_search_index(items):#{{{
+	"""
+	write number of items, sorted words in items and numbers of items
+	(in order of items without page breaks, starting with 1) which contain
+	each word to "search-index.js" (see SearchIndex in "files/gallery.js"),
+	list of numbers is increasing and stored as differences to previous number,
+	returns number of items
+	"""
+	index = {}
+	n = 0
+	for item in items:
+		if not item[0]:
+			continue
+		n = n + 1
+		for term in search_terms(item):
+			numbers = index.get(term)
+			if numbers is None:
+				numbers = index[term] = array.array('l')
+			numbers.append(n)
+	terms = sorted(index)
+
+	filename = gdir +S+ "search-index.js"
+	f = codecs.open( filename + ".tmp", "w", "utf-8" )
+	try:
+		text = json.dumps( terms, separators=(',',':') )
+		f.write( 'searchIndex(JSON.parse(\'{"count":%d,"terms":' % n + js_string(text) + ',"items":[' )
+		sep = ""
+		for term in terms:
+			numbers = index[term]
+			deltas = [numbers[0]] + [b - a for a, b in zip(numbers, numbers[1:])]
+			f.write( sep + json.dumps(deltas, separators=(',',':')) )
+			sep = ","
+		f.write( "]}'));\n" )
+	finally:
+		f.close()
+	replace_file(filename + ".tmp", filename)
+
+	return n
+#}}}
+
+def manifest_options():#{{{
+	""" options which must not change between updates of gallery """
+	options = {
+		'resolution': resolution,
+		'thumbnail_resolutions': thumbnail_resolutions,
+		'local': local,
+		'copy': cp == copy,
+		'pdfto': pdfto,
+		'font_render': font_render,
+		'font_size': font_size,
+		'font_text': font_text,
+		'font_thumbnail_text': font_thumbnail_text,
+		'sprites': sprites,
+		'poster_time': poster_time,
+		'poster_command': poster_command,
+		'thumb_format': thumb_format,
+		'thumb_bytes': thumb_bytes
+		}
+	# EXIF properties and placeholders are missing in unchanged items
+	# of older builds
+	if search_exif:
+		options['search_exif'] = True
+	if placeholder != "none":
+		options['placeholder'] = placeholder
+	return options
+#}}}
+
+def load_manifest():#{{{
+	"""
+	load build manifest of existing gallery,
+	manifest contains source path, size and modification time of all files
+	and resulting gallery items of each file,
+	if manifest is not available the gallery is rebuilt
+	(only with --force because files of the gallery may not be created by
+	this script) or if options changed
+	"""
+	global manifest, update, rebuild
+
+	manifest = {}
+	try:
+		f = codecs.open( gdir +S+ "manifest.json", "r", "utf-8" )
+		try:
+			m = json.load(f)
+		finally:
+			f.close()
+	except (IOError, ValueError):
+		print("WARNING: No build manifest in existing gallery -- rebuilding gallery.")
+		update = False
+		return
+
+	if m.get('options') != manifest_options():
+		print("WARNING: Gallery options changed -- rebuilding gallery.")
+		update = False
+		rebuild = True
+		return
+
+	manifest = m
+#}}}
+
+def manifest_entries(items):#{{{
+	"""
+	yield (source_file, manifest_entry) for source files of items,
+	entry contains final items of the file (see add_file())
+	"""
+	source = entry = None
+	for item in items:
+		if len(item) < 4 or not item[3]:
+			continue
+		# items of file are adjacent when sorted
+		if item[2] != source:
+			if entry:
+				yield source, entry
+			source, entry = item[2], dict(item[3], items=[])
+		entry['items'].append(item[:2])
+	if entry:
+		yield source, entry
+
+	for source, entry in itemless_entries:
+		yield source, entry
+#}}}
+
+def write_manifest(items):#{{{
+	""" write build manifest with entries of source files of items """
+	filename = gdir +S+ "manifest.json"
+	f = codecs.open( filename + ".tmp", "w", "utf-8" )
+	n = 0
+	try:
+		# same as json.dump() of {'files': ..., 'dirs': ..., 'options': ...}
+		# but entries are written one by one
+		f.write('{"files": {')
+		for source, entry in manifest_entries(items):
+			f.write( (n and ", " or "") + json.dumps(source) + ": " + json.dumps(entry) )
+			n = n + 1
+		f.write( '}, "dirs": ' + json.dumps(new_manifest['dirs']) +
+				', "options": ' + json.dumps(manifest_options()) + '}' )
+	finally:
+		f.close()
+	replace_file(filename + ".tmp", filename)
+
+	return n
+#}}}
+
+def try_int(s):#{{{
+	"Convert to integer if possible."
+	try: return int(s)
+	except: return s
+#}}}
+
+def natsort_key(s):#{{{
+	"Used internally to get a tuple by which s is sorted."
+	return list( map(try_int, re_natsort.findall(s)) )
+#}}}
+
+def item_size(item):#{{{
+	""" return approximate memory used by item in bytes """
+	size = 400 + 2*len(item[0])
+	if len(item) > 1:
+		size = size + 100*len(item[1])
+	if len(item) > 3 and item[3]:
+		size = size + 300
+	return size
+#}}}
+
+def write_records(f, items):#{{{
+	""" write items to temporary file as JSON lines """
+	for item in items:
+		f.write( json.dumps(item, separators=(',',':')).encode('ascii') + b"\n" )
+#}}}
+
+def read_records(f):#{{{
+	""" read items written by write_records() """
+	f.flush()
+	f.seek(0)
+	for line in f:
+		yield json.loads( line.decode('ascii') )
+	# items can be appended after reading all items
+	f.seek(0, 2)
+#}}}
+
+def chunks(items):#{{{
+	""" yield lists of at most stream_chunk items """
+	chunk = []
+	for item in items:
+		chunk.append(item)
+		if len(chunk) >= stream_chunk:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+#}}}
+
+class ItemStream(object):#{{{
+	"""
+	list of items which can be only appended and iterated,
+	items which don't fit in memory (see --item-memory) are moved to
+	temporary file so modified item must be appended after modification
+	"""
+	def __init__(self, items=()):
+		self.items = []
+		self.file = None
+		self.size = 0
+		self.count = 0
+		self.extend(items)
+
+	def __len__(self):
+		return self.count
+
+	def __iter__(self):
+		if self.file:
+			for item in read_records(self.file):
+				yield item
+		for item in self.items:
+			yield item
+
+	def append(self, item):
+		self.items.append(item)
+		self.count = self.count + 1
+		self.size = self.size + item_size(item)
+		if item_memory and self.size > item_memory<<20:
+			self.spill()
+
+	def extend(self, items):
+		for item in items:
+			self.append(item)
+
+	def spill(self):
+		""" move items from memory to temporary file """
+		if not self.file:
+			self.file = tempfile.TemporaryFile(prefix="mkgallery-")
+		write_records(self.file, self.items)
+		self.items = []
+		self.size = 0
+
+	def close(self):
+		if self.file:
+			self.file.close()
+			self.file = None
+		self.items = []
+#}}}
+
+class ItemSorter(ItemStream):#{{{
+	"""
+	items sorted by name in natural order (see natsort_key()),
+	items which don't fit in memory are sorted and moved to temporary
+	files which are merged when iterating
+	"""
+	def __init__(self, items=()):
+		self.runs = []
+		ItemStream.__init__(self, items)
+
+	def __iter__(self):
+		runs = [read_records(f) for f in self.runs]
+		runs.append( iter(self.sorted_items()) )
+		if len(runs) == 1:
+			return runs[0]
+		# equal keys are ordered by run and position in run as in stable sort
+		runs = [self.keyed_items(run, i) for i, run in enumerate(runs)]
+		return ( x[3] for x in heapq.merge(*runs) )
+
+	def keyed_items(self, items, run):
+		for i, item in enumerate(items):
+			yield natsort_key(item[0]), run, i, item
+
+	def sorted_items(self):
+		return sorted( self.items, key=lambda x: natsort_key(x[0]) )
+
+	def spill(self):
+		""" move sorted items from memory to new temporary file """
+		f = tempfile.TemporaryFile(prefix="mkgallery-")
+		self.runs.append(f)
+		write_records(f, self.sorted_items())
+		self.items = []
+		self.size = 0
+
+	def close(self):
+		for f in self.runs:
+			f.close()
+		self.runs = []
+		self.items = []
+#}}}
+
+def add_sorted(items, linked, allitems, duplicates=None):#{{{
+	"""
+	append sorted items (see ItemSorter) and page breaks to allitems,
+	files of items are linked to items directory (see link_file()),
+	copies of files found by duplicates (see Deduplicator) are removed
+	or remembered in duplicate_items
+	"""
+	global page
 
 	i = 0
-	# maximal number of items per page
-	#for item in sorted( items, key=lambda x: x.lower() ):
-	for item in sorted( items, key=lambda x: list(natsort_key(x)) ):
-		allitems.append([item, items[item]])
+	last = None
+	for item in items:
+		f, entry = item[2], item[3]
+		if duplicates and entry and 'pages' not in entry:
+			orig = duplicates.original(f, entry['size'], item[0])
+			if orig and dedup_mode == "collapse":
+				# items of previous build are removed (see remove_stale_items())
+				new_sources.discard(f)
+				continue
+			elif orig:
+				duplicate_items[item[0]] = orig
+
+		# items of PDF pages have same source file
+		if f != last:
+			link_file(f, entry, linked)
+			last = f
+			link = entry and entry.get('link')
+		elif link:
+			entry['link'] = link
+
+		allitems.append(item)
+		# maximal number of items per page
 		if page > 0:
 			i=i+1
 			if i%page == 0:
 				allitems.append([""])
+	items.close()
 
 	return allitems
 #}}}
 
-def main(argv):#{{{
+def build_gallery(allfiles):#{{{
+	""" build gallery from files (see parse_args()) using current options """
 	global title, resolution, gdir, url, d, force, page, title_page
 
-	# arguments
-	allfiles = parse_args(argv)
+	# profile main process (worker processes are not profiled)
+	if profile_file:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+
+	# load items of previous build
+	phase("clean")
+	if update:
+		load_manifest()
 
 	# clean gallery directory
 	clean_gallery()
 
-	# sorted items with page dividers
-	allitems = []
+	# find items, PDF files are rendered afterwards
+	found = []
+	pdfs = []
 	for files in allfiles:
+		found.append( gallery_items(files, pdfs) )
+	if pdfs:
+		phase("pdf")
+		render_pdfs(pdfs)
+
+	# sorted items with page dividers
+	phase("sort")
+	duplicates = dedup_mode != "none" and Deduplicator() or None
+	allitems = ItemStream()
+	for page_items in found:
 		# page divider
-		if allitems:
+		if len(allitems):
 			allitems.append([""])
-		items = gallery_items(files, allitems)
+		for items, linked in page_items:
+			add_sorted(items, linked, allitems, duplicates)
+	found = None
+	count_items( len(allitems) )
+	if duplicates and duplicates.count:
+		print("Files with same content as other files: %d" % duplicates.count)
+	remove_old_items()
+
+	if update:
+		remove_stale_items()
 
 	# no usable items found
-	if not empty and not allitems:
+	if not empty and not len(allitems):
 		print("No items in gallery!")
 		exit(1)
 
 	# write font faces to CSS file
-	create_fontfaces(allitems)
+	phase("fonts")
+	allitems = create_fontfaces(allitems)
+
+	# read image and video sizes
+	phase("probe")
+	allitems = probe_items(allitems)
 
 	# create title page
 	if title_page:
@@ -844,23 +4119,291 @@ def main(argv):#{{{
 			line = line + '<div class="stat '+cls[t]+'_total">' + str(count[t]) + '</div>'
 
 		# prepend title page to item list
-		allitems.insert( 0, ["$("+line+"</div>)",{'.alias':'Title page'}] )
+		items = ItemStream([ ["$("+line+"</div>)",{'.alias':'Title page'}] ])
+		items.extend(allitems)
+		allitems.close()
+		allitems = items
 
 	# open browser?
 	if url:
 		# write items.js so we can open it in browser
+		phase("write_items")
 		write_items(allitems)
 		launch_browser(url)
 
 	if resolution:
-		create_thumbnails(allitems)
+		phase("thumbnails")
+		allitems = create_thumbnails(allitems)
+		if sprites and thumbnail_resolutions:
+			# sheets would contain only thumbnails in base resolution
+			print("WARNING: Sprite sheets not created -- cannot be used with more thumbnail resolutions.")
+		elif sprites:
+			phase("sprites")
+			allitems = create_sprites(allitems)
 
 	if not url or resolution:
+		phase("write_items")
 		write_items(allitems)
 
+	filename = gdir +S+ "search-index.js"
+	if search_index:
+		phase("search_index")
+		count_items( write_search_index(allitems) )
+	elif os.path.exists(filename):
+		os.remove(filename)
+
+	phase("manifest")
+	count_items( write_manifest(allitems) )
+	allitems.close()
+	phase()
+
+	if profile_file:
+		profiler.disable()
+		profiler.dump_stats(profile_file)
+
+	if stats:
+		report = stats_report()
+		print_stats(report)
+		if stats_file:
+			f = open(stats_file, "w")
+			try:
+				json.dump(report, f, indent=1)
+			finally:
+				f.close()
+	if progress_mode == "json":
+		emit_event("done", gallery=gdir)
+
 	print("New gallery was created in: '"+gdir+"'")
 #}}}
 
+# options set by parse_args() and kept by GalleryBuilder
+config_options = ["title", "resolution", "thumbnail_resolutions", "d", "gdir", "url",
+		"progress_mode", "stats", "stats_file", "slowest", "profile_file", "jobs",
+		"scan_threads", "item_memory", "cachedir", "cache_size", "cache_hash",
+		"dedup_mode", "prune_cache",
+		"fast_thumbnails", "thumb_format", "thumb_bytes", "thumb_quality", "placeholder",
+		"poster_command", "poster_time", "force", "font_render", "font_size",
+		"font_text", "font_thumbnail_text", "local", "page", "title_page", "empty",
+		"pdfto", "update", "split_items", "sprites", "search_index", "search_exif",
+		"cp", "copy_mode", "batch_file", "watch", "watch_delay", "watch_poll"]
+# options used by job functions in worker processes (see init_worker())
+worker_options = ["fast_thumbnails", "thumb_format", "thumb_bytes", "thumb_quality",
+		"placeholder", "poster_command", "poster_time", "font_thumbnail_text"]
+
+def current_options():#{{{
+	return dict( (name, globals()[name]) for name in config_options )
+#}}}
+
+default_options = current_options()
+
+class GalleryBuilder(object):#{{{
+	"""
+	builds galleries one after another in the same process
+
+	Options (see config_options) are module globals used by all functions,
+	so builder keeps its own copy of options and sets them before each build.
+	Worker pools (see worker_pool()) and font index are kept between builds
+	until close() is called.
+
+	Example:
+		builder = GalleryBuilder(resolution=200)
+		try:
+			builder.build([["photos/2019"]], title="2019", gdir="galleries/2019")
+			builder.build([["photos/2020"]], title="2020", gdir="galleries/2020")
+		finally:
+			builder.close()
+	"""
+	def __init__(self, **options):
+		# web browser is launched only if url is set
+		self.defaults = dict(default_options, url="")
+		self.options = dict(self.defaults)
+		self.set_options(**options)
+		self.pools = {}
+		self.pool_options = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def check_options(self, options):
+		""" raise TypeError if options contain unknown name (see config_options) """
+		known = current_options()
+		for name in options:
+			if name not in known:
+				raise TypeError("Unknown option: " + name)
+
+	def set_options(self, **options):
+		""" change options of following builds """
+		self.check_options(options)
+		self.options.update(options)
+
+	def apply_options(self, options):
+		""" set module globals from options """
+		options = dict(options)
+		# gallery path and URL can contain title (see --directory and --url)
+		for name in ("gdir", "url"):
+			try:
+				options[name] = options[name] % options['title']
+			except:
+				pass
+		globals().update(options)
+
+	def parse_args(self, argv):
+		""" set options from command line arguments and return files (see parse_args()) """
+		self.apply_options(self.options)
+		files = parse_args(argv)
+		self.options = current_options()
+		return files
+
+	def build(self, files, **options):
+		"""
+		build gallery from files (list of pages with files and directories),
+		options override builder options only for this build,
+		returns statistics of build (see stats_report())
+		"""
+		global pools
+
+		self.check_options(options)
+		self.apply_options( dict(self.options, **options) )
+		reset_build_state()
+
+		# workers of kept pools must use same options
+		wopts = dict( (name, globals()[name]) for name in worker_options )
+		if wopts != self.pool_options:
+			self.close()
+			self.pool_options = wopts
+
+		restore = None
+		if progress_mode == "json" and event_output is None:
+			restore = redirect_output()
+
+		pools = self.pools
+		try:
+			build_gallery(files)
+		finally:
+			pools = None
+			if restore:
+				restore()
+
+		return stats_report()
+
+	def build_batch(self, filename, argv=()):
+		"""
+		build galleries listed in batch file -- JSON array with command line
+		arguments of each gallery (e.g. [["-t", "2019", "photos/2019"], ...]),
+		options in argv are used for all galleries,
+		returns number of galleries which failed to build
+		"""
+		f = codecs.open(filename, "r", "utf-8")
+		try:
+			batch = json.load(f)
+		finally:
+			f.close()
+
+		# options from command line without --batch and files
+		opts = getopt.gnu_getopt(argv, short_options, long_options)[0]
+		common = []
+		for opt, arg in opts:
+			if opt != "--batch":
+				common.append(opt)
+				if opt[2:] + "=" in long_options or opt[1:] + ":" in short_options:
+					common.append(arg)
+
+		failed = 0
+		for args in batch:
+			self.options = dict(self.defaults)
+			try:
+				files = self.parse_args( common + [str(arg) for arg in args] )
+				self.build(files)
+			except SystemExit as e:
+				if e.code:
+					if not isinstance(e.code, int):
+						print(e.code)
+					print("ERROR: Cannot build gallery (arguments: "+json.dumps(args)+")")
+					failed = failed + 1
+		return failed
+
+	def watch(self, files):
+		"""
+		build gallery and update it whenever files change until interrupted,
+		only changed directories are scanned again and only new and modified
+		files are processed (see --watch)
+		"""
+		global scan_cache, stat_cache
+
+		scan_cache, stat_cache = {}, {}
+		self.apply_options(self.options)
+		watcher = file_watcher( [f for page in files for f in page if f and is_local(f)] )
+		try:
+			self.build(files)
+			# web browser is launched only once
+			options = dict(update=True, url="")
+			while True:
+				print("Watching for changes (press Ctrl+C to stop) ...")
+				changes = {}
+				while not changes:
+					changes = watcher.changes()
+
+				# wait until burst of changes ends
+				while True:
+					more = watcher.changes(watch_delay)
+					if not more:
+						break
+					changes.update(more)
+
+				forget_dirs(changes)
+				print("Files changed -- updating gallery.")
+				try:
+					self.build(files, **options)
+				except SystemExit as e:
+					if e.code and not isinstance(e.code, int):
+						print(e.code)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			watcher.close()
+			scan_cache, stat_cache = None, None
+
+	def close(self):
+		""" close worker pools """
+		while self.pools:
+			self.pools.popitem()[1].terminate()
+		self.pool_options = None
+#}}}
+
+def main(argv):#{{{
+	builder = GalleryBuilder()
+	restore = None
+	try:
+		# arguments
+		allfiles = builder.parse_args(argv)
+
+		if progress_mode == "json":
+			restore = redirect_output()
+
+		if prune_cache:
+			prune_thumbnail_cache()
+			print("Thumbnail cache pruned.")
+			return
+
+		if batch_file:
+			if builder.build_batch(batch_file, argv):
+				exit(1)
+			return
+
+		if watch:
+			builder.watch(allfiles)
+			return
+
+		builder.build(allfiles)
+	finally:
+		builder.close()
+		if restore:
+			restore()
+#}}}
+
 if __name__ == "__main__":
 	main(sys.argv[1:])
 
@@ -0,0 +1,71 @@
+"""
+tests of building galleries with GalleryBuilder
+"""
+
+import os, sys, shutil, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mkgallery
+from test_update import read_items
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+class TestOptions(unittest.TestCase):
+	""" unknown options are rejected """
+
+	def test_unknown_option(self):
+		self.assertRaises( TypeError, mkgallery.GalleryBuilder, resoluton=100 )
+		builder = mkgallery.GalleryBuilder(resolution=100)
+		try:
+			self.assertRaises( TypeError, builder.set_options, resoluton=100 )
+			self.assertRaises( TypeError, builder.build, [["."]], resoluton=100 )
+			self.assertEqual(builder.options['resolution'], 100)
+		finally:
+			builder.close()
+		self.assertFalse( hasattr(mkgallery, "resoluton") )
+
+@unittest.skipIf(Image is None, "needs Python Imaging Library (PIL)")
+class TestBuilder(unittest.TestCase):
+	""" galleries built one after another with kept worker pools """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		for i in range(4):
+			Image.new( "RGB", (400, 200) ).save( os.path.join(self.input, "%d.png" % i) )
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_build(self):
+		builder = mkgallery.GalleryBuilder(resolution=100, jobs=2, cachedir="",
+				d=root, progress_mode="none")
+		try:
+			gdir1 = os.path.join(self.tmp, "gallery1")
+			gdir2 = os.path.join(self.tmp, "gallery2")
+			builder.build( [[self.input]], gdir=gdir1, resolution=50 )
+			pools = dict(builder.pools)
+			builder.build( [[self.input]], gdir=gdir2 )
+			# options of single build don't change builder options
+			self.assertEqual(builder.options['resolution'], 100)
+			self.assertTrue(pools)
+			self.assertEqual(builder.pools, pools)
+		finally:
+			builder.close()
+		self.assertEqual(builder.pools, {})
+
+		items1 = read_items(gdir1)
+		items2 = read_items(gdir2)
+		self.assertEqual( sorted(items1), ["%d.png" % i for i in range(4)] )
+		self.assertEqual( sorted(items2), sorted(items1) )
+		self.assertEqual( items1["0.png"][".thumbnail_size"], [50, 25] )
+		self.assertEqual( items2["0.png"][".thumbnail_size"], [100, 50] )
+
+if __name__ == "__main__":
+	unittest.main()
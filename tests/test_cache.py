@@ -0,0 +1,66 @@
+"""
+tests of thumbnail cache (see --cache and --cache-size)
+"""
+
+import os, sys, shutil, tempfile, time, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import mkgallery
+
+class TestPruneCache(unittest.TestCase):
+	""" least recently used entries are removed as a whole """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.options = (mkgallery.cachedir, mkgallery.cache_size)
+		mkgallery.cachedir = self.tmp
+		mkgallery.cache_size = 1
+		self.now = time.time()
+
+	def tearDown(self):
+		mkgallery.cachedir, mkgallery.cache_size = self.options
+		shutil.rmtree(self.tmp)
+
+	def write(self, name, kib, age):
+		path = os.path.join(self.tmp, *name.split("/"))
+		if not os.path.isdir( os.path.dirname(path) ):
+			os.makedirs( os.path.dirname(path) )
+		f = open(path, "wb")
+		f.write( b"x" * (kib*1024) )
+		f.close()
+		os.utime(path, (self.now - age, self.now - age))
+
+	def files(self):
+		return sorted( os.path.relpath(os.path.join(d, f), self.tmp).replace(os.sep, "/")
+				for d, dirs, files in os.walk(self.tmp) for f in files )
+
+	def test_prune(self):
+		# thumbnails used long ago
+		self.write("aa/aa01.png", 400, 300)
+		self.write("aa/aa01@600.png", 400, 300)
+		self.write("aa/aa01.poster.jpg", 10, 300)
+		self.write("aa/aa01.size", 0, 300)
+		# PDF pages, one of them used recently
+		self.write("bb/bb02/page-1.png", 300, 400)
+		self.write("bb/bb02/page-2.png", 300, 10)
+		self.write("bb/bb02.files", 0, 400)
+		# thumbnail used recently, high resolution thumbnail is not touched
+		self.write("aa/aa03.png", 100, 100)
+		self.write("aa/aa03@600.png", 200, 500)
+		self.write("aa/aa03.size", 0, 100)
+		self.write("cc/cc04.noframe", 0, 50)
+		# font index is not cache entry
+		self.write("fonts.json", 200, 1000)
+
+		mkgallery.prune_thumbnail_cache()
+		self.assertEqual( self.files(), ["aa/aa03.png", "aa/aa03.size", "aa/aa03@600.png",
+			"bb/bb02.files", "bb/bb02/page-1.png", "bb/bb02/page-2.png",
+			"cc/cc04.noframe", "fonts.json"] )
+
+		mkgallery.cache_size = 0
+		mkgallery.prune_thumbnail_cache()
+		self.assertEqual( self.files(), ["fonts.json"] )
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,49 @@
+"""
+tests of copying items to gallery (see --copy and --copy-mode)
+"""
+
+import os, sys, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestCopy(unittest.TestCase):
+	""" gallery items are hard links to originals only in hardlink mode """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		self.original = os.path.join(self.input, "page.html")
+		f = open(self.original, "w")
+		f.write("<html></html>")
+		f.close()
+		self.gdir = os.path.join(self.tmp, "gallery")
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def build(self, *args):
+		subprocess.check_call( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=none", "-f",
+			"-d", self.gdir] + list(args) + [self.input], stdout=open(os.devnull, "w") )
+		item = os.path.join( self.gdir, "items", self.original.lstrip(os.sep) )
+		self.assertFalse( os.path.islink(item) )
+		f = open(item)
+		try:
+			self.assertEqual(f.read(), "<html></html>")
+		finally:
+			f.close()
+		return os.path.samefile(item, self.original)
+
+	def test_copy(self):
+		self.assertFalse( self.build("-c") )
+
+	def test_copy_modes(self):
+		self.assertTrue( self.build("--copy-mode=hardlink") )
+		# unchanged file is not copied again but hard link must be replaced
+		self.assertFalse( self.build("--copy-mode=copy") )
+		self.assertFalse( self.build("--copy-mode=reflink") )
+		self.assertTrue( self.build("--copy-mode=hardlink") )
+
+if __name__ == "__main__":
+	unittest.main()
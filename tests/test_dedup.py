@@ -0,0 +1,111 @@
+"""
+tests of finding files with same content (see --dedup)
+"""
+
+import os, sys, random, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_update import read_items
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+class TestDedup(unittest.TestCase):
+	""" only files with same content are copies """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		self.gdir = os.path.join(self.tmp, "gallery")
+
+		rnd = random.Random(1)
+		# bigger than first and last block compared before whole content
+		data = bytearray( rnd.getrandbits(8) for i in range(200*1024) )
+		self.write("a_orig.html", data)
+		self.write("b_copy.html", data)
+		# same size, same first and last block
+		middle = bytearray(data)
+		middle[100*1024] ^= 1
+		self.write("c_middle.html", middle)
+		# same size, same beginning
+		end = bytearray(data)
+		end[-1] ^= 1
+		self.write("d_end.html", end)
+		# small files with same size
+		self.write("e_small.html", b"x" * 10)
+		self.write("f_small.html", b"y" * 10)
+		self.write("g_small_copy.html", b"x" * 10)
+		# empty files
+		self.write("h_empty.html", b"")
+		self.write("i_empty.html", b"")
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def write(self, name, data):
+		f = open( os.path.join(self.input, name), "wb" )
+		f.write( bytes(data) )
+		f.close()
+
+	def build(self, *args):
+		""" build gallery, return items and output """
+		p = subprocess.Popen( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=none", "-f",
+			"-d", self.gdir] + list(args) + [self.input], stdout=subprocess.PIPE )
+		out = p.communicate()[0].decode("utf-8")
+		self.assertEqual(p.returncode, 0)
+		return read_items(self.gdir), out
+
+	def names(self):
+		return sorted( os.listdir(self.input) )
+
+	def test_none(self):
+		items, out = self.build("--dedup=none")
+		self.assertEqual( sorted(items), self.names() )
+		self.assertNotIn("same content", out)
+
+	def test_keep(self):
+		items, out = self.build("--dedup=keep")
+		self.assertEqual( sorted(items), self.names() )
+		self.assertIn("Files with same content as other files: 2", out)
+
+	def test_collapse(self):
+		items, out = self.build("--dedup=collapse")
+		names = self.names()
+		names.remove("b_copy.html")
+		names.remove("g_small_copy.html")
+		self.assertEqual( sorted(items), names )
+		self.assertIn("Files with same content as other files: 2", out)
+
+		# copies are removed from updated gallery too
+		self.write("j_copy.html", b"y" * 10)
+		items, out = self.build("--dedup=collapse", "-U")
+		self.assertEqual( sorted(items), names )
+
+	@unittest.skipIf(Image is None, "needs Python Imaging Library (PIL)")
+	def test_keep_thumbnails(self):
+		Image.new( "RGB", (400, 200), (200, 10, 10) ).save( os.path.join(self.input, "k.png") )
+		shutil.copyfile( os.path.join(self.input, "k.png"), os.path.join(self.input, "l.png") )
+		# same size, other content
+		Image.new( "RGB", (400, 200), (10, 200, 10) ).save( os.path.join(self.input, "m.png") )
+		items, out = self.build("--dedup=keep", "-r", "100")
+		self.assertIn("Files with same content as other files: 3", out)
+		for name in ("k.png", "l.png", "m.png"):
+			self.assertEqual(items[name][".thumbnail_size"], [100, 50])
+
+		thumbs = os.path.join(self.gdir, "thumbs", "items", self.input.lstrip(os.sep))
+		def read(name):
+			f = open( os.path.join(thumbs, name + ".png"), "rb" )
+			try:
+				return f.read()
+			finally:
+				f.close()
+		self.assertEqual( read("k.png"), read("l.png") )
+		self.assertNotEqual( read("k.png"), read("m.png") )
+
+if __name__ == "__main__":
+	unittest.main()
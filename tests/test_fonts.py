@@ -0,0 +1,108 @@
+"""
+tests of font subsets used in font thumbnails (see --font-thumbnail-text)
+"""
+
+import os, sys, json, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mkgallery
+from test_update import read_items
+
+try:
+	from fontTools.fontBuilder import FontBuilder
+	from fontTools.pens.ttGlyphPen import TTGlyphPen
+	from fontTools.ttLib import TTFont
+except ImportError:
+	FontBuilder = None
+
+def create_font(filename, chars):
+	""" save TrueType font with square glyph for each character """
+	names = [".notdef"] + ["glyph%d" % ord(c) for c in chars]
+	pen = TTGlyphPen(None)
+	pen.moveTo( (100, 0) )
+	pen.lineTo( (100, 500) )
+	pen.lineTo( (500, 500) )
+	pen.lineTo( (500, 0) )
+	pen.closePath()
+	glyph = pen.glyph()
+
+	fb = FontBuilder(1000, isTTF=True)
+	fb.setupGlyphOrder(names)
+	fb.setupCharacterMap( dict((ord(c), "glyph%d" % ord(c)) for c in chars) )
+	fb.setupGlyf( dict((name, glyph) for name in names) )
+	fb.setupHorizontalMetrics( dict((name, (600, 100)) for name in names) )
+	fb.setupHorizontalHeader(ascent=800, descent=-200)
+	fb.setupNameTable( {'familyName': "Test", 'styleName': "Regular"} )
+	fb.setupOS2()
+	fb.setupPost()
+	fb.save(filename)
+
+@unittest.skipIf(mkgallery.fontsubset is None or FontBuilder is None, "needs fontTools")
+@unittest.skipIf(not mkgallery.has_pil, "needs Python Imaging Library (PIL)")
+class TestFontSubsets(unittest.TestCase):
+	""" subsets contain characters of thumbnail text written in items.js """
+
+	text = "ab1,\nXYZ"
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		self.gdir = os.path.join(self.tmp, "gallery")
+		create_font( os.path.join(self.input, "a.ttf"), "abcdXYZ12,é" )
+		shutil.copyfile( os.path.join(self.input, "a.ttf"), os.path.join(self.input, "b.ttf") )
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def build(self, *args):
+		subprocess.check_call( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=none", "-f",
+			"-d", self.gdir, "--font-thumbnail-text=" + self.text] + list(args) + [self.input],
+			stdout=open(os.devnull, "w") )
+		return read_items(self.gdir)
+
+	def read(self, name):
+		f = open( os.path.join(self.gdir, name), "rb" )
+		try:
+			return f.read().decode("utf-8")
+		finally:
+			f.close()
+
+	def check(self, items):
+		ext = mkgallery.font_subset_format
+		css = self.read("fonts.css")
+		thumbs = os.path.join(self.gdir, "thumbs", "items", self.input.lstrip(os.sep))
+		for name in ("a.ttf", "b.ttf"):
+			props = items[name]
+			self.assertEqual(props['.font_subset'], ext)
+			self.assertNotIn(".thumbnail_ext", props)
+
+			font = TTFont( os.path.join(thumbs, name + "." + ext) )
+			try:
+				self.assertEqual( sorted(font.getBestCmap()), sorted(map(ord, "ab1,XYZ")) )
+			finally:
+				font.close()
+			self.assertIn( "url('thumbs/items/" + self.input + "/" + name + "." + ext + "')", css )
+
+		# gallery.js reads thumbnail text from items.js
+		head = self.read("items.js").split("\n")
+		self.assertIn( "var font_thumbnail_text = " + json.dumps(self.text) + ";", head )
+
+	def test_subsets(self):
+		self.check( self.build() )
+		# copy of font uses subset of first font
+		self.check( self.build("--dedup=keep") )
+		# unchanged fonts in updated gallery
+		self.check( self.build("-U") )
+
+	def test_no_subsets(self):
+		self.text = ""
+		items = self.build()
+		self.assertEqual( items["a.ttf"].get(".font_subset"), None )
+		self.assertNotIn( "font_thumbnail_text", self.read("items.js") )
+
+if __name__ == "__main__":
+	unittest.main()
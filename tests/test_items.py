@@ -0,0 +1,201 @@
+"""
+tests of item list written by gallery build
+"""
+
+import os, sys, re, json, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_search import node, viewer_script
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+@unittest.skipIf(os.name != "posix", "needs file names with arbitrary bytes")
+class TestItems(unittest.TestCase):
+	""" items with file names which are not valid UTF-8 """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		f = open( os.path.join(self.input.encode("ascii"), b"caf\xe9.html"), "w" )
+		f.write("<html></html>")
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def build(self, *args):
+		gdir = os.path.join(self.tmp, "gallery")
+		env = dict(os.environ, LC_ALL="C.UTF-8")
+		subprocess.check_call( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=none", "-f",
+			"-d", gdir] + list(args) + [self.input], stdout=open(os.devnull, "w"), env=env )
+		return gdir
+
+	def read(self, filename):
+		f = open(filename, "rb")
+		try:
+			return f.read().decode("ascii")
+		finally:
+			f.close()
+
+	def test_undecodable_name(self):
+		gdir = self.build("--search-index")
+		text = self.read( os.path.join(gdir, "items.js") )
+		start = text.index("JSON.parse('") + len("JSON.parse('")
+		items = json.loads( text[start:text.rindex("')")].replace("\\\\", "\\") )
+		self.assertEqual(len(items['items']), 1)
+		self.assertEqual(items['items'][0][1], u"caf\udce9.html")
+		self.assertIn( '"caf"', self.read(os.path.join(gdir, "search-index.js")) )
+
+	@unittest.skipIf(Image is None, "needs Python Imaging Library (PIL)")
+	def test_undecodable_name_cache(self):
+		Image.new( "RGB", (64, 48) ).save(
+				os.path.join(self.input.encode("ascii"), b"ph\xe9.jpg"), "JPEG" )
+		cachedir = os.path.join(self.tmp, "cache")
+		for i in range(2):
+			self.build("--cache=" + cachedir)
+		sizes = [f for d in os.listdir(cachedir)
+				for f in os.listdir( os.path.join(cachedir, d) ) if f.endswith(".size")]
+		self.assertEqual(len(sizes), 1)
+
+def decode_list(text):
+	""" return item paths from JSON.parse() in "items.js", None is page break """
+	start = text.index("JSON.parse('") + len("JSON.parse('")
+	data = json.loads( text[start:text.rindex("')")].replace("\\'", "'").replace("\\\\", "\\") )
+	return [data['dirs'][item[0]] + item[1] if item else None for item in data['items']]
+
+# loads all pages of gallery with split items like gallery.js in browser,
+# returns path and page number of each item before and after loading
+# and numbers of loaded pages
+pages_script = """
+var storage, ls, item_pages, items, before, after, loaded, i;
+var fs = require("fs");
+function load (filename) { (0, eval)( fs.readFileSync(%s + "/" + filename, "utf8") ); }
+function itemsPage (page, list) { items.setPage(page, list); }
+var document = {
+    createElement: function () { return {}; },
+    getElementsByTagName: function () { return [{appendChild: function (script) { load(script.src); }}]; }
+};
+load("items.js");
+items = new Items(ls, 0);
+if (item_pages) {
+    items.setPages(item_pages);
+}
+before = [];
+for(i=0; i<items.length(); i+=1) { before.push([items.get(i)[0], items.page(i)]); }
+loaded = [];
+for(i=1; i<=items.pages; i+=1) {
+    items.loadPage(i, loaded.push.bind(loaded, i));
+}
+after = [];
+for(i=0; i<items.length(); i+=1) { after.push([items.get(i)[0], items.page(i)]); }
+console.log(JSON.stringify([before, after, loaded]));
+"""
+
+class TestSplitItems(unittest.TestCase):
+	""" items split to "items-page-<n>.js" are same as pages in "items.js" """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		for d in ("a", "b"):
+			os.makedirs( os.path.join(self.input, d) )
+		for name in ["a/a%d.html" % i for i in range(5)] + ["b/b0.html", "b/b1.html", "z0.html"]:
+			f = open( os.path.join(self.input, name), "w" )
+			f.write("<html></html>")
+			f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def build(self, name, *args):
+		gdir = os.path.join(self.tmp, name)
+		subprocess.check_call( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=none", "-f",
+			"-d", gdir] + list(args) + [self.input], stdout=open(os.devnull, "w") )
+		return gdir
+
+	def read(self, filename):
+		f = open(filename, "rb")
+		try:
+			return f.read().decode("utf-8")
+		finally:
+			f.close()
+
+	def pages(self, gdir):
+		""" return items of each page in gallery without split items """
+		pages = [[]]
+		for path in decode_list( self.read(os.path.join(gdir, "items.js")) ):
+			if path is None:
+				pages.append([])
+			else:
+				pages[-1].append(path)
+		return [page for page in pages if page]
+
+	def split_pages(self, gdir):
+		""" return list of pages in "items.js" and items of each page """
+		text = self.read( os.path.join(gdir, "items.js") )
+		self.assertIn("var ls = [];", text)
+		index = [(int(n), json.loads(t)) for n, t in re.findall(r'{n:(\d+),title:(".*")}', text)]
+		pages = []
+		for i in range(len(index)):
+			text = self.read( os.path.join(gdir, "items-page-%d.js" % (i+1)) )
+			self.assertTrue( text.startswith("itemsPage(%d, " % (i+1)) )
+			pages.append( decode_list(text) )
+		self.assertFalse( os.path.exists(os.path.join(gdir, "items-page-%d.js" % (len(index)+1))) )
+		return index, pages
+
+	def test_split(self):
+		expected = self.pages( self.build("gallery", "-p", "3") )
+		items = "items/" + self.input
+		self.assertEqual( expected, [
+			[items + "/a/a0.html", items + "/a/a1.html", items + "/a/a2.html"],
+			[items + "/a/a3.html", items + "/a/a4.html", items + "/b/b0.html"],
+			[items + "/b/b1.html", items + "/z0.html"] ] )
+
+		gdir = self.build("split", "-p", "3", "-S")
+		index, pages = self.split_pages(gdir)
+		self.assertEqual(pages, expected)
+		# page title is directory of first item
+		self.assertEqual( index, [(3, self.input + "/a"), (3, self.input + "/a"),
+			(2, self.input + "/b")] )
+
+		# pages of previous build are removed
+		gdir = self.build("split", "-p", "4", "-S")
+		index, pages = self.split_pages(gdir)
+		self.assertEqual( pages, self.pages(self.build("gallery", "-p", "4")) )
+		self.assertEqual( [n for n, t in index], [4, 4] )
+
+		# single page
+		gdir = self.build("split", "-S")
+		index, pages = self.split_pages(gdir)
+		self.assertEqual( pages, [sum(expected, [])] )
+
+	@unittest.skipIf(node is None, "needs node.js")
+	def test_viewer(self):
+		# items and their pages in viewer are same for split and whole item list
+		def load(gdir):
+			script = viewer_script("newClass", "Class", "decodeItems", "Items") + \
+					pages_script % json.dumps(gdir)
+			p = subprocess.Popen( [node], stdin=subprocess.PIPE, stdout=subprocess.PIPE )
+			out = p.communicate( script.encode("utf-8") )[0]
+			self.assertEqual(p.returncode, 0)
+			return json.loads( out.decode("utf-8") )
+
+		before, after, loaded = load( self.build("gallery", "-p", "3") )
+		self.assertEqual(before, after)
+		self.assertEqual( [page for path, page in after], [1, 1, 1, 2, 2, 2, 3, 3] )
+
+		before, split, loaded = load( self.build("split", "-p", "3", "-S") )
+		# items are unknown before their pages are loaded
+		self.assertEqual( before, [["", page] for path, page in after] )
+		self.assertEqual(split, after)
+		self.assertEqual(loaded, [1, 2, 3])
+
+if __name__ == "__main__":
+	unittest.main()
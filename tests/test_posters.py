@@ -0,0 +1,104 @@
+"""
+tests of video thumbnails created from poster frames (see --poster-command)
+"""
+
+import os, sys, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_update import read_items
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+# saves frame of video files, audio files have no frame
+poster_script = """
+import sys
+from PIL import Image
+time, infile, outfile = sys.argv[1:4]
+log = open(sys.argv[4], "a")
+log.write("%s %s\\n" % (time, infile.rsplit("/", 1)[-1]))
+log.close()
+if not infile.endswith(".mp3"):
+	Image.new("RGB", (320, 180), (200, 30, 30)).save(outfile, "JPEG")
+"""
+
+@unittest.skipIf(Image is None, "needs Python Imaging Library (PIL)")
+class TestPosters(unittest.TestCase):
+	""" poster frames and missing frames are cached """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		for name in ("clip.mp4", "song.mp3"):
+			f = open( os.path.join(self.input, name), "w" )
+			f.write(name)
+			f.close()
+		self.script = os.path.join(self.tmp, "poster.py")
+		f = open(self.script, "w")
+		f.write(poster_script)
+		f.close()
+		self.log = os.path.join(self.tmp, "log")
+		self.cachedir = os.path.join(self.tmp, "cache")
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def build(self, gdir, cachedir):
+		""" build gallery, return items and poster commands which were run """
+		if os.path.exists(self.log):
+			os.remove(self.log)
+		command = " ".join( [sys.executable, self.script, "%(time)s", "%(input)s",
+			"%(output)s", self.log] )
+		gdir = os.path.join(self.tmp, gdir)
+		subprocess.check_call( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=" + cachedir, "--template=" + root, "--progress=none",
+			"-r", "100", "--poster-time=2", "--poster-command=" + command,
+			"-d", gdir, self.input], stdout=open(os.devnull, "w") )
+
+		calls = []
+		if os.path.exists(self.log):
+			f = open(self.log)
+			try:
+				calls = sorted( f.read().split("\n")[:-1] )
+			finally:
+				f.close()
+		return gdir, read_items(gdir), calls
+
+	def check_items(self, gdir, items):
+		clip = items["clip.mp4"]
+		self.assertEqual(clip[".thumbnail_size"], [100, 56])
+		self.assertTrue( clip[".poster"].endswith("clip.mp4.poster.jpg") )
+		self.assertTrue( os.path.isfile(os.path.join(gdir, *clip[".poster"].split("/"))) )
+		self.assertEqual(items["song.mp3"], {})
+
+	def test_cache(self):
+		gdir, items, calls = self.build("gallery1", self.cachedir)
+		self.check_items(gdir, items)
+		# first frame is tried if there is no frame at poster time
+		self.assertEqual( calls, ["0 song.mp3", "2.0 clip.mp4", "2.0 song.mp3"] )
+
+		# frame and missing frame are in cache
+		gdir, items, calls = self.build("gallery2", self.cachedir)
+		self.check_items(gdir, items)
+		self.assertEqual(calls, [])
+
+		# changed file is not in cache
+		f = open( os.path.join(self.input, "song.mp3"), "a" )
+		f.write("changed")
+		f.close()
+		gdir, items, calls = self.build("gallery3", self.cachedir)
+		self.check_items(gdir, items)
+		self.assertEqual( calls, ["0 song.mp3", "2.0 song.mp3"] )
+
+	def test_no_cache(self):
+		for gdir in ("gallery1", "gallery2"):
+			gdir, items, calls = self.build(gdir, "")
+			self.check_items(gdir, items)
+			self.assertEqual( calls, ["0 song.mp3", "2.0 clip.mp4", "2.0 song.mp3"] )
+
+if __name__ == "__main__":
+	unittest.main()
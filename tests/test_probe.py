@@ -0,0 +1,181 @@
+"""
+tests of image and video sizes read from file headers (see probe_job())
+"""
+
+import os, sys, io, struct, shutil, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import mkgallery
+
+def segment(marker, payload):
+	""" return JPEG segment """
+	return struct.pack('>BBH', 0xff, marker, len(payload) + 2) + payload
+
+def sof(w, h, marker=0xc0):
+	""" return JPEG start of frame segment """
+	return segment(marker, struct.pack('>BHHB', 8, h, w, 3) + b'\x01\x22\x00' * 3)
+
+def exif(orientation=None, order='<', typ=3):
+	""" return EXIF APP1 segment with Orientation tag in IFD0 """
+	entries = []
+	if orientation is not None:
+		entries.append( struct.pack(order+'HHL', 0x0112, typ, 1) +
+				struct.pack(order+'HH', orientation, 0) )
+	tiff = (order == '<' and b'II' or b'MM') + struct.pack(order+'HL', 42, 8) + \
+			struct.pack(order+'H', len(entries)) + b''.join(entries) + struct.pack(order+'L', 0)
+	return segment(0xe1, b'Exif\x00\x00' + tiff)
+
+def jpeg(*segments):
+	return b'\xff\xd8' + b''.join(segments) + b'\xff\xda'
+
+def jpeg_size(data, exifdata=None):
+	return mkgallery.jpeg_size( io.BytesIO(data), exifdata )
+
+def box(name, payload):
+	""" return MP4 box """
+	return struct.pack('>L4s', len(payload) + 8, name) + payload
+
+def tkhd(w, h, version=0):
+	""" return MP4 track header box """
+	return box( b'tkhd', struct.pack('>B3x', version) + b'\x00' * (version and 32 or 20) +
+			b'\x00' * 52 + struct.pack('>LL', w << 16, h << 16) )
+
+def mp4_size(data):
+	return mkgallery.mp4_size( io.BytesIO(data), 0, len(data) )
+
+def svg_size(text):
+	return mkgallery.svg_size( io.BytesIO(text.encode('utf-8')) )
+
+class TestJpeg(unittest.TestCase):
+
+	def test_baseline(self):
+		self.assertEqual( jpeg_size(jpeg(sof(640, 480))), [640, 480] )
+
+	def test_markers(self):
+		# progressive, extended and lossless frames
+		for marker in (0xc1, 0xc2, 0xc3, 0xc5, 0xc9, 0xca, 0xcf):
+			self.assertEqual( jpeg_size(jpeg(sof(64, 48, marker))), [64, 48] )
+		# Huffman and arithmetic coding tables are not frames
+		tables = segment(0xc4, b'\x00' * 17) + segment(0xcc, b'\x00\x00')
+		self.assertEqual( jpeg_size(jpeg(tables, sof(64, 48, 0xc2))), [64, 48] )
+		# APP0, comment, fill bytes and markers without segment
+		data = jpeg( segment(0xe0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'),
+				segment(0xfe, b'comment \xff\xc0'), b'\xff\xff\xff\x01\xff\xd0', sof(64, 48) )
+		self.assertEqual( jpeg_size(data), [64, 48] )
+
+	def test_orientation(self):
+		for order in ('<', '>'):
+			for orientation in range(1, 9):
+				size = jpeg_size( jpeg(exif(orientation, order), sof(640, 480)) )
+				self.assertEqual( size, orientation >= 5 and [480, 640] or [640, 480] )
+
+	def test_invalid_orientation(self):
+		for segments in ( (exif(),), (exif(9),), (exif(6, typ=4),),
+				(segment(0xe1, b'Exif\x00\x00II*\x00'),),
+				(segment(0xe1, b'http://ns.adobe.com/xap/1.0/\x00'),) ):
+			self.assertEqual( jpeg_size(jpeg(*(segments + (sof(640, 480),)))), [640, 480] )
+
+	def test_exif(self):
+		data = []
+		self.assertEqual( jpeg_size(jpeg(exif(6), sof(640, 480)), data), [480, 640] )
+		self.assertEqual( len(data), 1 )
+		self.assertTrue( data[0].startswith(b'Exif\x00\x00') )
+
+	def test_no_frame(self):
+		self.assertEqual( jpeg_size(jpeg()), None )
+		self.assertEqual( jpeg_size(b'\xff\xd8\xff\xd9' + sof(64, 48)), None )
+		self.assertEqual( jpeg_size(b'\xff\xd8'), None )
+
+	def test_truncated(self):
+		data = jpeg( exif(6), sof(640, 480) )
+		for n in range(3, data.index(b'\xff\xc0') + 6):
+			try:
+				size = jpeg_size(data[:n])
+			except (struct.error, ValueError, IndexError):
+				continue
+			self.assertEqual(size, None)
+
+class TestMp4(unittest.TestCase):
+
+	def test_video(self):
+		data = box(b'ftyp', b'isom\x00\x00\x02\x00') + \
+				box( b'moov', box(b'mvhd', b'\x00' * 100) + box(b'trak', tkhd(1920, 1080)) )
+		self.assertEqual( mp4_size(data), [1920, 1080] )
+
+	def test_audio_track(self):
+		data = box( b'moov', box(b'trak', tkhd(0, 0)) + box(b'trak', tkhd(640, 360, 1)) )
+		self.assertEqual( mp4_size(data), [640, 360] )
+		self.assertEqual( mp4_size( box(b'moov', box(b'trak', tkhd(0, 0))) ), None )
+
+	def test_large_size(self):
+		moov = box( b'trak', tkhd(320, 240) )
+		data = struct.pack('>L4sQ', 1, b'moov', len(moov) + 16) + moov
+		self.assertEqual( mp4_size(data), [320, 240] )
+		# size 0 -- box extends to end of file
+		data = struct.pack('>L4s', 0, b'moov') + moov
+		self.assertEqual( mp4_size(data), [320, 240] )
+
+	def test_malformed(self):
+		self.assertEqual( mp4_size(b''), None )
+		self.assertEqual( mp4_size( struct.pack('>L4s', 4, b'moov') + b'\x00' * 8 ), None )
+		data = box( b'moov', box(b'trak', tkhd(320, 240)) )
+		for n in range(len(data) - 1):
+			try:
+				size = mp4_size(data[:n])
+			except (struct.error, ValueError, TypeError):
+				continue
+			self.assertEqual(size, None)
+
+class TestSvg(unittest.TestCase):
+
+	def test_size(self):
+		self.assertEqual( svg_size('<svg width="640" height="480"/>'), [640, 480] )
+		self.assertEqual( svg_size('<?xml version="1.0"?>\n<svg\n width = \'64.5px\' height="48px">'), [64, 48] )
+
+	def test_view_box(self):
+		self.assertEqual( svg_size('<svg viewBox="0 0 100 50">'), [100, 50] )
+		self.assertEqual( svg_size('<svg viewBox="0,0,100.5,50">'), [100, 50] )
+		# units other than pixels
+		self.assertEqual( svg_size('<svg width="10cm" height="5cm" viewBox="0 0 100 50">'), [100, 50] )
+
+	def test_unknown(self):
+		self.assertEqual( svg_size('<svg width="100%" height="100%">'), None )
+		self.assertEqual( svg_size('<svg viewBox="0 0 100">'), None )
+		self.assertEqual( svg_size('<html><body></body></html>'), None )
+		self.assertEqual( svg_size('<svg width="640" height="480"'), None )
+
+class TestProbe(unittest.TestCase):
+	""" probe_job() reads size of files and returns None for unknown or broken files """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def probe(self, name, data):
+		path = os.path.join(self.tmp, name)
+		f = open(path, "wb")
+		f.write(data)
+		f.close()
+		return mkgallery.probe_job(path)
+
+	def test_formats(self):
+		png = b'\x89PNG\r\n\x1a\n' + struct.pack('>L4sLL', 13, b'IHDR', 300, 200) + b'\x08\x02\x00\x00\x00'
+		self.assertEqual( self.probe("a.png", png), [300, 200] )
+		self.assertEqual( self.probe("a.gif", b'GIF89a' + struct.pack('<HH', 30, 20) + b'\x00' * 20), [30, 20] )
+		self.assertEqual( self.probe("a.jpg", jpeg(exif(8, '>'), sof(300, 200, 0xc2))), [200, 300] )
+		self.assertEqual( self.probe("a.mp4", box(b'ftyp', b'isom') + box(b'moov', box(b'trak', tkhd(32, 24)))), [32, 24] )
+		self.assertEqual( self.probe("a.svg", b'<svg width="10" height="20"/>'), [10, 20] )
+
+	def test_broken(self):
+		self.assertEqual( self.probe("a.png", b'\x89PNG\r\n\x1a\n'), None )
+		self.assertEqual( self.probe("a.jpg", jpeg(exif(6), sof(300, 200))[:30]), None )
+		self.assertEqual( self.probe("a.mp4", box(b'ftyp', b'isom') + b'\x00\x00\x01\x00moov'), None )
+		self.assertEqual( self.probe("a.txt", b'text'), None )
+		self.assertEqual( self.probe("a.jpg", b''), None )
+		self.assertEqual( mkgallery.probe_job( os.path.join(self.tmp, "missing.jpg") ), None )
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,126 @@
+"""
+tests of search index (see --search-index)
+"""
+
+import os, sys, re, json, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import mkgallery
+
+def find_node():
+	for path in os.environ.get("PATH", "").split(os.pathsep):
+		for name in ("node", "nodejs"):
+			node = os.path.join(path, name)
+			if os.path.isfile(node) and os.access(node, os.X_OK):
+				return node
+	return None
+
+node = find_node()
+
+def viewer_script(*names):
+	""" return functions and classes with given names from gallery.js """
+	f = open( os.path.join(root, "files", "gallery.js"), "rb" )
+	try:
+		js = f.read().decode("utf-8")
+	finally:
+		f.close()
+	code = []
+	for name in names:
+		m = re.search( r'^function %s\b.*?^}//}}}$' % name, js, re.S | re.M ) or \
+			re.search( r'^var %s = .*?^}\);$' % name, js, re.S | re.M )
+		code.append( m.group(0) )
+	return "\n".join(code)
+
+@unittest.skipIf(node is None, "needs node.js")
+class TestSearchIndex(unittest.TestCase):
+	""" index decoded in gallery gives numbers of items written in index """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.gdir = mkgallery.gdir
+		mkgallery.gdir = self.tmp
+
+	def tearDown(self):
+		mkgallery.gdir = self.gdir
+		shutil.rmtree(self.tmp)
+
+	def decode(self, words, queries):
+		""" return result of SearchIndex.lookup() for words and find() for queries """
+		script = viewer_script("newClass", "Class", "SearchIndex") + """
+var search;
+function searchIndex (data) { search = new SearchIndex(data); }
+%s
+var words = %s, queries = %s, res = {lookup: {}, find: {}}, i;
+for(i=0; i<words.length; i+=1) { res.lookup[words[i]] = search.lookup(words[i]); }
+for(i=0; i<queries.length; i+=1) { res.find[queries[i]] = search.find(queries[i]); }
+console.log(JSON.stringify(res));
+"""
+		f = open( os.path.join(self.tmp, "search-index.js"), "rb" )
+		try:
+			index = f.read().decode("utf-8")
+		finally:
+			f.close()
+		script = script % ( index, json.dumps(words), json.dumps(queries) )
+		p = subprocess.Popen( [node], stdin=subprocess.PIPE, stdout=subprocess.PIPE )
+		out = p.communicate( script.encode("utf-8") )[0]
+		self.assertEqual(p.returncode, 0)
+		return json.loads( out.decode("utf-8") )
+
+	def test_decode(self):
+		items = [
+			["beach/sun_01.jpg", {}],
+			["beach/sun_02.jpg", {'.alias': "Sunset <b>at</b> beach"}],
+			[""],
+			["city/night.jpg", {}],
+			["items/fonts/Sans.ttf", {'.link': "items/fonts/Sans.ttf"}],
+			[""],
+			["city/sun.mp4", {'.alias': "don't"}],
+			["beach/sun_10.jpg", {'.date': "2012-05-07 10:00:00"}],
+			]
+		# more numbers than in other lists (lookup with binary search)
+		items.extend( [["many/img%d.jpg" % i, {}] for i in range(40)] )
+		self.assertEqual( mkgallery.write_search_index(items), len(items) - 2 )
+
+		expected = {}
+		n = 0
+		for item in items:
+			if item[0]:
+				n = n + 1
+				for term in mkgallery.search_terms(item):
+					expected.setdefault(term, []).append(n)
+		self.assertIn("sunset", expected)
+		self.assertIn("201205", expected)
+		self.assertNotIn("items", expected)
+
+		words = sorted(expected)
+		queries = ["sun", "beach sun", "SUN jpg", "sun-01", "image beach", "beach many",
+				"don't", "sans font", "?!", "nothing"]
+		res = self.decode(words, queries)
+
+		def lookup(word):
+			# items with words starting with given word
+			numbers = set()
+			for term in words:
+				if term.startswith(word):
+					numbers.update(expected[term])
+			return sorted(numbers)
+
+		def find(query):
+			# items containing all words in query
+			found = None
+			for word in re.split(r'[\W_]+', query.lower()):
+				if word:
+					numbers = set( lookup(word) )
+					found = numbers if found is None else found & numbers
+			return None if found is None else sorted(found)
+
+		for word in words:
+			self.assertEqual( res['lookup'][word], lookup(word), word )
+		self.assertEqual( lookup("sun"), [1, 2, 5, 6] )
+		self.assertEqual( find("beach sun"), [1, 2, 6] )
+		for query in queries:
+			self.assertEqual( res['find'][query], find(query), query )
+
+if __name__ == "__main__":
+	unittest.main()
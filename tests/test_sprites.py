@@ -0,0 +1,75 @@
+"""
+tests of sprite sheets (see --sprites)
+"""
+
+import os, sys, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_update import read_items
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+@unittest.skipIf(Image is None, "needs Python Imaging Library (PIL)")
+class TestSprites(unittest.TestCase):
+	""" positions of thumbnails in items.js match sprite sheets """
+
+	sizes = [(400, 200), (200, 400), (300, 300), (50, 20), (120, 90), (90, 300), (1000, 10)]
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		self.gdir = os.path.join(self.tmp, "gallery")
+		for i, size in enumerate(self.sizes):
+			im = Image.new("RGB", size, (30*i, 255 - 30*i, 100))
+			# corner marks position of thumbnail
+			im.paste( (255, 255, 255), (0, 0, size[0]//4 + 1, size[1]//4 + 1) )
+			im.save( os.path.join(self.input, "%d.png" % i) )
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def build(self, *args):
+		p = subprocess.Popen( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=none", "-f",
+			"-d", self.gdir, "--sprites"] + list(args) + [self.input], stdout=subprocess.PIPE )
+		out = p.communicate()[0].decode("utf-8")
+		self.assertEqual(p.returncode, 0)
+		return read_items(self.gdir), out
+
+	def test_sheets(self):
+		items, out = self.build("-r", "100")
+		self.assertEqual( len(items), len(self.sizes) )
+
+		thumbs = os.path.join(self.gdir, "thumbs", "items", self.input.lstrip(os.sep))
+		areas = {}
+		for name, props in items.items():
+			sheet, x, y = props['.sprite']
+			w, h = props['.thumbnail_size']
+			self.assertTrue( sheet.startswith("thumbs/sprites/page-1-") )
+			im = Image.open( os.path.join(self.gdir, *sheet.split("/")) ).convert("RGB")
+			self.assertTrue( x >= 0 and y >= 0 and x + w <= im.size[0] and y + h <= im.size[1] )
+
+			# thumbnails don't overlap
+			for x2, y2, w2, h2 in areas.get(sheet, []):
+				self.assertTrue( x + w <= x2 or x2 + w2 <= x or y + h <= y2 or y2 + h2 <= y )
+			areas.setdefault(sheet, []).append( (x, y, w, h) )
+
+			thumb = Image.open( os.path.join(thumbs, name + ".png") ).convert("RGB")
+			self.assertEqual( thumb.size, (w, h) )
+			self.assertEqual( im.crop((x, y, x + w, y + h)).tobytes(), thumb.tobytes() )
+
+	def test_more_resolutions(self):
+		items, out = self.build("-r", "100,200")
+		self.assertIn("WARNING: Sprite sheets not created", out)
+		for props in items.values():
+			self.assertNotIn(".sprite", props)
+		self.assertEqual(items["0.png"][".thumbnail_resolutions"], [200])
+		self.assertFalse( os.path.exists(os.path.join(self.gdir, "thumbs", "sprites")) )
+
+if __name__ == "__main__":
+	unittest.main()
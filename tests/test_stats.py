@@ -0,0 +1,103 @@
+"""
+tests of build statistics (see --stats)
+"""
+
+import os, sys, json, shutil, subprocess, tempfile, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import mkgallery
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+@unittest.skipIf(Image is None, "needs Python Imaging Library (PIL)")
+class TestStats(unittest.TestCase):
+	""" CPU time of thumbnails created in worker processes is accounted """
+	images = 16
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		for i in range(self.images):
+			im = Image.effect_noise( (1600, 1200), 64 + i ).convert("RGB")
+			im.save( os.path.join(self.input, "image%02d.jpg" % i), quality=95 )
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def thumbnails_cpu(self, stats_file):
+		f = open(stats_file)
+		try:
+			st = json.load(f)['phases']['thumbnails']
+		finally:
+			f.close()
+		self.assertEqual(st['items'], self.images)
+		return st['cpu']
+
+	def build(self, jobs):
+		""" build gallery in new process, return CPU time of thumbnails phase """
+		gdir = os.path.join(self.tmp, "gallery%d" % jobs)
+		stats_file = os.path.join(self.tmp, "stats%d.json" % jobs)
+		subprocess.check_call( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-j", str(jobs), "-r", "200", "-u", "", "--cache=", "--template=" + root,
+			"--progress=none", "--stats-file=" + stats_file, "-d", gdir, self.input],
+			stdout=open(os.devnull, "w") )
+		return self.thumbnails_cpu(stats_file)
+
+	def test_jobs(self):
+		serial = self.build(1)
+		parallel = self.build(2)
+		self.assertGreater(serial, 0.1)
+		self.assertGreater(parallel, serial/2)
+
+	def test_kept_pool(self):
+		serial = self.build(1)
+		stats_file = os.path.join(self.tmp, "stats.json")
+		builder = mkgallery.GalleryBuilder(resolution=200, jobs=2, cachedir="",
+				d=root, progress_mode="none", stats=True, stats_file=stats_file)
+		try:
+			builder.build( [[self.input]], gdir=os.path.join(self.tmp, "gallery") )
+		finally:
+			builder.close()
+		self.assertGreater(self.thumbnails_cpu(stats_file), serial/2)
+
+class TestProgress(unittest.TestCase):
+	""" standard output contains only JSON events with --progress=json """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		for name in ("a.html", "b.html"):
+			f = open( os.path.join(self.input, name), "w" )
+			f.write("<html></html>")
+			f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_json(self):
+		gdir = os.path.join(self.tmp, "gallery")
+		# update of new gallery and statistics print messages
+		p = subprocess.Popen( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=json", "--stats",
+			"-U", "-d", gdir, self.input], stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+		out, err = p.communicate()
+		self.assertEqual(p.returncode, 0)
+
+		events = [json.loads(line) for line in out.decode("utf-8").splitlines()]
+		self.assertEqual( events[0]['event'], "phase_start" )
+		self.assertEqual( events[-1], {'event': "done", 'gallery': gdir, 'time': events[-1]['time']} )
+		self.assertIn( "manifest", [e['phase'] for e in events if e['event'] == "phase_end"] )
+
+		err = err.decode("utf-8")
+		self.assertIn("WARNING: No build manifest", err)
+		self.assertIn("Build statistics:", err)
+		self.assertIn("New gallery was created in:", err)
+
+if __name__ == "__main__":
+	unittest.main()
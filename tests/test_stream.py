@@ -0,0 +1,70 @@
+"""
+tests of item lists which don't fit in memory (see --item-memory)
+"""
+
+import os, sys, random, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+import mkgallery
+
+class TestItemStream(unittest.TestCase):
+	""" items moved to temporary files are read in same order as items in memory """
+
+	def setUp(self):
+		self.item_memory = mkgallery.item_memory
+		# about 2000 items fit in memory
+		mkgallery.item_memory = 1
+		rnd = random.Random(1)
+		# many items have same name, order of names is natural (e.g. "img9" < "img10")
+		self.items = [ ["dir%d/img%d.jpg" % (rnd.randint(0, 2), rnd.randint(0, 300)), {'n': i}]
+				for i in range(9000) ]
+
+	def tearDown(self):
+		mkgallery.item_memory = self.item_memory
+
+	def test_stream(self):
+		stream = mkgallery.ItemStream(self.items[:5000])
+		self.assertTrue(stream.file)
+		stream.extend(self.items[5000:])
+		try:
+			self.assertEqual( len(stream), len(self.items) )
+			self.assertEqual( list(stream), self.items )
+			# items can be appended after iterating
+			stream.append(["last"])
+			self.assertEqual( list(stream), self.items + [["last"]] )
+		finally:
+			stream.close()
+
+	def test_sorter(self):
+		sorter = mkgallery.ItemSorter(self.items)
+		try:
+			self.assertGreater( len(sorter.runs), 2 )
+			expected = sorted( self.items, key=lambda x: mkgallery.natsort_key(x[0]) )
+			self.assertEqual( list(sorter), expected )
+			numbers = [int(x[0][8:-4]) for x in expected if x[0].startswith("dir0/")]
+			self.assertEqual( numbers, sorted(numbers) )
+		finally:
+			sorter.close()
+
+	def test_sorter_in_memory(self):
+		mkgallery.item_memory = 0
+		sorter = mkgallery.ItemSorter(self.items)
+		try:
+			self.assertEqual( sorter.runs, [] )
+			self.assertEqual( list(sorter),
+					sorted(self.items, key=lambda x: mkgallery.natsort_key(x[0])) )
+		finally:
+			sorter.close()
+
+	def test_stable(self):
+		# equal names keep order in which they were added across all runs
+		sorter = mkgallery.ItemSorter( ["same.jpg", {'n': i}] for i in range(6000) )
+		try:
+			self.assertGreater( len(sorter.runs), 1 )
+			self.assertEqual( [x[1]['n'] for x in sorter], list(range(6000)) )
+		finally:
+			sorter.close()
+
+if __name__ == "__main__":
+	unittest.main()
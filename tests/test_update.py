@@ -0,0 +1,102 @@
+"""
+tests of incremental gallery update (see --update)
+"""
+
+import os, sys, json, shutil, subprocess, tempfile, time, unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+	from PIL import Image
+except ImportError:
+	Image = None
+
+def read_items(gdir):
+	""" return items from "items.js" as {filename: properties} """
+	f = open( os.path.join(gdir, "items.js") )
+	try:
+		text = f.read()
+	finally:
+		f.close()
+	start = text.index("JSON.parse('") + len("JSON.parse('")
+	data = json.loads( text[start:text.rindex("')")].replace("\\'", "'").replace("\\\\", "\\") )
+	return dict( (item[1], item[2] if len(item) > 2 else {}) for item in data['items'] if item )
+
+@unittest.skipIf(Image is None, "needs Python Imaging Library (PIL)")
+class TestUpdate(unittest.TestCase):
+	""" update adds, removes and changes items and rebuilds gallery if options changed """
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.input = os.path.join(self.tmp, "input")
+		os.mkdir(self.input)
+		self.gdir = os.path.join(self.tmp, "gallery")
+		self.image("a.png", (400, 200))
+		self.image("b.png", (200, 400))
+		self.page("c.html")
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def image(self, name, size):
+		path = os.path.join(self.input, name)
+		Image.new("RGB", size, (10, 200, 30)).save(path)
+		# modification time must change even on file systems with low resolution
+		t = time.time() + len(os.listdir(self.input))
+		os.utime(path, (t, t))
+
+	def page(self, name):
+		f = open( os.path.join(self.input, name), "w" )
+		f.write("<html></html>")
+		f.close()
+
+	def build(self, *args):
+		""" build gallery, return exit status and items """
+		res = subprocess.call( [sys.executable, os.path.join(root, "mkgallery.py"),
+			"-u", "", "--cache=", "--template=" + root, "--progress=none",
+			"-d", self.gdir] + list(args) + [self.input], stdout=open(os.devnull, "w") )
+		return res, res == 0 and read_items(self.gdir) or {}
+
+	def test_update(self):
+		res, items = self.build("-r", "100")
+		self.assertEqual(res, 0)
+		self.assertEqual( sorted(items), ["a.png", "b.png", "c.html"] )
+		self.assertEqual(items["a.png"][".thumbnail_size"], [100, 50])
+
+		os.remove( os.path.join(self.input, "b.png") )
+		self.image("a.png", (100, 400))
+		self.image("d.png", (300, 300))
+		res, items = self.build("-r", "100", "-U")
+		self.assertEqual(res, 0)
+		self.assertEqual( sorted(items), ["a.png", "c.html", "d.png"] )
+		self.assertEqual(items["a.png"][".thumbnail_size"], [25, 100])
+		self.assertEqual(items["d.png"][".thumbnail_size"], [100, 100])
+		thumbs = os.path.join(self.gdir, "thumbs", "items", self.input.lstrip(os.sep))
+		self.assertEqual( sorted(os.listdir(thumbs)), ["a.png.png", "d.png.png"] )
+
+		# unchanged gallery
+		res, items2 = self.build("-r", "100", "-U")
+		self.assertEqual(res, 0)
+		self.assertEqual(items2, items)
+
+	def test_options_changed(self):
+		res, items = self.build("-r", "100")
+		self.assertEqual(res, 0)
+
+		# gallery is rebuilt without --force
+		res, items = self.build("-r", "50", "-U")
+		self.assertEqual(res, 0)
+		self.assertEqual( sorted(items), ["a.png", "b.png", "c.html"] )
+		self.assertEqual(items["a.png"][".thumbnail_size"], [50, 25])
+
+	def test_foreign_gallery(self):
+		# files in gallery without manifest are removed only with --force
+		os.makedirs( os.path.join(self.gdir, "thumbs") )
+		res, items = self.build("-U")
+		self.assertNotEqual(res, 0)
+		res, items = self.build("-U", "-f")
+		self.assertEqual(res, 0)
+		self.assertEqual( sorted(items), ["a.png", "b.png", "c.html"] )
+
+if __name__ == "__main__":
+	unittest.main()